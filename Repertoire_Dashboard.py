@@ -1,31 +1,57 @@
+import os
+import tempfile
 import numpy
 import pandas
 
-from bokeh.io import save, show, output_file
-from bokeh.layouts import layout
+from bokeh.document import Document
+from bokeh.embed import file_html
+from bokeh.resources import Resources, CDN, INLINE
+from bokeh.util.browser import view
+from bokeh.layouts import layout, row, column
 
-from scripts.Diversity import Diversity_Plot
+from scripts.Diversity import Diversity_Plot, Clone_Size_Distribution_Plot, Rarefaction_Extrapolation_Plot
 from scripts.Cyrcos import Cyrcos_Repertoire_Comparison_Plot
 from scripts.UpSet import Repertoire_Upset_Plot
 from scripts.Mosaic import Mosaic_Plot
 from scripts.Gene_Plots import VJ_Gene_Plot, Burtin_VGene_SHM_Plot
-from scripts.Clone_Stats import Violin_SHM_Plot, CDR_Length_Histogram_Plot
-from scripts.Gene_Colors import vgene_colors, vfamily_colors, jgene_colors, isotype_colors
+from scripts.Clone_Stats import Violin_SHM_Plot, CDR_Length_Histogram_Plot, SHM_Density_Plot, SHM_Hexbin_Table
+from scripts.Clone_Stats import CDR3_Composition_Plot, CDR3_Property_Profile_Plot
+from scripts.Gene_Colors import vgene_colors, vfamily_colors, jgene_colors, isotype_colors, Used_Gene_Colors
+from scripts.Dashboard_Cache import Dashboard_Section_Cache
+from scripts.Lazy_Layout import Lazy_Tabs, Write_Static_Site
+from scripts.Abundance_Matrix import Clone_Abundance_Matrix
+from scripts.Similarity import Similarity_Heatmap_Plot
+from scripts.CDR3_Network import CDR3_Network_Plot
+from scripts.CDR3_Matrix import CDR3_Length_Matrices
+from scripts.Clone_Store import Clone_Store
+from scripts.Normalization import Rarefy_Repertoires
+from scripts.Repertoire_Data import Combine_Sample_DataFrames, Normalize_Gene_Columns, Recode_Categories, Gene_Family
+from scripts.Repertoire_Data import Ranked_Clone_Index, Strip_Allele
+from scripts.Clone_Details import Clone_Detail_Index, Clone_Detail_Panel
 
 def Repertoire_Dashboard(clone_dfs, filename = None, title = "Repertoire Analysis Dashboard", plot_title_prefix = "",
 						 mosaic_top_clones = 5000, cyrcos_top_clones = 1000, upset_highlighted_sets = None,
 						 clone_col = "CloneID", vgene_col = "VGene", jgene_col = "JGene", isotype_col = "Isotype",
 						 count_col = "Clustered", vshm_col = "V_SHM", jshm_col = "J_SHM", cdr_col = "CDR3_AA",
-						 sample_col = None, sizing_mode = "scale_width", show_plots = True, bokeh_resources = "cdn"):
+						 sample_col = None, sizing_mode = "scale_width", show_plots = True, bokeh_resources = "cdn",
+						 cache_dir = None, strip_alleles = True, raster_plots = False, sample_layout = "grid",
+						 lazy_panel_dir = None, similarity_metric = "morisita-horn", cdr3_network_distance = None,
+						 cdr3_network_metric = "hamming", samples = None, rarefy_depth = None, rarefy_seed = 0,
+						 diversity_estimates = False, clone_details = False, site_dir = None, doc = None,
+						 return_html = False, facet_col = None):
 	"""Creates an interactive dashboard HTML page displaying all the comparative visualizations.
 
+	Every call builds its dashboard in its own Document and writes it explicitly, without Bokeh's global output state
+	(output_file, curdoc), so dashboards can be built concurrently on the threads of one process.
+
 	Parameters
 	----------
-	clone_dfs: pandas DataFrame or dict of {str: DataFrame}
-		Input repertoire(s) with sample names; input should be formatted as a dict of sample name: DataFrame or a single
-		concatenated pandas DataFrame with a column sample_col specifying the samples of origin
+	clone_dfs: pandas DataFrame, dict of {str: DataFrame} or Clone_Store
+		Input repertoire(s) with sample names; input should be formatted as a dict of sample name: DataFrame, a single
+		concatenated pandas DataFrame with a column sample_col specifying the samples of origin, or an on-disk
+		Clone_Store (of which only the selected samples' rows are read)
 	filename: str or None
-		Name for the saved output HTML file, or None if user wishes to save manually; default is None
+		Name for the saved output HTML file, or None to only return the dashboard; default is None
 	title: str
 		Page title for the output HTML file; default is "Repertoire Analysis Dashboard"
 	plot_title_prefix: str
@@ -57,122 +83,428 @@ def Repertoire_Dashboard(clone_dfs, filename = None, title = "Repertoire Analysi
 	sizing_mode: str
 		How to scale the plots in the dashboard layout (see Bokeh layout function); default is "scale_width"
 	show_plots: bool
-		Whether the dashboard page will be immediately shown upon creation; default is True
+		Whether the dashboard page will be opened in a browser upon creation (from filename, or a temporary file if
+		filename is None); default is True
 	bokeh_resources: str
-		BokehJS resource location used for the dashboard (see Bokeh output_file documentation); default is "cdn"
+		BokehJS resource location used for the dashboard (see Bokeh Resources documentation); default is "cdn"
 		"cdn" gets the required files from the Bokeh CDN (requires internet connection)
 		"inline" adds all necessary stylesheets and scripts to the HTML page itself
+	cache_dir: str or None
+		Directory for caching the serialized dashboard sections between runs, or None to disable caching; sections
+		(and per-sample Mosaic and V-J gene plots) are only rebuilt when their input columns, parameters or code
+		change; default is None
+	strip_alleles: bool
+		Whether to remove allele suffixes from the V/J gene names (for example "IGHV1-69*01" to "IGHV1-69") so they
+		match the gene color tables; default is True
+	raster_plots: bool
+		Whether to draw the Mosaic tiles and Cyrcos links as server-side rendered images (with hover kept for the top
+		clones), which keeps very large repertoires responsive; default is False
+	sample_layout: str
+		How the per-sample Mosaic and V-J gene plots are arranged; default is "grid"
+		"grid" places the plots of all samples in two columns on the page
+		"tabs" places each sample's plots in its own tab, where only the first tab is laid out on page load and the
+		others are embedded when first opened (recommended for many samples)
+	lazy_panel_dir: str or None
+		With sample_layout "tabs", directory to write the deferred sample panels to as separate JSON documents which
+		are fetched when their tab is opened (the page must then be served over HTTP), or None to store them in the
+		page itself; default is None
+	similarity_metric: str
+		Pairwise sample similarity index shown in the clustered heatmap next to the UpSet plot; "jaccard", "sorensen",
+		"morisita-horn" or "cosine"; default is "morisita-horn"
+	cdr3_network_distance: int or None
+		Maximum CDR3 amino acid distance for linking clones in the CDR3 similarity network panel, or None to leave the
+		panel out; default is None
+	cdr3_network_metric: str
+		Distance used for the CDR3 similarity network; "hamming" or "levenshtein"; default is "hamming"
+	samples: list of str or None
+		Samples to include in the dashboard, or None for all samples of clone_dfs; default is None
+	rarefy_depth: int, str or None
+		Sequencing depth every sample's clone counts are subsampled to (without replacement) before all plots, "min"
+		for the smallest sample's total, or None to plot the counts as they are; samples with a smaller total are left
+		out; default is None
+	rarefy_seed: int
+		Seed of the subsampling, so rarefied dashboards are reproducible; default is 0
+	diversity_estimates: bool
+		Whether to add the estimated diversities including unseen clones (Chao1 and coverage-based Hill numbers) to the
+		diversity plot, and a panel of Hill number rarefaction / extrapolation curves; requires integer clone counts;
+		default is False
+	clone_details: bool
+		Whether to build the dashboard for a Bokeh server session (a script run with "bokeh serve"): the Mosaic tiles,
+		Cyrcos link ends and UpSet bars then carry only clone IDs, and tapping them shows the full records of their
+		clones (all columns, in every sample) in a details table at the bottom. Pass the session's document as doc (for
+		example doc = curdoc() in the served script); default is False
+	site_dir: str or None
+		Directory to write the dashboard to as a static site instead of one HTML file: a small index.html with every
+		dashboard row as a separate JSON document in site_dir/panels, embedded as it scrolls into view. With
+		bokeh_resources "inline" the BokehJS files are copied into site_dir/static, so the site works from a local file
+		server without internet access; default is None
+	doc: bokeh Document or None
+		Document to add the dashboard to (for example a Bokeh server session's document), or None for a new Document;
+		default is None
+	return_html: bool
+		Whether to return the standalone HTML page (as UTF-8 bytes) instead of the Document; default is False
+	facet_col: str or None
+		Header / name for a column to split every sample by (for example isotype_col), shown as small multiples in the
+		SHM, V gene SHM, diversity, CDR3 length and V-J gene plots, or None for whole samples; default is None
 
 	Returns
 	----------
-	dashboard: bokeh nested layout of Column and Row
-		The output dashboard Layout object representing the final plots and their placements
+	dashboard_doc: bokeh Document or bytes
+		The Document holding the dashboard layout (its only root added by this call), or its HTML page if return_html
 	"""
 
-	#Set up output file if user wants to save the dashboard page
-	if filename is not None:
-		output_file(filename = filename, title = title, mode = bokeh_resources)
-
 	repertoire_cols = [clone_col, vgene_col, jgene_col, isotype_col, count_col, vshm_col, jshm_col, cdr_col]
+	if facet_col is not None and facet_col not in repertoire_cols:
+		repertoire_cols.append(facet_col)
 
-	if isinstance(clone_dfs, dict):
+	if isinstance(clone_dfs, Clone_Store):
 		if sample_col is None:
-			sample_col = "Sample"
+			sample_col = clone_dfs.sample_col
 
-		dfs = []
-		for sample in clone_dfs:
-			clone_df = clone_dfs[sample][repertoire_cols]
-			clone_df[sample_col] = sample
-			dfs.append(clone_df)
+		comparison_df = clone_dfs.To_DataFrame(samples = samples, columns = repertoire_cols, sample_col = sample_col)
+
+	elif isinstance(clone_dfs, dict):
+		if sample_col is None:
+			sample_col = "Sample"
+		if samples is not None:
+			clone_dfs = {sample: clone_dfs[sample] for sample in samples}
 
-		comparison_df = pandas.concat(dfs, ignore_index = True)
+		comparison_df = Combine_Sample_DataFrames(clone_dfs, repertoire_cols, sample_col = sample_col)
 
 	elif isinstance(clone_dfs, pandas.DataFrame):
 		if sample_col is not None:
 			repertoire_cols.append(sample_col)
 			comparison_df = clone_dfs[repertoire_cols]
+			if samples is not None:
+				comparison_df = comparison_df[comparison_df[sample_col].isin(samples)]
+				if comparison_df[sample_col].dtype.name == "category":
+					sample_series = comparison_df[sample_col].cat.remove_unused_categories()
+					comparison_df = comparison_df.assign(**{sample_col: sample_series})
 		else:
 			raise KeyError("No sample-name column header was found in the repertoire DataFrame!")
 
+	#Convert the gene and isotype columns to categoricals once, so families and colors are derived per category
+	comparison_df = Normalize_Gene_Columns(comparison_df, gene_cols = [vgene_col, jgene_col], isotype_col = isotype_col,
+										   strip_alleles = strip_alleles)
+
+	#Compare samples at equal depth, as richness and overlap grow with the number of sequenced reads
+	if rarefy_depth is not None:
+		comparison_df = Rarefy_Repertoires(comparison_df, count_col = count_col, sample_col = sample_col,
+										   depth = None if rarefy_depth == "min" else rarefy_depth, seed = rarefy_seed)
+
+	#Genes missing from the color tables (light chain / TCR loci, novel genes) get distinguishable per-locus colors
+	#from all samples' genes, so they match in every plot; the shared color tables are left unchanged
+	vgenes = Recode_Categories(comparison_df[vgene_col], Strip_Allele)
+	dashboard_vgene_colors = vgene_colors.Extended(vgenes.cat.categories)
+	dashboard_vfamily_colors = vfamily_colors.Extended(Recode_Categories(vgenes, Gene_Family).cat.categories)
+	dashboard_jgene_colors = jgene_colors.Extended(Recode_Categories(comparison_df[jgene_col],
+																	 Strip_Allele).cat.categories)
+	dashboard_isotype_colors = isotype_colors.Extended(comparison_df[isotype_col].cat.categories)
+
+	#Sections are rebuilt only if their input columns, parameters or code changed since the last cached build
+	section_cache = Dashboard_Section_Cache(cache_dir)
+
+	#Section fingerprints include only the colors of the genes a section draws, not the whole color tables
+	def Section_Color_Params(params, df):
+		color_params = dict(params)
+		gene_color_cols = [("vgene_colors", vgene_col, Strip_Allele), ("vfamily_colors", vgene_col, Gene_Family),
+						   ("jgene_colors", jgene_col, Strip_Allele), ("isotype_colors", isotype_col, None)]
+		for color_param, gene_col, recode in gene_color_cols:
+			if color_param in params:
+				genes = df[gene_col] if recode is None else Recode_Categories(df[gene_col], recode)
+				color_params[color_param] = Used_Gene_Colors(params[color_param], genes)
+		return color_params
+
+	#With a facet column, the sample comparison plots show one small multiple panel per facet value
+	split_cols = sample_col if facet_col is None else [sample_col, facet_col]
+
+	#The sparse clone x sample abundance matrix is built on first use and shared by the overlap and diversity plots
+	abundance_matrices = []
+	def Abundance_Matrix():
+		if not abundance_matrices:
+			abundance_matrices.append(Clone_Abundance_Matrix.From_DataFrame(comparison_df, clone_col = clone_col,
+																			sample_col = sample_col,
+																			count_col = count_col))
+		return abundance_matrices[0]
+
 	#############################################
 	##    Paired V-J Gene Usage Donut Plots    ##
 	#############################################
 	vj_gene_plots = []
 	for sample, df in comparison_df.groupby([sample_col]):
 		plot_title = "{0} {1} Paired V-J Gene Usage".format(plot_title_prefix, sample)
-		vj_gene_plot = VJ_Gene_Plot(df, title = plot_title, vgene_col = vgene_col, jgene_col = jgene_col,
-									count_col = count_col, vgene_colors = vgene_colors, jgene_colors = jgene_colors,
-									vfamily_colors = vfamily_colors)
+		vj_gene_params = {"title": plot_title, "vgene_col": vgene_col, "jgene_col": jgene_col, "count_col": count_col,
+						  "vgene_colors": dashboard_vgene_colors, "jgene_colors": dashboard_jgene_colors,
+						  "vfamily_colors": dashboard_vfamily_colors,
+						  "split_col": facet_col}
+		vj_gene_plot = section_cache.Get_Section("VJ_Gene_{0}".format(sample),
+												 lambda df = df, params = vj_gene_params: VJ_Gene_Plot(df, **params),
+												 clone_df = df, data_cols = [vgene_col, jgene_col, count_col, facet_col],
+												 params = Section_Color_Params(vj_gene_params, df), code = VJ_Gene_Plot)
 		vj_gene_plots.append(vj_gene_plot)
 
 	#############################################
 	##        V/J Gene SHMs Violin Plot        ##
 	#############################################
-	vj_shm_plot = Violin_SHM_Plot(comparison_df, title = plot_title_prefix + " Gene SHM Levels", vshm_col = vshm_col,
-								  jshm_col = jshm_col, split_col = sample_col)
+	vj_shm_params = {"title": plot_title_prefix + " Gene SHM Levels", "vshm_col": vshm_col, "jshm_col": jshm_col,
+					 "split_col": split_cols}
+	vj_shm_plot = section_cache.Get_Section("VJ_SHM", lambda: Violin_SHM_Plot(comparison_df, **vj_shm_params),
+											clone_df = comparison_df,
+											data_cols = [vshm_col, jshm_col, sample_col, facet_col],
+											params = vj_shm_params, code = Violin_SHM_Plot)
+
+	#############################################
+	##     V vs J Gene SHM Hexbin Density      ##
+	#############################################
+	shm_density_params = {"title": plot_title_prefix, "vshm_col": vshm_col, "jshm_col": jshm_col,
+						  "split_col": sample_col, "facet_col": facet_col, "count_col": count_col}
+	shm_density_plot = section_cache.Get_Section("SHM_Density",
+												 lambda: SHM_Density_Plot(comparison_df, **shm_density_params),
+												 clone_df = comparison_df,
+												 data_cols = [vshm_col, jshm_col, count_col, sample_col, facet_col],
+												 params = shm_density_params, code = [SHM_Density_Plot, SHM_Hexbin_Table])
 
 	#############################################
 	## Repertoire Clone Frequency Mosaic Plots ##
 	#############################################
 	mosaic_plots = []
-	for sample, df in comparison_df.groupby([sample_col]):
+	mosaic_cols = [clone_col, count_col, vgene_col, jgene_col, isotype_col, vshm_col, jshm_col]
+	#Each sample's clones are ranked once; the Mosaic plots (and their cache keys) only use the top clones' rows
+	ranked_clone_index = Ranked_Clone_Index(comparison_df, count_col = count_col, sample_col = sample_col)
+	for sample in ranked_clone_index.samples:
+		df = comparison_df.take(ranked_clone_index.Top_Rows(sample, mosaic_top_clones or None))
 		plot_title = "{0} {1} Clonotype Frequencies Mosaic".format(plot_title_prefix, sample)
-		mosaic_plot = Mosaic_Plot(df, title = plot_title, top_clones = mosaic_top_clones, vgene_col = vgene_col,
-								  jgene_col = jgene_col, isotype_col = isotype_col, count_col = count_col,
-								  vshm_col = vshm_col, jshm_col = jshm_col, vgene_colors = vgene_colors,
-								  jgene_colors = jgene_colors, vfamily_colors = vfamily_colors,
-								  isotype_colors = isotype_colors)
+		mosaic_params = {"title": plot_title, "top_clones": mosaic_top_clones, "vgene_col": vgene_col,
+						 "jgene_col": jgene_col, "isotype_col": isotype_col, "count_col": count_col,
+						 "vshm_col": vshm_col, "jshm_col": jshm_col, "vgene_colors": dashboard_vgene_colors,
+						 "jgene_colors": dashboard_jgene_colors, "vfamily_colors": dashboard_vfamily_colors,
+						 "isotype_colors": dashboard_isotype_colors, "raster": raster_plots, "clone_col": clone_col,
+						 "clone_details": clone_details}
+		mosaic_plot = section_cache.Get_Section("Mosaic_{0}".format(sample),
+												lambda df = df, params = mosaic_params: Mosaic_Plot(df, **params),
+												clone_df = df, data_cols = mosaic_cols,
+												params = Section_Color_Params(mosaic_params, df), code = Mosaic_Plot)
 		mosaic_plots.append(mosaic_plot)
 
 	#############################################
 	##      Clonal V Gene SHM Burtin Plot      ##
 	#############################################
-	clonal_vgene_shm_plot = Burtin_VGene_SHM_Plot(comparison_df, title = plot_title_prefix + " Clonal V Gene Mean SHM",
-												  vgene_col = vgene_col, vshm_col = vshm_col, split_col = sample_col,
-												  vfamily_colors = vfamily_colors)
+	vgene_shm_params = {"title": plot_title_prefix + " Clonal V Gene Mean SHM", "vgene_col": vgene_col,
+						"vshm_col": vshm_col, "split_col": split_cols,
+						"vfamily_colors": dashboard_vfamily_colors}
+	clonal_vgene_shm_plot = section_cache.Get_Section("VGene_SHM",
+													  lambda: Burtin_VGene_SHM_Plot(comparison_df, **vgene_shm_params),
+													  clone_df = comparison_df,
+													  data_cols = [vgene_col, vshm_col, sample_col, facet_col],
+													  params = Section_Color_Params(vgene_shm_params, comparison_df),
+													  code = Burtin_VGene_SHM_Plot)
 
 	#############################################
 	##        Repertoire Diversity Plot        ##
 	#############################################
-	diversity_plot = Diversity_Plot(comparison_df, title = plot_title_prefix + " Repertoire Diversity & Polarization",
-									count_col = count_col, split_col = sample_col)
+	diversity_params = {"title": plot_title_prefix + " Repertoire Diversity & Polarization", "count_col": count_col,
+						"split_col": split_cols, "richness_estimates": diversity_estimates}
+	#The sample abundance matrix columns are whole samples, so faceted diversities are split from the DataFrame
+	build_diversity_plot = lambda: Diversity_Plot(comparison_df,
+												  abundance_matrix = Abundance_Matrix() if facet_col is None else None,
+												  **diversity_params)
+	diversity_plot = section_cache.Get_Section("Diversity", build_diversity_plot, clone_df = comparison_df,
+											   data_cols = [clone_col, count_col, sample_col, facet_col],
+											   params = diversity_params, code = [Diversity_Plot, Clone_Abundance_Matrix])
+
+	if diversity_estimates:
+		rarefaction_params = {"title": plot_title_prefix + " Diversity Rarefaction & Extrapolation",
+							  "count_col": count_col, "split_col": sample_col}
+		build_rarefaction_plot = lambda: Rarefaction_Extrapolation_Plot(comparison_df,
+																		abundance_matrix = Abundance_Matrix(),
+																		**rarefaction_params)
+		rarefaction_plot = section_cache.Get_Section("Rarefaction", build_rarefaction_plot,
+													 clone_df = comparison_df,
+													 data_cols = [clone_col, count_col, sample_col],
+													 params = rarefaction_params,
+													 code = [Rarefaction_Extrapolation_Plot, Clone_Abundance_Matrix])
+
+	#############################################
+	##     Clone Size Distribution Plots       ##
+	#############################################
+	clone_size_params = {"title": plot_title_prefix + " Clone Size Distribution", "count_col": count_col,
+						 "split_col": sample_col}
+	build_clone_size_plot = lambda: Clone_Size_Distribution_Plot(comparison_df, abundance_matrix = Abundance_Matrix(),
+																 **clone_size_params)
+	clone_size_plot = section_cache.Get_Section("Clone_Size", build_clone_size_plot,
+												clone_df = comparison_df, data_cols = [clone_col, count_col, sample_col],
+												params = clone_size_params,
+												code = [Clone_Size_Distribution_Plot, Clone_Abundance_Matrix])
 
 	#############################################
 	##  CDR3 Amino Acid Length Histogram Plot  ##
 	#############################################
-	cdr_len_plot = CDR_Length_Histogram_Plot(comparison_df, title = plot_title_prefix + " CDR3 Length Spectratype",
-											 cdr_col = cdr_col, split_col = sample_col)
+	cdr_len_params = {"title": plot_title_prefix + " CDR3 Length Spectratype", "cdr_col": cdr_col,
+					  "split_col": split_cols}
+	cdr_len_plot = section_cache.Get_Section("CDR3_Length",
+											 lambda: CDR_Length_Histogram_Plot(comparison_df, **cdr_len_params),
+											 clone_df = comparison_df, data_cols = [cdr_col, sample_col, facet_col],
+											 params = cdr_len_params, code = CDR_Length_Histogram_Plot)
+
+	#############################################
+	##  CDR3 Composition & Property Profiles   ##
+	#############################################
+	#The CDR3s are packed into per-length uint8 matrices once for both panels
+	cdr3_matrices = []
+	def CDR3_Matrices():
+		if not cdr3_matrices:
+			cdr3_matrices.append(CDR3_Length_Matrices(comparison_df[cdr_col], comparison_df[sample_col]))
+		return cdr3_matrices[0]
+
+	cdr3_composition_params = {"title": plot_title_prefix + " CDR3 Positional Composition", "cdr_col": cdr_col,
+							   "split_col": sample_col}
+	build_cdr3_composition_plot = lambda: CDR3_Composition_Plot(comparison_df, cdr3_matrices = CDR3_Matrices(),
+																**cdr3_composition_params)
+	cdr3_composition_plot = section_cache.Get_Section("CDR3_Composition", build_cdr3_composition_plot,
+													  clone_df = comparison_df, data_cols = [cdr_col, sample_col],
+													  params = cdr3_composition_params,
+													  code = [CDR3_Composition_Plot, CDR3_Length_Matrices])
+
+	cdr3_property_params = {"title": plot_title_prefix + " CDR3 Hydrophobicity & Charge", "cdr_col": cdr_col,
+							"split_col": sample_col}
+	build_cdr3_property_plot = lambda: CDR3_Property_Profile_Plot(comparison_df, cdr3_matrices = CDR3_Matrices(),
+																  **cdr3_property_params)
+	cdr3_property_plot = section_cache.Get_Section("CDR3_Properties", build_cdr3_property_plot,
+												   clone_df = comparison_df, data_cols = [cdr_col, sample_col],
+												   params = cdr3_property_params,
+												   code = [CDR3_Property_Profile_Plot, CDR3_Length_Matrices])
 
 	#############################################
 	## Shared Repertoire Clonotypes UpSet Plot ##
 	#############################################
-	upset_plot = Repertoire_Upset_Plot(comparison_df, title = plot_title_prefix + " Shared Clone Set UpSet Plot",
-									   clone_col = clone_col, sample_col = sample_col,
-									   highlighted_sets = upset_highlighted_sets)
+	upset_params = {"title": plot_title_prefix + " Shared Clone Set UpSet Plot", "clone_col": clone_col,
+					"sample_col": sample_col, "highlighted_sets": upset_highlighted_sets, "clone_details": clone_details}
+	build_upset_plot = lambda: Repertoire_Upset_Plot(comparison_df, abundance_matrix = Abundance_Matrix(),
+													 **upset_params).plots_grid
+	upset_plot = section_cache.Get_Section("UpSet", build_upset_plot,
+										   clone_df = comparison_df, data_cols = [clone_col, sample_col],
+										   params = upset_params, code = [Repertoire_Upset_Plot, Clone_Abundance_Matrix])
+
+	#############################################
+	##   Pairwise Sample Similarity Heatmap    ##
+	#############################################
+	similarity_params = {"title": plot_title_prefix + " Pairwise Repertoire Similarity", "metric": similarity_metric,
+						 "clone_col": clone_col, "count_col": count_col, "split_col": sample_col}
+	build_similarity_plot = lambda: Similarity_Heatmap_Plot(comparison_df, abundance_matrix = Abundance_Matrix(),
+															**similarity_params)
+	similarity_plot = section_cache.Get_Section("Similarity", build_similarity_plot,
+												clone_df = comparison_df, data_cols = [clone_col, count_col, sample_col],
+												params = similarity_params,
+												code = [Similarity_Heatmap_Plot, Clone_Abundance_Matrix])
 
 	#############################################
 	## Shared Clone Rank/Frequency Circos Plot ##
 	#############################################
-	cyrcos_plot = Cyrcos_Repertoire_Comparison_Plot(comparison_df, title = " Shared Repertoire Clonal Frequency",
-													top_clones = cyrcos_top_clones, clone_col = clone_col,
-													count_col = count_col, sample_col = sample_col)
+	cyrcos_params = {"title": " Shared Repertoire Clonal Frequency", "top_clones": cyrcos_top_clones,
+					 "clone_col": clone_col, "count_col": count_col, "sample_col": sample_col,
+					 "raster_links": raster_plots, "clone_details": clone_details}
+	build_cyrcos_plot = lambda: Cyrcos_Repertoire_Comparison_Plot(comparison_df, abundance_matrix = Abundance_Matrix(),
+																  **cyrcos_params).plot
+	cyrcos_plot = section_cache.Get_Section("Cyrcos", build_cyrcos_plot,
+											clone_df = comparison_df, data_cols = [clone_col, count_col, sample_col],
+											params = cyrcos_params,
+											code = [Cyrcos_Repertoire_Comparison_Plot, Clone_Abundance_Matrix])
+
+	dashboard_layout = [[upset_plot, similarity_plot], [vj_shm_plot, clonal_vgene_shm_plot], [shm_density_plot],
+						[diversity_plot, clone_size_plot], [cdr_len_plot, cdr3_property_plot], [cdr3_composition_plot]]
+	if diversity_estimates:
+		dashboard_layout.insert(4, [rarefaction_plot])
+
+	if sample_layout == "tabs":
+		#One tab of Mosaic and V-J gene plots per sample, with the inactive tabs deferred until they are opened
+		samples = comparison_df[sample_col].drop_duplicates().sort_values().tolist()
+		sample_panels = [(str(sample), row(mosaic_plot, vj_gene_plot))
+						 for sample, mosaic_plot, vj_gene_plot in zip(samples, mosaic_plots, vj_gene_plots)]
+
+		#Static sites keep the deferred sample panels next to the dashboard row panels
+		if site_dir is not None and lazy_panel_dir is None:
+			lazy_panel_dir = os.path.join(site_dir, "panels")
+
+		lazy_panel_url = None
+		page_dir = site_dir if site_dir is not None else filename and os.path.dirname(os.path.abspath(filename))
+		if lazy_panel_dir is not None and page_dir is not None:
+			lazy_panel_url = os.path.relpath(lazy_panel_dir, os.path.abspath(page_dir))
+			lazy_panel_url = lazy_panel_url.replace(os.sep, "/")
+
+		dashboard_layout += [[Lazy_Tabs(sample_panels, json_dir = lazy_panel_dir, json_url = lazy_panel_url)]]
+
+	elif sample_layout == "grid":
+		#Arrange the mosaic and V-J gene plots into two columns
+		mosaic_plots = [list(plots) for plots in numpy.array_split(mosaic_plots, numpy.ceil(len(mosaic_plots) / 2))]
+		vj_gene_plots = [list(plots) for plots in numpy.array_split(vj_gene_plots, numpy.ceil(len(vj_gene_plots) / 2))]
+
+		dashboard_layout += mosaic_plots
+		dashboard_layout += vj_gene_plots
 
-	dashboard_layout = [[upset_plot.plots_grid], [vj_shm_plot, clonal_vgene_shm_plot], [cdr_len_plot, diversity_plot]]
+	else:
+		raise ValueError("sample_layout must be either \"grid\" or \"tabs\"!")
 
-	#Arrange the mosaic and V-J gene plots into two columns
-	mosaic_plots = [list(plots) for plots in numpy.array_split(mosaic_plots, numpy.ceil(len(mosaic_plots) / 2))]
-	vj_gene_plots = [list(plots) for plots in numpy.array_split(vj_gene_plots, numpy.ceil(len(vj_gene_plots) / 2))]
+	dashboard_layout += [[cyrcos_plot]]
 
-	dashboard_layout += mosaic_plots
-	dashboard_layout += vj_gene_plots
+	#############################################
+	##      CDR3 Similarity Network Plot       ##
+	#############################################
+	if cdr3_network_distance is not None:
+		cdr3_network_params = {"title": plot_title_prefix + " CDR3 Similarity Network",
+							   "max_distance": cdr3_network_distance, "metric": cdr3_network_metric,
+							   "cdr_col": cdr_col, "clone_col": clone_col, "count_col": count_col,
+							   "sample_col": sample_col}
+		cdr3_network_plot = section_cache.Get_Section("CDR3_Network",
+													  lambda: CDR3_Network_Plot(comparison_df, **cdr3_network_params),
+													  clone_df = comparison_df,
+													  data_cols = [clone_col, cdr_col, count_col, sample_col],
+													  params = cdr3_network_params, code = CDR3_Network_Plot)
+		dashboard_layout += [[cdr3_network_plot]]
 
-	dashboard_layout += [[cyrcos_plot.plot]]
-	dashboard = layout(children = dashboard_layout, sizing_mode = sizing_mode)
+	#############################################
+	##    Clone Details (Bokeh server only)    ##
+	#############################################
+	if clone_details:
+		clone_detail_panel = Clone_Detail_Panel(Clone_Detail_Index(comparison_df, clone_col = clone_col),
+												abundance_matrix = Abundance_Matrix())
+		dashboard_layout += [[clone_detail_panel.layout]]
 
-	if show_plots:
-		show(dashboard)
+	if site_dir is not None:
+		#Every dashboard row is its own panel document, loaded progressively by the index page
+		site_panels = [("Row_{0}".format(idx), layout(children = [panel_row], sizing_mode = sizing_mode))
+					   for idx, panel_row in enumerate(dashboard_layout)]
+		Write_Static_Site(site_panels, site_dir, title = title,
+						  resources = "cdn" if bokeh_resources == "cdn" else "inline")
+		dashboard = column(children = [panel for _, panel in site_panels], sizing_mode = sizing_mode)
 	else:
-		save(dashboard)
+		dashboard = layout(children = dashboard_layout, sizing_mode = sizing_mode)
+
+	if clone_details:
+		#The tap callbacks run in the server session serving doc
+		clone_detail_panel.Link_Layout(dashboard)
+
+	#The dashboard gets its own Document, so concurrent builds never share Bokeh's global output state
+	dashboard_doc = Document() if doc is None else doc
+	dashboard_doc.add_root(dashboard)
+	dashboard_doc.title = title
+
+	dashboard_html = None
+	if return_html or filename is not None or (show_plots and site_dir is None and not clone_details):
+		resources = {"cdn": CDN, "inline": INLINE}.get(bokeh_resources) or Resources(mode = bokeh_resources)
+		dashboard_html = file_html(dashboard_doc, resources, title = title).encode("utf-8")
+
+	if filename is not None:
+		with open(filename, "wb") as html_file:
+			html_file.write(dashboard_html)
+
+	if show_plots and site_dir is None and not clone_details:
+		if filename is None:
+			with tempfile.NamedTemporaryFile(suffix = ".html", delete = False) as html_file:
+				html_file.write(dashboard_html)
+				filename = html_file.name
+		view(os.path.abspath(filename))
+
+	return dashboard_html if return_html else dashboard_doc
 
 if __name__ == "__main__":
 	df = pandas.read_csv("data/Donor_Clones.txt", sep = "\t", usecols = ["CloneID", "Clustered", "VGene", "JGene", "Isotype", "V_SHM", "J_SHM", "CDR3_AA", "Sample"],
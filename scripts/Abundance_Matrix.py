@@ -0,0 +1,249 @@
+import json
+
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype
+from scipy import sparse
+
+from .Repertoire_Data import Sample_Set_Keys, Top_Clone_Order
+
+class Clone_Abundance_Matrix(object):
+	def __init__(self, matrix, clones, samples):
+		"""Creates a sparse clone x sample abundance matrix from a scipy sparse matrix and its row / column labels.
+
+		Parameters
+		----------
+		matrix: scipy sparse matrix
+			Clone counts with one row per clone and one column per sample
+		clones: iterable
+			Clone ID of each row
+		samples: iterable of str
+			Sample name of each column
+		"""
+
+		self.csr = sparse.csr_matrix(matrix)
+		self.csr.sum_duplicates()
+		self.csr.eliminate_zeros()
+		self.clones = pandas.Index(clones)
+		self.samples = list(samples)
+		self._csc = None
+		self._sample_ranks = {}
+
+	@classmethod
+	def From_DataFrame(cls, clone_dfs, clone_col = "CloneID", sample_col = "Sample", count_col = "Clustered"):
+		"""Builds the abundance matrix from repertoire DataFrame(s); counts of repeated clone / sample rows are summed.
+
+		Parameters
+		----------
+		clone_dfs: pandas DataFrame or dict of {str: DataFrame}
+			Input repertoire(s) as a dict of sample name: DataFrame or a single DataFrame with the column sample_col
+		clone_col: str
+			Header / name for the column containing the clone IDs; default is "CloneID"
+		sample_col: str
+			Header / name for the column containing the sample names (for a single DataFrame); default is "Sample"
+		count_col: str or None
+			Header / name for the column containing the clone counts or frequencies, or None to count every row as
+			one (membership only); default is "Clustered"
+
+		Returns
+		----------
+		abundance_matrix: Clone_Abundance_Matrix
+			The clone x sample abundance matrix; samples are in dict order or in sorted / category order
+		"""
+
+		if isinstance(clone_dfs, dict):
+			samples = list(clone_dfs)
+			clone_ids = pandas.concat([clone_dfs[sample][clone_col] for sample in samples], ignore_index = True)
+			if count_col is not None:
+				counts = numpy.concatenate([clone_dfs[sample][count_col].values for sample in samples])
+			else:
+				counts = numpy.ones(len(clone_ids), dtype = numpy.int64)
+			sample_codes = numpy.repeat(numpy.arange(len(samples)), [len(clone_dfs[sample]) for sample in samples])
+
+		else:
+			clone_ids = clone_dfs[clone_col]
+			counts = clone_dfs[count_col].values if count_col is not None else numpy.ones(len(clone_ids), numpy.int64)
+			if is_categorical_dtype(clone_dfs[sample_col]):
+				sample_series = clone_dfs[sample_col].cat.remove_unused_categories()
+				sample_codes, samples = sample_series.cat.codes.values, list(sample_series.cat.categories)
+			else:
+				sample_codes, samples = pandas.factorize(clone_dfs[sample_col], sort = True)
+				samples = list(samples)
+
+		#Rows are numbered by first appearance of each clone ID
+		clone_codes, clones = pandas.factorize(clone_ids)
+		matrix = sparse.coo_matrix((counts, (clone_codes, sample_codes)), shape = (len(clones), len(samples)))
+
+		return cls(matrix, clones, samples)
+
+	@property
+	def csc(self):
+		"""The matrix in CSC format (fast per-sample column access), converted once on first use."""
+
+		if self._csc is None:
+			self._csc = self.csr.tocsc()
+			self._csc.sort_indices()
+
+		return self._csc
+
+	def Sample_Index(self, sample):
+		"""Gets the column number of a sample."""
+
+		return self.samples.index(sample)
+
+	def Membership(self):
+		"""Gets the boolean clone x sample membership matrix (CSR)."""
+
+		return self.csr.astype(bool)
+
+	def Sample_Totals(self):
+		"""Gets the total count of every sample as a Series."""
+
+		return pandas.Series(numpy.asarray(self.csr.sum(axis = 0)).ravel(), index = self.samples)
+
+	def Sample_Clone_Counts(self):
+		"""Gets the number of clones in every sample as a Series."""
+
+		return pandas.Series(numpy.diff(self.csc.indptr), index = self.samples)
+
+	def Clone_Sample_Counts(self):
+		"""Gets the number of samples containing every clone as a Series."""
+
+		return pandas.Series(numpy.diff(self.csr.indptr), index = self.clones)
+
+	def Sample_Counts(self, sample):
+		"""Gets the clone counts of one sample (for its clones only, in clone row order) as a numpy array."""
+
+		col = self.Sample_Index(sample)
+		return self.csc.data[self.csc.indptr[col]:self.csc.indptr[col + 1]]
+
+	def Sample_Ranks(self, sample, top_clones = None):
+		"""Gets the clone rows of one sample ordered from its largest clone, so a row's position is the clone's rank.
+
+		Ties are broken by clone row order (the first appearance of each clone ID). Only the top clones are sorted, and
+		the ranking is kept, so later calls for the same or fewer top clones are slices.
+
+		Parameters
+		----------
+		sample: str
+			Name of the sample
+		top_clones: int or None
+			Number of largest clones to return, or None for all; default is None
+
+		Returns
+		----------
+		ranked_rows: numpy array of ints
+			Matrix rows of the sample's clones, from rank 0 (largest clone) onward
+		ranked_counts: numpy array
+			Counts of the ranked clones
+		"""
+
+		col = self.Sample_Index(sample)
+		rows = self.csc.indices[self.csc.indptr[col]:self.csc.indptr[col + 1]]
+		counts = self.csc.data[self.csc.indptr[col]:self.csc.indptr[col + 1]]
+
+		required_ranks = len(counts) if top_clones is None else min(top_clones, len(counts))
+		rank_order = self._sample_ranks.get(col)
+		if rank_order is None or len(rank_order) < required_ranks:
+			rank_order = Top_Clone_Order(counts, required_ranks)
+			self._sample_ranks[col] = rank_order
+		rank_order = rank_order[:required_ranks]
+
+		return rows[rank_order], counts[rank_order]
+
+	def Pairwise_Overlaps(self):
+		"""Gets the number of clones shared by every pair of samples (the diagonal is each sample's clone count)."""
+
+		membership = self.csc.astype(bool).astype(numpy.int64)
+		overlaps = (membership.T @ membership).toarray()
+
+		return pandas.DataFrame(overlaps, index = self.samples, columns = self.samples)
+
+	def Overlap_Counts(self, min_shared = 2, max_shared = None):
+		"""Gets the number of clones shared by each set of samples, as used by Repertoire_Upset_Plot.
+
+		Each clone's sample set is identified by the (wrapping) sum of random 64-bit keys of its samples over its CSR
+		row, so all sets are counted with one reduction and one sort.
+
+		Parameters
+		----------
+		min_shared: int or None
+			Minimum number of samples a clone must be in to be counted; default is 2
+		max_shared: int or None
+			Maximum number of samples a clone can be in to be counted; default is None
+
+		Returns
+		----------
+		overlap_counts: pandas Series
+			Shared clone counts indexed by the JSON list of sample names of each set, largest first
+		"""
+
+		self.csr.sort_indices()
+		sample_keys = Sample_Set_Keys(len(self.samples))
+
+		#Empty rows hold no entries, so the non-empty rows' entries are contiguous segments for the reduction
+		sample_counts = numpy.diff(self.csr.indptr)
+		row_starts = self.csr.indptr[:-1][sample_counts > 0]
+		sample_counts = sample_counts[sample_counts > 0]
+		with numpy.errstate(over = "ignore"):
+			set_keys = numpy.add.reduceat(sample_keys[self.csr.indices], row_starts) if len(row_starts) else row_starts
+
+		shared = numpy.ones(len(row_starts), dtype = bool)
+		if min_shared is not None:
+			shared &= sample_counts >= min_shared
+		if max_shared is not None:
+			shared &= sample_counts <= max_shared
+		row_starts, sample_counts, set_keys = row_starts[shared], sample_counts[shared], set_keys[shared]
+
+		_, first_rows, set_counts = numpy.unique(set_keys, return_index = True, return_counts = True)
+		set_names = []
+		for row_start, set_size in zip(row_starts[first_rows], sample_counts[first_rows]):
+			set_samples = self.csr.indices[row_start:row_start + set_size]
+			set_names.append(json.dumps([self.samples[col] for col in set_samples]))
+
+		overlap_counts = pandas.Series(set_counts, index = set_names, dtype = numpy.int64)
+
+		return overlap_counts.sort_values(ascending = False, kind = "mergesort")
+
+	def Set_Clones(self, samples):
+		"""Gets the IDs of the clones found in exactly the given set of samples (one UpSet bar), using the sample set keys
+		of Overlap_Counts."""
+
+		self.csr.sort_indices()
+		sample_keys = Sample_Set_Keys(len(self.samples))
+		set_cols = numpy.array([self.Sample_Index(sample) for sample in samples], dtype = numpy.int64)
+		with numpy.errstate(over = "ignore"):
+			target_key = sample_keys[set_cols].sum()
+
+		sample_counts = numpy.diff(self.csr.indptr)
+		rows = numpy.flatnonzero(sample_counts == len(set_cols))
+		if len(rows) == 0 or len(set_cols) == 0:
+			return self.clones[rows[:0]]
+
+		#Only rows of the right set size are reduced; their entries are gathered into contiguous segments
+		entry_idxs = numpy.repeat(self.csr.indptr[rows], len(set_cols)) + numpy.tile(numpy.arange(len(set_cols)), len(rows))
+		with numpy.errstate(over = "ignore"):
+			set_keys = numpy.add.reduceat(sample_keys[self.csr.indices[entry_idxs]],
+										  numpy.arange(0, len(entry_idxs), len(set_cols)))
+
+		return self.clones[rows[set_keys == target_key]]
+
+	def Save(self, filename):
+		"""Saves the matrix and its clone / sample labels to a compressed .npz file."""
+
+		clones = self.clones.values
+		if clones.dtype == object:
+			clones = clones.astype(str)
+
+		numpy.savez_compressed(filename, data = self.csr.data, indices = self.csr.indices, indptr = self.csr.indptr,
+							   shape = numpy.array(self.csr.shape), clones = clones,
+							   samples = numpy.array(self.samples, dtype = str))
+
+	@classmethod
+	def Load(cls, filename):
+		"""Loads a matrix saved with Save."""
+
+		with numpy.load(filename, allow_pickle = False) as matrix_file:
+			matrix = sparse.csr_matrix((matrix_file["data"], matrix_file["indices"], matrix_file["indptr"]),
+									   shape = tuple(matrix_file["shape"]))
+			return cls(matrix, matrix_file["clones"], matrix_file["samples"].tolist())
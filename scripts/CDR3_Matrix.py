@@ -0,0 +1,181 @@
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype
+
+#Amino acid (and stop / gap) alphabet of the uint8 encoded CDR3 matrices; code 0 is unknown characters
+amino_acids = "ACDEFGHIKLMNPQRSTVWY*_"
+aa_codes = numpy.zeros(256, dtype = numpy.uint8)
+aa_codes[numpy.frombuffer(amino_acids.encode("ascii"), dtype = numpy.uint8)] = numpy.arange(1, len(amino_acids) + 1)
+aa_codes[numpy.frombuffer(amino_acids.lower().encode("ascii"), dtype = numpy.uint8)] = numpy.arange(1, len(amino_acids) + 1)
+
+#Per residue property scales; residues missing from a scale score 0
+property_scales = {
+	#Kyte & Doolittle hydropathy index
+	"hydrophobicity": {"A": 1.8, "R": -4.5, "N": -3.5, "D": -3.5, "C": 2.5, "Q": -3.5, "E": -3.5, "G": -0.4, "H": -3.2,
+					   "I": 4.5, "L": 3.8, "K": -3.9, "M": 1.9, "F": 2.8, "P": -1.6, "S": -0.8, "T": -0.7, "W": -0.9,
+					   "Y": -1.3, "V": 4.2},
+	#Approximate side chain charge at physiological pH
+	"charge": {"K": 1.0, "R": 1.0, "H": 0.1, "D": -1.0, "E": -1.0}
+}
+
+def Property_Table(scale):
+	"""Creates a lookup table from amino acid codes to a property scale (a name in property_scales or a dict)."""
+
+	if not isinstance(scale, dict):
+		scale = property_scales[scale]
+
+	table = numpy.zeros(len(amino_acids) + 1)
+	for amino_acid, value in scale.items():
+		table[amino_acids.index(amino_acid) + 1] = value
+
+	return table
+
+def Encode_Sequences(sequences, length):
+	"""Encodes equal length sequences into a uint8 matrix with one row per sequence and one column per position."""
+
+	sequence_bytes = "".join(sequences).encode("ascii", errors = "replace")
+	encoded = aa_codes[numpy.frombuffer(sequence_bytes, dtype = numpy.uint8)]
+
+	return encoded.reshape(len(sequences), length)
+
+class CDR3_Length_Matrices(object):
+	def __init__(self, sequences, groups = None, weights = None):
+		"""Packs CDR3 amino acid sequences once into fixed width uint8 matrices, one per CDR3 length.
+
+		Each distinct sequence is encoded once (through a single byte buffer), so composition and property profiles
+		are NumPy table lookups and bincounts rather than Python string operations.
+
+		Parameters
+		----------
+		sequences: pandas Series or iterable of str
+			CDR3 amino acid sequence of every clone; missing sequences are skipped
+		groups: pandas Series, iterable or None
+			Group (sample) of every clone, or None for a single group; default is None
+		weights: iterable of numbers or None
+			Weight (count / frequency) of every clone, or None to count every clone once; default is None
+		"""
+
+		sequences = pandas.Series(sequences).reset_index(drop = True)
+		total_clones = len(sequences)
+
+		if groups is None:
+			group_codes, self.groups = numpy.zeros(total_clones, dtype = numpy.int64), ["Repertoire"]
+		elif is_categorical_dtype(groups):
+			groups = pandas.Series(groups).cat.remove_unused_categories()
+			group_codes, self.groups = groups.cat.codes.values.astype(numpy.int64), list(groups.cat.categories)
+		else:
+			group_codes, self.groups = pandas.factorize(pandas.Series(groups), sort = True)
+			self.groups = list(self.groups)
+
+		weights = numpy.ones(total_clones) if weights is None else numpy.asarray(weights, dtype = float)
+
+		#Distinct sequences (the categories for categorical columns) are encoded once
+		if is_categorical_dtype(sequences):
+			sequence_codes, unique_sequences = sequences.cat.codes.values, sequences.cat.categories
+		else:
+			sequence_codes, unique_sequences = pandas.factorize(sequences)
+		unique_sequences = pandas.Series(unique_sequences, dtype = object).astype(str)
+		unique_lengths = unique_sequences.str.len().values
+
+		sequence_buffer = aa_codes[numpy.frombuffer("".join(unique_sequences).encode("ascii", errors = "replace"),
+													dtype = numpy.uint8)]
+		sequence_starts = numpy.cumsum(unique_lengths) - unique_lengths
+
+		valid = (sequence_codes >= 0) & (group_codes >= 0)
+		sequence_codes, group_codes, weights = sequence_codes[valid], group_codes[valid], weights[valid]
+		clone_lengths = unique_lengths[sequence_codes]
+
+		self.matrices = {}
+		self.row_groups = {}
+		self.row_weights = {}
+		for length in numpy.unique(clone_lengths):
+			if length == 0:
+				continue
+			length_clones = clone_lengths == length
+
+			#Clones with the same sequence in the same group are merged into one weighted row
+			pair_codes, pairs = pandas.factorize(sequence_codes[length_clones] * len(self.groups) +
+												 group_codes[length_clones])
+			pair_weights = numpy.bincount(pair_codes, weights = weights[length_clones], minlength = len(pairs))
+			pair_sequences, pair_groups = numpy.divmod(pairs, len(self.groups))
+
+			gather = sequence_starts[pair_sequences][:, None] + numpy.arange(length)
+			self.matrices[int(length)] = sequence_buffer[gather]
+			self.row_groups[int(length)] = pair_groups
+			self.row_weights[int(length)] = pair_weights
+
+		self.lengths = sorted(self.matrices)
+
+	def Length_Counts(self):
+		"""Gets the weighted number of clones of every group (rows) and CDR3 length (columns) as a DataFrame."""
+
+		length_counts = {length: numpy.bincount(self.row_groups[length], weights = self.row_weights[length],
+												minlength = len(self.groups))
+						 for length in self.lengths}
+
+		return pandas.DataFrame(length_counts, index = self.groups, columns = self.lengths)
+
+	def Modal_Length(self):
+		"""Gets the most common CDR3 length over all groups."""
+
+		return int(self.Length_Counts().sum(axis = 0).idxmax())
+
+	def Positional_Composition(self, length, normalize = True):
+		"""Gets the (weighted) amino acid composition of every position of the CDR3s of one length.
+
+		Parameters
+		----------
+		length: int
+			CDR3 length
+		normalize: bool
+			Whether to return frequencies at each position instead of weighted counts; default is True
+
+		Returns
+		----------
+		composition: numpy array with shape (groups, length, len(amino_acids) + 1)
+			Composition of every group, position and amino acid code (code 0 being unknown characters)
+		"""
+
+		total_codes = len(amino_acids) + 1
+		composition_shape = (len(self.groups), length, total_codes)
+		if length not in self.matrices:
+			return numpy.zeros(composition_shape)
+
+		matrix = self.matrices[length]
+		bins = (self.row_groups[length][:, None] * length + numpy.arange(length)) * total_codes + matrix
+		bin_weights = numpy.broadcast_to(self.row_weights[length][:, None], matrix.shape)
+		composition = numpy.bincount(bins.ravel(), weights = bin_weights.ravel(),
+									 minlength = numpy.prod(composition_shape)).reshape(composition_shape)
+
+		if normalize:
+			position_totals = composition.sum(axis = 2, keepdims = True)
+			composition = composition / numpy.where(position_totals > 0, position_totals, 1.0)
+
+		return composition
+
+	def Positional_Property(self, length, scale = "hydrophobicity"):
+		"""Gets the weighted mean property score of every group (rows) and position (columns) of one CDR3 length."""
+
+		profile = self.Positional_Composition(length) @ Property_Table(scale)
+
+		return pandas.DataFrame(profile, index = self.groups, columns = numpy.arange(1, length + 1))
+
+	def Sequence_Property(self, length, scale = "hydrophobicity", mean = False):
+		"""Gets the total (or mean per residue) property score of every row of one CDR3 length matrix."""
+
+		scores = Property_Table(scale)[self.matrices[length]].sum(axis = 1)
+
+		return scores / length if mean else scores
+
+	def Property_By_Length(self, scale = "hydrophobicity", mean = False):
+		"""Gets the weighted mean sequence property score of every group (rows) and CDR3 length (columns)."""
+
+		length_scores = {}
+		for length in self.lengths:
+			scores = numpy.bincount(self.row_groups[length], minlength = len(self.groups),
+									weights = self.row_weights[length] * self.Sequence_Property(length, scale, mean))
+			totals = numpy.bincount(self.row_groups[length], weights = self.row_weights[length],
+									minlength = len(self.groups))
+			length_scores[length] = numpy.where(totals > 0, scores / numpy.where(totals > 0, totals, 1.0), numpy.nan)
+
+		return pandas.DataFrame(length_scores, index = self.groups, columns = self.lengths)
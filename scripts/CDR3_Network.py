@@ -0,0 +1,391 @@
+import numpy
+import pandas
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from bokeh.plotting import figure
+from bokeh.models import HoverTool, ColumnDataSource, NumeralTickFormatter
+from bokeh.io.export import export_png
+from bokeh.layouts import column, row
+
+from .CDR3_Matrix import Encode_Sequences
+
+def _Group_Pairs(group_codes):
+	"""Gets all pairs (i, j) of positions with i < j and equal group codes, without a Python loop over groups."""
+
+	sort_order = numpy.argsort(group_codes, kind = "stable")
+	sorted_codes = group_codes[sort_order]
+
+	#For every sorted position, the number of later positions in the same group
+	group_ends = numpy.searchsorted(sorted_codes, sorted_codes, side = "right")
+	later_counts = group_ends - numpy.arange(len(sorted_codes)) - 1
+
+	first_positions = numpy.repeat(numpy.arange(len(sorted_codes)), later_counts)
+	pair_offsets = numpy.arange(len(first_positions)) - numpy.repeat(numpy.cumsum(later_counts) - later_counts,
+																	  later_counts)
+	second_positions = first_positions + 1 + pair_offsets
+
+	return sort_order[first_positions], sort_order[second_positions]
+
+def _Hamming_Bucket_Pairs(encoded, bucket_idxs, max_distance, chunk_size = 1000000):
+	"""Finds the pairs within Hamming distance max_distance in one bucket of equal length encoded sequences.
+
+	By the pigeonhole principle, two sequences within distance k are identical in at least one of k + 1 segments, so
+	only sequences sharing a segment are compared.
+	"""
+
+	length = encoded.shape[1]
+	if length <= max_distance:
+		#Sequences this short are always within the distance of each other (the segments would be empty)
+		first, second = _Group_Pairs(numpy.zeros(len(bucket_idxs), dtype = numpy.int64))
+		return numpy.stack([bucket_idxs[first], bucket_idxs[second]], axis = 1)
+
+	segment_bounds = numpy.linspace(0, length, max_distance + 2).astype(int)
+
+	pairs = []
+	for start, stop in zip(segment_bounds[:-1], segment_bounds[1:]):
+		if stop <= start:
+			continue
+		_, segment_codes = numpy.unique(encoded[:, start:stop], axis = 0, return_inverse = True)
+		first, second = _Group_Pairs(segment_codes.ravel())
+
+		for chunk_start in range(0, len(first), chunk_size):
+			chunk_first = first[chunk_start:chunk_start + chunk_size]
+			chunk_second = second[chunk_start:chunk_start + chunk_size]
+			distances = (encoded[chunk_first] != encoded[chunk_second]).sum(axis = 1)
+			within = distances <= max_distance
+			pairs.append(numpy.stack([bucket_idxs[chunk_first[within]], bucket_idxs[chunk_second[within]]], axis = 1))
+
+	return numpy.concatenate(pairs) if pairs else numpy.empty((0, 2), dtype = numpy.int64)
+
+def _Deletion_Variants(sequences, seq_idxs, max_distance):
+	"""Hashes all variants of the sequences with up to max_distance deleted positions (runs in a worker process)."""
+
+	variants = []
+	variant_idxs = []
+	for sequence, seq_idx in zip(sequences, seq_idxs):
+		sequence_variants = {sequence}
+		for _ in range(max_distance):
+			sequence_variants |= {variant[:pos] + variant[pos + 1:] for variant in sequence_variants
+								  for pos in range(len(variant))}
+		variants += list(sequence_variants)
+		variant_idxs += [seq_idx] * len(sequence_variants)
+
+	variant_hashes = pandas.util.hash_array(numpy.array(variants, dtype = object))
+
+	return variant_hashes, numpy.array(variant_idxs, dtype = numpy.int64)
+
+def Levenshtein_Within(seq1, seq2, max_distance):
+	"""Checks whether the Levenshtein (edit) distance of two sequences is at most max_distance (banded DP)."""
+
+	if abs(len(seq1) - len(seq2)) > max_distance:
+		return False
+
+	previous = list(range(len(seq2) + 1))
+	for idx1 in range(1, len(seq1) + 1):
+		current = [idx1] + [max_distance + 1] * len(seq2)
+		#Only cells within max_distance of the diagonal can be within the distance
+		for idx2 in range(max(1, idx1 - max_distance), min(len(seq2), idx1 + max_distance) + 1):
+			substitution = previous[idx2 - 1] + (seq1[idx1 - 1] != seq2[idx2 - 1])
+			current[idx2] = min(substitution, previous[idx2] + 1, current[idx2 - 1] + 1)
+		if min(current) > max_distance:
+			return False
+		previous = current
+
+	return previous[len(seq2)] <= max_distance
+
+def _Levenshtein_Verify(seq_pairs, max_distance):
+	"""Checks a chunk of candidate sequence pairs (runs in a worker process)."""
+
+	return numpy.array([Levenshtein_Within(seq1, seq2, max_distance) for seq1, seq2 in seq_pairs], dtype = bool)
+
+def CDR3_Neighbor_Pairs(sequences, max_distance = 1, metric = "hamming", n_jobs = 4, chunk_size = 100000):
+	"""Finds all pairs of sequences within a Hamming or Levenshtein distance, using an index instead of all pairs.
+
+	Hamming neighbors are found within length buckets from shared pigeonhole segments; Levenshtein neighbors from
+	shared deletion neighborhood variants (the sequences with up to max_distance positions deleted). Buckets and
+	chunks are processed in parallel.
+
+	Parameters
+	----------
+	sequences: iterable of str
+		Amino acid sequences (for example CDR3s); missing and empty sequences have no neighbors
+	max_distance: int
+		Maximum number of substitutions (Hamming) or edits (Levenshtein) between neighbors; default is 1
+	metric: str
+		"hamming" or "levenshtein"; default is "hamming"
+	n_jobs: int
+		Number of threads (Hamming) or worker processes (Levenshtein); default is 4
+	chunk_size: int
+		Number of sequences / candidate pairs per Levenshtein job; default is 100000
+
+	Returns
+	----------
+	pairs: numpy array of ints with shape (n, 2)
+		Unique index pairs (i, j) with i < j of the neighboring sequences
+	"""
+
+	sequences = pandas.Series(sequences).astype(object).fillna("").astype(str).reset_index(drop = True)
+	lengths = sequences.str.len().values
+
+	#Missing (and empty) sequences are not indexed, so they stay isolated instead of all sharing the empty variant
+	indexed_idxs = numpy.flatnonzero(lengths > 0)
+
+	if metric.lower() == "hamming":
+		bucket_jobs = []
+		for length in numpy.unique(lengths):
+			bucket_idxs = numpy.flatnonzero(lengths == length)
+			if len(bucket_idxs) > 1 and length > 0:
+				encoded = Encode_Sequences(sequences.values[bucket_idxs].tolist(), int(length))
+				bucket_jobs.append((encoded, bucket_idxs))
+
+		#Numpy releases the GIL for the comparisons, so the length buckets run on threads
+		with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+			bucket_pairs = list(executor.map(lambda job: _Hamming_Bucket_Pairs(job[0], job[1], max_distance),
+											 bucket_jobs))
+		pairs = numpy.concatenate(bucket_pairs) if bucket_pairs else numpy.empty((0, 2), dtype = numpy.int64)
+
+	elif metric.lower() == "levenshtein" and len(indexed_idxs) < 2:
+		pairs = numpy.empty((0, 2), dtype = numpy.int64)
+
+	elif metric.lower() == "levenshtein":
+		seq_chunks = [(sequences.values[indexed_idxs[start:start + chunk_size]].tolist(),
+					   indexed_idxs[start:start + chunk_size])
+					  for start in range(0, len(indexed_idxs), chunk_size)]
+
+		with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+			variant_jobs = [executor.submit(_Deletion_Variants, seqs, seq_idxs, max_distance)
+							for seqs, seq_idxs in seq_chunks]
+			variant_hashes, variant_idxs = zip(*[variant_job.result() for variant_job in variant_jobs])
+			variant_hashes = numpy.concatenate(variant_hashes)
+			variant_idxs = numpy.concatenate(variant_idxs)
+
+			first, second = _Group_Pairs(pandas.factorize(variant_hashes)[0])
+			candidates = numpy.sort(numpy.stack([variant_idxs[first], variant_idxs[second]], axis = 1), axis = 1)
+			candidates = numpy.unique(candidates[candidates[:, 0] != candidates[:, 1]], axis = 0)
+
+			candidate_seqs = list(zip(sequences.values[candidates[:, 0]], sequences.values[candidates[:, 1]]))
+			verify_jobs = [executor.submit(_Levenshtein_Verify, candidate_seqs[start:start + chunk_size], max_distance)
+						   for start in range(0, len(candidate_seqs), chunk_size)]
+			within = [verify_job.result() for verify_job in verify_jobs]
+
+		pairs = candidates[numpy.concatenate(within)] if within else numpy.empty((0, 2), dtype = numpy.int64)
+
+	else:
+		raise ValueError("metric must be either \"hamming\" or \"levenshtein\"!")
+
+	pairs = numpy.sort(pairs.astype(numpy.int64), axis = 1)
+	return numpy.unique(pairs, axis = 0) if len(pairs) else pairs
+
+class CDR3_Similarity_Network(object):
+	def __init__(self, clone_df, max_distance = 1, metric = "hamming", cdr_col = "CDR3_AA", clone_col = "CloneID",
+				 count_col = "Clustered", sample_col = None, n_jobs = 4):
+		"""Creates a network of clones linked by CDR3 amino acid sequences within a Hamming or Levenshtein distance.
+
+		Parameters
+		----------
+		clone_df: pandas DataFrame
+			DataFrame of the repertoire(s); each row is a node of the network
+		max_distance: int
+			Maximum CDR3 distance between linked clones; default is 1
+		metric: str
+			"hamming" (substitutions only) or "levenshtein" (substitutions and insertions / deletions); default is
+			"hamming"
+		cdr_col, clone_col, count_col: str
+			Column names of the CDR3 sequences, clone IDs and clone counts
+		sample_col: str or None
+			Column name of the sample names, or None; default is None
+		n_jobs: int
+			Number of threads / worker processes used to find the neighbors; default is 4
+		"""
+
+		node_cols = [col for col in [clone_col, cdr_col, count_col, sample_col] if col is not None]
+		self.nodes = clone_df[node_cols].reset_index(drop = True)
+		self.cdr_col = cdr_col
+		self.clone_col = clone_col
+		self.count_col = count_col
+		self.sample_col = sample_col
+
+		self.edges = CDR3_Neighbor_Pairs(self.nodes[cdr_col], max_distance = max_distance, metric = metric,
+										 n_jobs = n_jobs)
+
+		total_nodes = len(self.nodes)
+		self.adjacency = sparse.coo_matrix((numpy.ones(len(self.edges), dtype = numpy.int8),
+											(self.edges[:, 0], self.edges[:, 1])), shape = (total_nodes, total_nodes))
+		self.adjacency = (self.adjacency + self.adjacency.T).tocsr()
+
+		self.total_components, self.components = connected_components(self.adjacency, directed = False)
+		self.degrees = numpy.diff(self.adjacency.indptr)
+
+		self.nodes["Component"] = self.components
+		self.nodes["Degree"] = self.degrees
+
+	def Component_Sizes(self):
+		"""Gets the number of clones in every connected component, largest first."""
+
+		return pandas.Series(numpy.bincount(self.components)).sort_values(ascending = False, kind = "mergesort")
+
+	def Component_Size_Distribution(self):
+		"""Gets the number of components of every component size."""
+
+		return pandas.Series(numpy.bincount(numpy.bincount(self.components))).iloc[1:].loc[lambda sizes: sizes > 0]
+
+	def Degree_Distribution(self):
+		"""Gets the number of clones with every degree (number of CDR3 neighbors)."""
+
+		return pandas.Series(numpy.bincount(self.degrees))
+
+	def Layout(self, max_nodes = 5000, min_component_size = 2):
+		"""Places the largest components (up to max_nodes clones in total) side by side for plotting.
+
+		Components are taken largest first as long as they fit in the remaining nodes, so one oversize component does
+		not hide the smaller ones; a component larger than max_nodes on its own is cut to its max_nodes highest degree
+		clones. Each component is drawn as a star around its highest degree clone with the other clones on rings ordered by
+		degree, which needs no iterative force layout.
+
+		Returns
+		----------
+		node_positions: pandas DataFrame
+			The nodes of the placed components with x and y columns
+		"""
+
+		component_sizes = self.Component_Sizes()
+		component_sizes = component_sizes[component_sizes >= min_component_size].clip(upper = max_nodes)
+
+		shown_components = []
+		remaining_nodes = max_nodes
+		for component, component_size in component_sizes.items():
+			if remaining_nodes < min_component_size:
+				break
+			if component_size <= remaining_nodes:
+				shown_components.append(component)
+				remaining_nodes -= component_size
+		shown_components = component_sizes.loc[shown_components]
+
+		shown_nodes = self.nodes[self.nodes["Component"].isin(shown_components.index)]
+		shown_nodes = shown_nodes.sort_values(["Component", "Degree"], ascending = [True, False], kind = "mergesort")
+
+		#Position within the component: 0 for the hub, then rings of growing radius
+		node_ranks = shown_nodes.groupby("Component").cumcount().values
+		shown_nodes, node_ranks = shown_nodes[node_ranks < max_nodes], node_ranks[node_ranks < max_nodes]
+		ring_radii = numpy.sqrt(node_ranks)
+		ring_angles = node_ranks * 2.399963229728653  #Golden angle spreads nodes evenly over the rings
+
+		#Components are placed on a grid of cells sized by their largest ring
+		component_order = {component: idx for idx, component in enumerate(shown_components.index)}
+		cell_idxs = shown_nodes["Component"].map(component_order).values
+		cell_size = 2.0 * numpy.sqrt(shown_components.max() if len(shown_components) else 1) + 1.0
+		grid_width = max(int(numpy.ceil(numpy.sqrt(len(shown_components)))), 1)
+
+		shown_nodes = shown_nodes.copy()
+		shown_nodes["x"] = (cell_idxs % grid_width) * cell_size + ring_radii * numpy.cos(ring_angles)
+		shown_nodes["y"] = -(cell_idxs // grid_width) * cell_size + ring_radii * numpy.sin(ring_angles)
+
+		return shown_nodes
+
+def CDR3_Network_Plot(clone_df, png = None, title = "", max_distance = 1, metric = "hamming", cdr_col = "CDR3_AA",
+					  clone_col = "CloneID", count_col = "Clustered", sample_col = None, max_nodes = 5000,
+					  min_component_size = 2, figsize = (1000, 1000), n_jobs = 4, network = None):
+	"""Creates a CDR3 similarity network panel with the component size and degree distributions.
+
+	Only the largest components (up to max_nodes clones) are drawn as nodes and edges; all components are summarized
+	in the distributions, which keeps the page responsive for networks of millions of clones.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) (can be None if network is given)
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	max_distance, metric, cdr_col, clone_col, count_col, sample_col, n_jobs:
+		See CDR3_Similarity_Network
+	max_nodes: int
+		Maximum number of clones drawn in the network view; default is 5000
+	min_component_size: int
+		Smallest component drawn in the network view; default is 2
+	figsize: tuple of (int, int)
+		The width and height of the network view; default is (1000, 1000)
+	network: CDR3_Similarity_Network or None
+		Prebuilt network to plot; default is None
+
+	Returns
+	----------
+	plot: bokeh Column
+		The network view above the component size and degree distribution plots
+	"""
+
+	if network is None:
+		network = CDR3_Similarity_Network(clone_df, max_distance = max_distance, metric = metric, cdr_col = cdr_col,
+										  clone_col = clone_col, count_col = count_col, sample_col = sample_col,
+										  n_jobs = n_jobs)
+
+	network_params = {
+		"plot_width": figsize[0],
+		"plot_height": figsize[1],
+		"title": title,
+		"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+		"active_scroll": "wheel_zoom",
+		"toolbar_location": "right",
+		"match_aspect": True
+	}
+	plot = figure(**network_params)
+	plot.grid.visible = False
+	plot.axis.visible = False
+
+	shown_nodes = network.Layout(max_nodes = max_nodes, min_component_size = min_component_size)
+
+	#All shown edges are drawn with one segment renderer
+	node_xs = pandas.Series(shown_nodes["x"].values, index = shown_nodes.index)
+	node_ys = pandas.Series(shown_nodes["y"].values, index = shown_nodes.index)
+	#Cut down components keep only the edges between their shown clones
+	shown_edges = network.edges[numpy.isin(network.edges[:, 0], shown_nodes.index.values) &
+								numpy.isin(network.edges[:, 1], shown_nodes.index.values)]
+	edge_data = {
+		"x0": node_xs.reindex(shown_edges[:, 0]).values,
+		"y0": node_ys.reindex(shown_edges[:, 0]).values,
+		"x1": node_xs.reindex(shown_edges[:, 1]).values,
+		"y1": node_ys.reindex(shown_edges[:, 1]).values
+	}
+	plot.segment(x0 = "x0", y0 = "y0", x1 = "x1", y1 = "y1", line_color = "#969696", line_width = 0.6,
+				 source = ColumnDataSource(edge_data))
+
+	node_data = {col: numpy.asarray(shown_nodes[col]) for col in shown_nodes.columns}
+	node_data["size"] = 4.0 + 2.0 * numpy.log10(shown_nodes[count_col].clip(lower = 1).values)
+	node_renderer = plot.circle(x = "x", y = "y", size = "size", fill_color = "#1E78B4", line_color = "#505050",
+								line_width = 0.4, source = ColumnDataSource(node_data))
+
+	hover_tooltips = [("Clone ID", "@{0}".format(clone_col)), ("CDR3", "@{0}".format(cdr_col)),
+					  ("Count", "@{0}".format(count_col)), ("Degree", "@Degree"), ("Component", "@Component")]
+	if sample_col is not None:
+		hover_tooltips.append(("Sample", "@{0}".format(sample_col)))
+	plot.add_tools(HoverTool(tooltips = hover_tooltips, renderers = [node_renderer]))
+
+	distribution_plots = []
+	for distribution, x_label in ((network.Component_Size_Distribution(), "Component Size (Clones)"),
+								  (network.Degree_Distribution(), "Degree (CDR3 Neighbors)")):
+		distribution_params = {
+			"plot_width": figsize[0] // 2,
+			"plot_height": figsize[1] // 3,
+			"x_axis_type": "log",
+			"y_axis_type": "log",
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"toolbar_location": "right"
+		}
+		distribution_plot = figure(**distribution_params)
+		#Zero degrees can't be shown on a log axis; they are the singleton components
+		distribution = distribution[(distribution.index > 0) & (distribution.values > 0)]
+		distribution_plot.circle(x = distribution.index.values, y = distribution.values, size = 6, color = "#1E78B4")
+		distribution_plot.xaxis.axis_label = x_label
+		distribution_plot.yaxis.axis_label = "Total"
+		distribution_plot.yaxis.formatter = NumeralTickFormatter(format = "0,0")
+		distribution_plots.append(distribution_plot)
+
+	network_plot = column(plot, row(*distribution_plots))
+
+	if png is not None:
+		export_png(network_plot, png)
+
+	return network_plot
@@ -0,0 +1,129 @@
+import json
+
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype
+
+from bokeh.models import ColumnDataSource
+from bokeh.models.widgets import DataTable, TableColumn, Div
+from bokeh.layouts import column
+
+class Clone_Detail_Index(object):
+	def __init__(self, clone_df, clone_col = "CloneID", detail_cols = None):
+		"""Indexes the rows of a repertoire DataFrame by clone ID, so the full records of any clones (one row per sample
+		they appear in) are gathered without scanning the DataFrame.
+
+		The rows are sorted by clone once; every clone is then a contiguous range of the sorted rows, as in a CSR matrix.
+
+		Parameters
+		----------
+		clone_df: pandas DataFrame
+			DataFrame of the repertoire(s), with one row per clone and sample
+		clone_col: str
+			Column name in clone_df of the clone IDs; default is "CloneID"
+		detail_cols: list of str or None
+			Columns of the clone records (for example CDR3, sequence and sample), or None for all columns; default is None
+		"""
+
+		self.clone_col = clone_col
+		self.detail_cols = list(clone_df.columns) if detail_cols is None else list(detail_cols)
+		if clone_col not in self.detail_cols:
+			self.detail_cols.insert(0, clone_col)
+		self.clone_df = clone_df[self.detail_cols].reset_index(drop = True)
+
+		if is_categorical_dtype(self.clone_df[clone_col]):
+			clone_codes, self.clones = self.clone_df[clone_col].cat.codes.values, self.clone_df[clone_col].cat.categories
+		else:
+			clone_codes, self.clones = pandas.factorize(self.clone_df[clone_col])
+
+		self.row_order = numpy.argsort(clone_codes, kind = "stable")
+		self.row_order = self.row_order[clone_codes[self.row_order] >= 0]
+		self.clone_offsets = numpy.searchsorted(clone_codes[self.row_order], numpy.arange(len(self.clones) + 1))
+
+	def Clone_Rows(self, clone_ids):
+		"""Gets the row positions (in clone_df) of all records of the given clone IDs; unknown IDs are skipped."""
+
+		clone_idxs = self.clones.get_indexer(pandas.Index(clone_ids))
+		clone_idxs = clone_idxs[clone_idxs >= 0]
+		starts, stops = self.clone_offsets[clone_idxs], self.clone_offsets[clone_idxs + 1]
+
+		range_lengths = stops - starts
+		offsets = numpy.arange(range_lengths.sum()) - numpy.repeat(numpy.cumsum(range_lengths) - range_lengths,
+																	range_lengths)
+
+		return self.row_order[numpy.repeat(starts, range_lengths) + offsets]
+
+	def Records(self, clone_ids):
+		"""Gets the full records of the given clone IDs as a DataFrame, grouped by clone in the given order."""
+
+		return self.clone_df.take(self.Clone_Rows(clone_ids))
+
+class Clone_Detail_Panel(object):
+	def __init__(self, detail_index, abundance_matrix = None, max_rows = 1000, figsize = (1000, 300)):
+		"""Creates a clone details table for a Bokeh server session, filled from a Clone_Detail_Index when clones are
+		tapped in linked plots.
+
+		Parameters
+		----------
+		detail_index: Clone_Detail_Index
+			Index of the full clone records
+		abundance_matrix: Clone_Abundance_Matrix or None
+			Clone x sample abundance matrix for resolving tapped UpSet bars to their clones; default is None
+		max_rows: int
+			Maximum number of records shown at once; default is 1000
+		figsize: tuple of (int, int)
+			The width and height of the table; default is (1000, 300)
+		"""
+
+		self.detail_index = detail_index
+		self.abundance_matrix = abundance_matrix
+		self.max_rows = max_rows
+
+		self.table_source = ColumnDataSource({col: [] for col in detail_index.detail_cols})
+		table_columns = [TableColumn(field = col, title = col) for col in detail_index.detail_cols]
+		self.table = DataTable(source = self.table_source, columns = table_columns, width = figsize[0],
+							   height = figsize[1], index_position = None)
+		self.header = Div(text = "<b>Clone Details</b>: tap a Mosaic tile, Cyrcos link end or UpSet bar",
+						  width = figsize[0])
+		self.layout = column(self.header, self.table)
+
+	def Show_Clones(self, clone_ids, label = "Selected clones"):
+		"""Fills the table with the records of the given clone IDs (up to max_rows)."""
+
+		records = self.detail_index.Records(clone_ids)
+		shown = records.head(self.max_rows)
+		self.table_source.data = {col: shown[col].astype(object).tolist() for col in self.detail_index.detail_cols}
+		self.header.text = "<b>Clone Details</b>: {0} ({1:,} clones, {2:,} records{3})".format(
+			label, len(pandas.unique(numpy.asarray(clone_ids))), len(records),
+			", first {0:,} shown".format(self.max_rows) if len(records) > self.max_rows else "")
+
+	def Link_Source(self, source, clone_col = "CloneID"):
+		"""Shows the records of the clones selected (tapped) in a source with a clone ID column."""
+
+		def Selection_Changed(attr, old, new):
+			if new:
+				self.Show_Clones([source.data[clone_col][idx] for idx in new])
+
+		source.selected.on_change("indices", Selection_Changed)
+
+	def Link_Set_Source(self, source, set_col = "set"):
+		"""Shows the records of the clones shared by exactly the sample set selected (tapped) in an UpSet bar source,
+		whose set column holds JSON lists of sample names."""
+
+		def Selection_Changed(attr, old, new):
+			if new and self.abundance_matrix is not None:
+				samples = json.loads(source.data[set_col][new[0]])
+				self.Show_Clones(self.abundance_matrix.Set_Clones(samples), label = " & ".join(samples))
+
+		source.selected.on_change("indices", Selection_Changed)
+
+	def Link_Layout(self, layout):
+		"""Links every clone source of a layout (the sources named "clone_tiles", "clone_links" and "clone_sets" by
+		Mosaic_Plot, Cyrcos_Repertoire_Comparison_Plot and Repertoire_Upset_Plot with clone_details) to the table."""
+
+		for source in layout.select({"type": ColumnDataSource, "name": "clone_tiles"}):
+			self.Link_Source(source)
+		for source in layout.select({"type": ColumnDataSource, "name": "clone_links"}):
+			self.Link_Source(source)
+		for source in layout.select({"type": ColumnDataSource, "name": "clone_sets"}):
+			self.Link_Set_Source(source)
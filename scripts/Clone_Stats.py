@@ -1,258 +1,655 @@
 import numpy
+import pandas
 import math
 from scipy.stats import gaussian_kde
 
 from bokeh.plotting import figure
-from bokeh.models import Range1d, HoverTool, ColumnDataSource, NumeralTickFormatter, FixedTicker
+from bokeh.models import Range1d, HoverTool, ColumnDataSource, NumeralTickFormatter, FixedTicker, CDSView, \
+	IndexFilter, LogColorMapper, ColorBar, LogTicker
+from bokeh.palettes import viridis
+from bokeh.util.hex import cartesian_to_axial, axial_to_cartesian
 from bokeh.io.export import export_png
+from bokeh.layouts import gridplot
+
+from .Gene_Colors import Sample_Colors, aminoacid_colors, missing_color
+from .CDR3_Matrix import CDR3_Length_Matrices, amino_acids
+from .Repertoire_Data import Split_Columns, Facet_Cells, Cell_Rows, Facet_Panels
 
 def Violin_SHM_Plot(clone_df, png = None, title = "", vshm_col = "V_SHM", jshm_col = "J_SHM", split_col = None,
-					quads = True, violin_width = 0.8, line_width = 0.4, figsize = (1000, 600), hover_tooltip = True):
+					quads = True, violin_width = 0.8, line_width = 0.4, figsize = (1000, 600), hover_tooltip = True,
+					ncols = 2):
 	"""Creates a SHM violin plot that can be used to compare multiple categories in a Repertoire.
 
 	Parameters
 	----------
 	clone_df: pandas DataFrame
+	split_col: str, list of str or None
+		Column separating various repertoire subsets in clone_df or None if single repertoire; a list of columns (for
+		example ["Sample", "Isotype"]) draws the subsets of the first column in one small multiple panel per combination
+		of the others; default is None
+	ncols: int
+		Number of facet panels per row; default is 2
 
 	Returns
 	----------
-	script: str
-	div: str
+	plot: bokeh figure or GridBox
+		The figure object for the violin plot, or the grid of facet panels
 	"""
 
-	figure_params = {
-		"plot_width": figsize[0],
-		"plot_height": figsize[1],
-		"y_range": Range1d(-0.005, 0.3, bounds = (-0.01, 0.31)),
-		"title": title,
-		"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
-		"active_scroll": "wheel_zoom",
-		"toolbar_location": "right"
-	}
-
-	plot = figure(**figure_params)
-	plot.grid.visible = False
-	plot.xaxis.minor_tick_line_color = None
-	plot.xaxis.major_label_text_font_size = "10pt"
-	plot.yaxis.axis_label = "V/J Gene SHM"
-	plot.yaxis.major_label_text_font_size = "10pt"
-	plot.yaxis.formatter = NumeralTickFormatter(format = "0.00%")
-
-	if hover_tooltip:
-		hover_tooltips = [("Mean SHM", "@mean{(0.00%)}"), ("Max SHM", "@max{(0.00%)}"),
-						  ("25th Percentile", "@quantile25{(0.00%)}"), ("75th Percentile", "@quantile75{(0.00%)}")]
-		hover_tool = HoverTool(point_policy = "follow_mouse", tooltips = hover_tooltips)
-		plot.add_tools(hover_tool)
-
 	shm_cols = []
 	if vshm_col is not None:
 		shm_cols.append(vshm_col)
 	if jshm_col is not None:
 		shm_cols.append(jshm_col)
 
-	#To compare samples, add the sample column to split on to the DataFrame
-	if split_col is not None:
-		shm_cols.append(split_col)
-		shm_df = clone_df[shm_cols]
-
-		samples = []
-		shm_dfs = []
-		for sample, df in shm_df.groupby([split_col]):
-			samples.append(sample)
-			shm_dfs.append(df)
-
-	else:
-		samples = ["Repertoire"]
-		shm_dfs = [clone_df[shm_cols]]
+	#The clones of every sample (and facet) cell are gathered once, with one sort of their combined codes
+	split_cols = Split_Columns(split_col)
+	series_cols, facet_cols = split_cols[:1], split_cols[1:]
+	cell_codes, cells = Facet_Cells(clone_df, facet_cols + series_cols)
+	shm_df = clone_df[shm_cols]
+	shm_dfs = [shm_df.take(rows) for rows in Cell_Rows(cell_codes, len(cells))]
+	samples = cells[series_cols[0]].tolist() if series_cols else ["Repertoire"] * len(cells)
 
 	vshm_violin_color = "lightgreen"
 	jshm_violin_color = "slateblue"
-	violin_xs = []
-	violin_ys = []
-	violin_colors = []
-	violin_legends = []
-	hover_means = []
-	hover_maxes = []
-	hover_25quantiles = []
-	hover_75quantiles = []
-	x_location_to_category = {}
-	violin_x_offset = 0
-
-	for sample, df in zip(samples, shm_dfs):
-		#Create the density functions
-		if vshm_col in df.columns:
-			vshm_mean = df[vshm_col].mean()
-			vshm_max = df[vshm_col].max()
-			hover_means.append([vshm_mean])
-			hover_maxes.append([vshm_max])
-			hover_25quantiles.append([df[vshm_col].quantile(0.25)])
-			hover_75quantiles.append([df[vshm_col].quantile(0.75)])
-
-			y_points = numpy.linspace(0.0, vshm_max, 300)  #Create the y range of 300 points from min to max
-			reversed_y_points = numpy.flipud(y_points)
-			v_kernel = gaussian_kde(df[vshm_col], "scott")
-			vshm_x_points = v_kernel(y_points)
-
-			#Normalize the x range to standard width; negate V SHM points to place it on the left half of the violin
-			vshm_x_points = -vshm_x_points / vshm_x_points.max() * violin_width / 2.0
-
-			#Return to the patch starting points if a different violin is drawn for the other half, or mirror data
-			if jshm_col in df.columns:
-				vshm_x_points = numpy.append(vshm_x_points, abs(vshm_x_points).min())
-				vshm_y_points = numpy.append(y_points, y_points.min())
-			else:
-				reversed_vshm_x = numpy.flipud(-vshm_x_points)
-				vshm_x_points = numpy.append(vshm_x_points, reversed_vshm_x)
-				vshm_y_points = numpy.append(y_points, reversed_y_points)
-
-			violin_xs.append(vshm_x_points + violin_x_offset)
-			violin_ys.append(vshm_y_points)
-			violin_colors.append(vshm_violin_color)
-			violin_legends.append("V Gene SHM")
-
-		if jshm_col in df.columns:
-			jshm_mean = df[jshm_col].mean()
-			jshm_max = df[jshm_col].max()
-			hover_means.append([jshm_mean])
-			hover_maxes.append([jshm_max])
-			hover_25quantiles.append([df[jshm_col].quantile(0.25)])
-			hover_75quantiles.append([df[jshm_col].quantile(0.75)])
-
-			y_points = numpy.linspace(0.0, jshm_max, 300)  #Create the y range of 300 points from min to max
-			reversed_y_points = numpy.flipud(y_points)
-			j_kernel = gaussian_kde(df[jshm_col], "scott")
-			jshm_x_points = j_kernel(y_points)
-
-			#Normalize the x range to standard width
-			jshm_x_points = jshm_x_points / jshm_x_points.max() * violin_width / 2.0
-
-			#Return to the patch starting points if a different violin is drawn for the other half, or mirror data
+
+	plots = []
+	for panel_title, panel_cells in Facet_Panels(cells, facet_cols):
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"y_range": Range1d(-0.005, 0.3, bounds = (-0.01, 0.31)),
+			"title": " ".join([text for text in (title, panel_title) if text]),
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"active_scroll": "wheel_zoom",
+			"toolbar_location": "right"
+		}
+
+		plot = figure(**figure_params)
+		plot.grid.visible = False
+		plot.xaxis.minor_tick_line_color = None
+		plot.xaxis.major_label_text_font_size = "10pt"
+		plot.yaxis.axis_label = "V/J Gene SHM"
+		plot.yaxis.major_label_text_font_size = "10pt"
+		plot.yaxis.formatter = NumeralTickFormatter(format = "0.00%")
+
+		if hover_tooltip:
+			hover_tooltips = [("Mean SHM", "@mean{(0.00%)}"), ("Max SHM", "@max{(0.00%)}"),
+							  ("25th Percentile", "@quantile25{(0.00%)}"), ("75th Percentile", "@quantile75{(0.00%)}")]
+			hover_tool = HoverTool(point_policy = "follow_mouse", tooltips = hover_tooltips)
+			plot.add_tools(hover_tool)
+
+		violin_xs = []
+		violin_ys = []
+		violin_colors = []
+		violin_legends = []
+		hover_means = []
+		hover_maxes = []
+		hover_25quantiles = []
+		hover_75quantiles = []
+		x_location_to_category = {}
+		violin_x_offset = 0
+
+		for cell in panel_cells:
+			df = shm_dfs[cell]
+			#Create the density functions
 			if vshm_col in df.columns:
-				jshm_x_points = numpy.append(jshm_x_points, abs(jshm_x_points).min())
-				jshm_y_points = numpy.append(y_points, y_points.min())
-			else:
-				reversed_jshm_x = numpy.flipud(-jshm_x_points)
-				jshm_x_points = numpy.append(jshm_x_points, reversed_jshm_x)
-				jshm_y_points = numpy.append(y_points, reversed_y_points)
-
-			violin_xs.append(jshm_x_points + violin_x_offset)
-			violin_ys.append(jshm_y_points)
-			violin_colors.append(jshm_violin_color)
-			violin_legends.append("J Gene SHM")
-
-		if quads:
-			pass
-
-		x_location_to_category[violin_x_offset] = sample
-		violin_x_offset += violin_width * 1.2
-
-	violin_data = {
-		"xs": violin_xs,
-		"ys": violin_ys,
-		"fill_color": violin_colors,
-		"legend": violin_legends,
-		"mean": hover_means,
-		"max": hover_maxes,
-		"quantile25": hover_25quantiles,
-		"quantile75": hover_75quantiles
-	}
-	violin_source = ColumnDataSource(violin_data)
+				vshm_mean = df[vshm_col].mean()
+				vshm_max = df[vshm_col].max()
+				hover_means.append([vshm_mean])
+				hover_maxes.append([vshm_max])
+				hover_25quantiles.append([df[vshm_col].quantile(0.25)])
+				hover_75quantiles.append([df[vshm_col].quantile(0.75)])
+
+				y_points = numpy.linspace(0.0, vshm_max, 300)  #Create the y range of 300 points from min to max
+				reversed_y_points = numpy.flipud(y_points)
+				v_kernel = gaussian_kde(df[vshm_col], "scott")
+				vshm_x_points = v_kernel(y_points)
+
+				#Normalize the x range to standard width; negate V SHM points to place it on the left half of the violin
+				vshm_x_points = -vshm_x_points / vshm_x_points.max() * violin_width / 2.0
+
+				#Return to the patch starting points if a different violin is drawn for the other half, or mirror data
+				if jshm_col in df.columns:
+					vshm_x_points = numpy.append(vshm_x_points, abs(vshm_x_points).min())
+					vshm_y_points = numpy.append(y_points, y_points.min())
+				else:
+					reversed_vshm_x = numpy.flipud(-vshm_x_points)
+					vshm_x_points = numpy.append(vshm_x_points, reversed_vshm_x)
+					vshm_y_points = numpy.append(y_points, reversed_y_points)
+
+				violin_xs.append(vshm_x_points + violin_x_offset)
+				violin_ys.append(vshm_y_points)
+				violin_colors.append(vshm_violin_color)
+				violin_legends.append("V Gene SHM")
+
+			if jshm_col in df.columns:
+				jshm_mean = df[jshm_col].mean()
+				jshm_max = df[jshm_col].max()
+				hover_means.append([jshm_mean])
+				hover_maxes.append([jshm_max])
+				hover_25quantiles.append([df[jshm_col].quantile(0.25)])
+				hover_75quantiles.append([df[jshm_col].quantile(0.75)])
+
+				y_points = numpy.linspace(0.0, jshm_max, 300)  #Create the y range of 300 points from min to max
+				reversed_y_points = numpy.flipud(y_points)
+				j_kernel = gaussian_kde(df[jshm_col], "scott")
+				jshm_x_points = j_kernel(y_points)
+
+				#Normalize the x range to standard width
+				jshm_x_points = jshm_x_points / jshm_x_points.max() * violin_width / 2.0
+
+				#Return to the patch starting points if a different violin is drawn for the other half, or mirror data
+				if vshm_col in df.columns:
+					jshm_x_points = numpy.append(jshm_x_points, abs(jshm_x_points).min())
+					jshm_y_points = numpy.append(y_points, y_points.min())
+				else:
+					reversed_jshm_x = numpy.flipud(-jshm_x_points)
+					jshm_x_points = numpy.append(jshm_x_points, reversed_jshm_x)
+					jshm_y_points = numpy.append(y_points, reversed_y_points)
+
+				violin_xs.append(jshm_x_points + violin_x_offset)
+				violin_ys.append(jshm_y_points)
+				violin_colors.append(jshm_violin_color)
+				violin_legends.append("J Gene SHM")
+
+			if quads:
+				pass
+
+			x_location_to_category[violin_x_offset] = str(samples[cell])
+			violin_x_offset += violin_width * 1.2
+
+		violin_data = {
+			"xs": violin_xs,
+			"ys": violin_ys,
+			"fill_color": violin_colors,
+			"legend": violin_legends,
+			"mean": hover_means,
+			"max": hover_maxes,
+			"quantile25": hover_25quantiles,
+			"quantile75": hover_75quantiles
+		}
+		violin_source = ColumnDataSource(violin_data)
 
-	plot.patches(xs = "xs", ys = "ys", fill_color = "fill_color", line_color = "black", line_width = line_width,
-				 legend = "legend", source = violin_source)
+		plot.patches(xs = "xs", ys = "ys", fill_color = "fill_color", line_color = "black", line_width = line_width,
+					 legend = "legend", source = violin_source)
 
-	#Replace / remap the X axis tickers to the categorical samples
-	plot.xaxis.ticker = FixedTicker(ticks = [loc for loc in x_location_to_category])
-	plot.xaxis.major_label_overrides = x_location_to_category
-	plot.x_range.bounds = (min(x_location_to_category.keys()) - 1, max(x_location_to_category.keys()) + 1)
+		#Replace / remap the X axis tickers to the categorical samples
+		plot.xaxis.ticker = FixedTicker(ticks = [loc for loc in x_location_to_category])
+		plot.xaxis.major_label_overrides = x_location_to_category
+		plot.x_range.bounds = (min(x_location_to_category.keys()) - 1, max(x_location_to_category.keys()) + 1)
+
+		plots.append(plot)
+
+	#Facets are shown as small multiples; a single panel is returned as the plain figure
+	if facet_cols:
+		plot = gridplot(plots, ncols = ncols, toolbar_location = "right")
+	else:
+		plot = plots[0]
 
 	if png is not None:
 		export_png(plot, png)
 
 	return plot
 
-def CDR_Length_Histogram_Plot(clone_df, png = None, title = "", cdr_col = "CDR3_AA", split_col = None,
-							  quantile_boundries = (0.0001, 0.9999), figsize = (800, 600)):
-	figure_params = {
-		"plot_width": figsize[0],
-		"plot_height": figsize[1],
-		"title": title,
-		"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
-		"active_scroll": "wheel_zoom",
-		"toolbar_location": "right"
-	}
+def SHM_Hexbin_Table(clone_df, vshm_col = "V_SHM", jshm_col = "J_SHM", split_cols = None, count_col = None,
+					 hex_size = 0.005):
+	"""Aggregates the joint V / J SHM distribution into hexagonal bins for every group of clones.
 
-	plot = figure(**figure_params)
-	plot.grid.visible = False
-	plot.xaxis.minor_tick_line_color = None
-	plot.xaxis.axis_label = "CDR3 Length"
-	plot.xaxis.axis_label_text_font_size = "12pt"
-	plot.xaxis.major_label_text_font_size = "12pt"
-	plot.yaxis.axis_label = "P(x)"
-	plot.yaxis.axis_label_text_font_size = "12pt"
-	plot.yaxis.major_label_text_font_size = "12pt"
-
-	#To compare samples, add the sample column to split on to the DataFrame
-	if split_col is not None:
-		cdr3_df = clone_df[[cdr_col, split_col]]
+	Every clone is binned with one vectorized axial coordinate rounding, and the (weighted) bin totals of all groups
+	come from a single bincount, so the table size depends on the number of occupied bins and not on the clones.
 
-		samples = []
-		cdr3_lens = []
-		for sample, df in cdr3_df.groupby([split_col]):
-			samples.append(sample)
-			cdr3_lens.append(df[cdr_col].str.len())
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s)
+	vshm_col, jshm_col: str
+		Column names in clone_df of the V and J gene SHM; default is "V_SHM" and "J_SHM"
+	split_cols: list of str or None
+		Column names in clone_df to group the clones by (for example the sample and isotype), or None for one group;
+		default is None
+	count_col: str or None
+		Column name in clone_df of the clone counts to weight the clones by, or None to count every clone once; default
+		is None
+	hex_size: float
+		Size (center to corner) of the pointy top hexagons in SHM units; default is 0.005
 
+	Returns
+	----------
+	hexbin_df: pandas DataFrame
+		One row per group and occupied bin, with the group columns, the axial coordinates q and r, the bin center x
+		(V SHM) and y (J SHM), the weighted count and its share of the group total
+	"""
+
+	split_cols = Split_Columns(split_cols)
+	shm_values = clone_df[[vshm_col, jshm_col]].values.astype(float)
+	weights = numpy.ones(len(clone_df)) if count_col is None else clone_df[count_col].values.astype(float)
+
+	#Groups are combined into one code per clone (see Facet_Cells)
+	group_codes, groups = Facet_Cells(clone_df, split_cols)
+	kept = ~numpy.isnan(shm_values).any(axis = 1) & (group_codes >= 0)
+
+	q, r = cartesian_to_axial(shm_values[kept, 0], shm_values[kept, 1], hex_size, "pointytop")
+
+	#Group and axial coordinates are packed into one integer per clone, so the occupied bins are one factorize
+	q_min, r_min = (q.min(), r.min()) if len(q) else (0, 0)
+	q_span, r_span = (q.max() - q_min + 1, r.max() - r_min + 1) if len(q) else (1, 1)
+	bin_codes, bins = pandas.factorize((group_codes[kept] * q_span + (q - q_min)) * r_span + (r - r_min), sort = True)
+	bin_counts = numpy.bincount(bin_codes, weights = weights[kept], minlength = len(bins))
+
+	bin_groups, bin_r = numpy.divmod(bins, r_span)
+	bin_groups, bin_q = numpy.divmod(bin_groups, q_span)
+	bin_q, bin_r = bin_q + q_min, bin_r + r_min
+	hexbin_df = pandas.DataFrame({"q": bin_q, "r": bin_r})
+	for idx, col in enumerate(split_cols):
+		hexbin_df.insert(idx, col, numpy.asarray(groups[col].astype(object))[bin_groups])
+
+	hexbin_df["x"], hexbin_df["y"] = axial_to_cartesian(bin_q, bin_r, hex_size, "pointytop")
+	hexbin_df["count"] = bin_counts
+	group_totals = hexbin_df.groupby(split_cols, sort = False)["count"].transform("sum") if split_cols else bin_counts.sum()
+	hexbin_df["share"] = bin_counts / group_totals
+
+	return hexbin_df
+
+def SHM_Density_Plot(clone_df, png = None, title = "", vshm_col = "V_SHM", jshm_col = "J_SHM", split_col = None,
+					 facet_col = None, count_col = None, hex_size = 0.005, shm_range = (0.0, 0.2), ncols = 4,
+					 figsize = (250, 250)):
+	"""Creates small multiple hexbin density plots of the joint V and J gene SHM, one per sample (and facet).
+
+	The SHM values are binned in Python (see SHM_Hexbin_Table), so only the occupied bins are sent to the page.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) to plot
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	vshm_col, jshm_col: str
+		Column names in clone_df of the V and J gene SHM; default is "V_SHM" and "J_SHM"
+	split_col: str or None
+		Column separating various repertoire subsets in clone_df or None if single repertoire; default is None
+	facet_col: str or None
+		Column name in clone_df to further split every sample by (for example the isotype), or None; default is None
+	count_col: str or None
+		Column name in clone_df of the clone counts to weight the clones by, or None to count every clone once; default
+		is None
+	hex_size: float
+		Size (center to corner) of the hexagons in SHM units; default is 0.005
+	shm_range: tuple of (float, float)
+		Initial V and J SHM axis range; default is (0.0, 0.2)
+	ncols: int
+		Number of plots per row; default is 4
+	figsize: tuple of (int, int)
+		The width and height of every plot; default is (250, 250)
+
+	Returns
+	----------
+	plot: bokeh GridBox
+		The density plots, sharing their ranges and color scale
+	"""
+
+	split_cols = [col for col in (split_col, facet_col) if col is not None]
+	hexbin_df = SHM_Hexbin_Table(clone_df, vshm_col = vshm_col, jshm_col = jshm_col, split_cols = split_cols,
+								 count_col = count_col, hex_size = hex_size)
+
+	#All plots share one source (sliced by index filters), one color scale and linked ranges
+	hexbin_source = ColumnDataSource(hexbin_df)
+	color_mapper = LogColorMapper(palette = viridis(256), low = max(hexbin_df["share"].min(), 1e-6),
+								  high = max(hexbin_df["share"].max(), 1e-6))
+	x_range = Range1d(shm_range[0], shm_range[1])
+	y_range = Range1d(shm_range[0], shm_range[1])
+
+	if split_cols:
+		panel_groups = hexbin_df.groupby(split_cols, sort = True).indices
 	else:
-		samples = ["Repertoire"]
-		cdr3_lens = [clone_df[cdr_col].str.len()]
+		panel_groups = {"Repertoire": numpy.arange(len(hexbin_df))}
+
+	plots = []
+	for panel, panel_rows in panel_groups.items():
+		panel_title = " - ".join([str(value) for value in panel]) if isinstance(panel, tuple) else str(panel)
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"x_range": x_range,
+			"y_range": y_range,
+			"title": title + " " + panel_title if title else panel_title,
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"active_scroll": "wheel_zoom",
+			"toolbar_location": "right",
+			"match_aspect": True
+		}
+		plot = figure(**figure_params)
+		plot.grid.visible = False
+		plot.background_fill_color = "#F0F0F0"
+		plot.xaxis.axis_label = "V Gene SHM"
+		plot.yaxis.axis_label = "J Gene SHM"
+		plot.axis.formatter = NumeralTickFormatter(format = "0%")
+
+		plot.hex_tile(q = "q", r = "r", size = hex_size, line_color = None, source = hexbin_source,
+					  view = CDSView(source = hexbin_source, filters = [IndexFilter(panel_rows.tolist())]),
+					  fill_color = {"field": "share", "transform": color_mapper})
+		plot.add_tools(HoverTool(tooltips = [("V SHM", "@x{0.0%}"), ("J SHM", "@y{0.0%}"),
+											 ("Clones" if count_col is None else "Count", "@count{0,0}"),
+											 ("Share", "@share{0.00%}")]))
+		plots.append(plot)
+
+	color_bar = ColorBar(color_mapper = color_mapper, ticker = LogTicker(), label_standoff = 8, location = (0, 0),
+						 formatter = NumeralTickFormatter(format = "0.0%"), width = 10)
+	plots[-1].add_layout(color_bar, "right")
+
+	density_plot = gridplot(plots, ncols = ncols, toolbar_location = "right")
+
+	if png is not None:
+		export_png(density_plot, png)
+
+	return density_plot
+
+def CDR_Length_Histogram_Plot(clone_df, png = None, title = "", cdr_col = "CDR3_AA", split_col = None,
+							  quantile_boundries = (0.0001, 0.9999), figsize = (800, 600), ncols = 2):
+	"""Creates a CDR3 length spectratype (histogram) plot comparing the subsets of a repertoire.
 
-	bin_min = min([cdr_len_series.min() for cdr_len_series in cdr3_lens])
-	bin_max = max([cdr_len_series.max() for cdr_len_series in cdr3_lens]) + 1
+	The lengths of all clones are binned with a single bincount over the combined sample (and facet) and length codes.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) to plot
+	split_col: str, list of str or None
+		Column separating various repertoire subsets in clone_df or None if single repertoire; a list of columns (for
+		example ["Sample", "Isotype"]) draws the subsets of the first column in one small multiple panel per combination
+		of the others; default is None
+	ncols: int
+		Number of facet panels per row; default is 2
+
+	Returns
+	----------
+	plot: bokeh figure or GridBox
+		The figure object for the histogram plot, or the grid of facet panels
+	"""
+
+	split_cols = Split_Columns(split_col)
+	series_cols, facet_cols = split_cols[:1], split_cols[1:]
+	cell_codes, cells = Facet_Cells(clone_df, facet_cols + series_cols)
+	cdr3_lens = clone_df[cdr_col].str.len().values
+	kept = (cell_codes >= 0) & ~numpy.isnan(cdr3_lens)
+
+	bin_min = int(cdr3_lens[kept].min())
+	bin_max = int(cdr3_lens[kept].max()) + 1
 	bin_range = [i for i in range(bin_min, bin_max)]
+	#Bins are one length wide, with the longest length counted in the last bin (as numpy.histogram does)
+	total_bins = max(len(bin_range) - 1, 1)
+	len_bins = numpy.minimum(cdr3_lens[kept].astype(numpy.int64) - bin_min, total_bins - 1)
+	cell_heights = numpy.bincount(cell_codes[kept] * total_bins + len_bins, minlength = len(cells) * total_bins)
+	cell_heights = cell_heights.reshape(len(cells), total_bins).astype(float)
+	cell_heights /= numpy.maximum(cell_heights.sum(axis = 1, keepdims = True), 1.0)
+
+	if series_cols:
+		samples = cells[series_cols[0]].astype(str).tolist()
+		sample_codes = cells[series_cols[0]].cat.codes.values
+		total_samples = len(cells[series_cols[0]].cat.categories)
+	else:
+		samples = ["Repertoire"] * len(cells)
+		sample_codes = numpy.zeros(len(cells), dtype = int)
+		total_samples = 1
 
-	bar_colors = ["#A0C8E6", "#32A032", "#1E78B4", "#B4DC8C"]
-	bar_offset = 0.0
-	bar_width = 1 / len(samples)
+	bar_colors = Sample_Colors(total_samples, ["#A0C8E6", "#32A032", "#1E78B4", "#B4DC8C"])
+	#Ensure proper Y axis scrolling boundaries are set (shared by all facet panels)
+	upper_y = cell_heights.max() if len(cells) else 0.0
 
-	upper_y = 0.0
+	if quantile_boundries is not None:
+		lower_x = numpy.nanquantile(cdr3_lens, quantile_boundries[0])
+		upper_x = numpy.nanquantile(cdr3_lens, quantile_boundries[1])
+
+	plots = []
+	for panel_title, panel_cells in Facet_Panels(cells, facet_cols):
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"title": " ".join([text for text in (title, panel_title) if text]),
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"active_scroll": "wheel_zoom",
+			"toolbar_location": "right"
+		}
 
-	for idx, (sample, cdr_len_series) in enumerate(zip(samples, cdr3_lens)):
-		heights, lefts = numpy.histogram(cdr_len_series, density = True, bins = bin_range)
+		plot = figure(**figure_params)
+		plot.grid.visible = False
+		plot.xaxis.minor_tick_line_color = None
+		plot.xaxis.axis_label = "CDR3 Length"
+		plot.xaxis.axis_label_text_font_size = "12pt"
+		plot.xaxis.major_label_text_font_size = "12pt"
+		plot.yaxis.axis_label = "P(x)"
+		plot.yaxis.axis_label_text_font_size = "12pt"
+		plot.yaxis.major_label_text_font_size = "12pt"
 
-		#Ensure proper Y axis scrolling boundaries are set
-		if heights.max() > upper_y:
-			upper_y = heights.max()
+		bar_offset = 0.0
+		bar_width = 1 / len(panel_cells)
 
-		#Shift bars if multiple samples are being plotted
-		lefts = lefts.astype(float)
-		lefts += bar_offset
+		#The bars of all samples are drawn with a single quad renderer, grouped into legend entries by the sample column
+		bars_data = {"top": [], "left": [], "right": [], "color": [], "sample": []}
+		for cell in panel_cells:
+			heights = cell_heights[cell]
 
-		bar_lefts = lefts[:-1]
-		bar_rights = bar_lefts + bar_width
+			#Shift bars if multiple samples are being plotted
+			bar_lefts = numpy.arange(bin_min, bin_min + total_bins, dtype = float) + bar_offset
+			bar_rights = bar_lefts + bar_width
 
-		plot.quad(top = heights, bottom = 0, left = bar_lefts, right = bar_rights, fill_color = bar_colors[idx],
-				  line_color = None, legend = sample)
+			bars_data["top"].append(heights)
+			bars_data["left"].append(bar_lefts)
+			bars_data["right"].append(bar_rights)
+			bars_data["color"] += [bar_colors[sample_codes[cell]]] * len(heights)
+			bars_data["sample"] += [samples[cell]] * len(heights)
 
-		bar_offset += bar_width
+			bar_offset += bar_width
 
-	plot.y_range.start = -0.001
-	plot.y_range.end = upper_y
-	plot.y_range.bounds = (-0.05, upper_y * 1.5)
+		for col in ("top", "left", "right"):
+			bars_data[col] = numpy.concatenate(bars_data[col])
 
-	if quantile_boundries is not None:
-		lower_x = clone_df[cdr_col].str.len().quantile(quantile_boundries[0])
-		upper_x = clone_df[cdr_col].str.len().quantile(quantile_boundries[1])
+		plot.quad(top = "top", bottom = 0, left = "left", right = "right", fill_color = "color", line_color = None,
+				  legend = "sample", source = ColumnDataSource(bars_data))
+
+		plot.y_range.start = -0.001
+		plot.y_range.end = upper_y
+		plot.y_range.bounds = (-0.05, upper_y * 1.5)
+
+		if quantile_boundries is not None:
+			plot.x_range.start = lower_x
+			plot.x_range.end = upper_x
 
-		plot.x_range.start = lower_x
-		plot.x_range.end = upper_x
+		plot.x_range.bounds = (0, bin_max + 4)
 
-	plot.x_range.bounds = (0, bin_max + 4)
+		plots.append(plot)
+
+	#Facets are shown as small multiples; a single panel is returned as the plain figure
+	if facet_cols:
+		plot = gridplot(plots, ncols = ncols, toolbar_location = "right")
+	else:
+		plot = plots[0]
 
 	if png is not None:
 		export_png(plot, png)
 
 	return plot
 
+def CDR3_Composition_Plot(clone_df, png = None, title = "", cdr_col = "CDR3_AA", split_col = None, count_col = None,
+						  cdr_length = None, min_label_frequency = 0.08, figsize = (800, 250), cdr3_matrices = None):
+	"""Creates stacked positional amino acid frequency (logo style) plots of the CDR3s of one length, one per sample.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) (can be None if cdr3_matrices is given)
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	cdr_col: str
+		Column name in clone_df of the CDR3 amino acid sequences; default is "CDR3_AA"
+	split_col: str or None
+		Column name in clone_df of the sample names to compare; default is None
+	count_col: str or None
+		Column name in clone_df of the clone counts to weight the clones by, or None to count every clone once;
+		default is None
+	cdr_length: int or None
+		CDR3 length to show, or None for the most common length; default is None
+	min_label_frequency: float
+		Smallest amino acid frequency labeled with its letter; default is 0.08
+	figsize: tuple of (int, int)
+		The width and height of each sample's plot; default is (800, 250)
+	cdr3_matrices: CDR3_Length_Matrices or None
+		Prebuilt CDR3 matrices (grouped by the samples) to use instead of clone_df; default is None
+
+	Returns
+	----------
+	plot: bokeh GridBox
+		The samples' composition plots with a shared x axis
+	"""
+
+	if cdr3_matrices is None:
+		cdr3_matrices = CDR3_Length_Matrices(clone_df[cdr_col], clone_df[split_col] if split_col is not None else None,
+											 clone_df[count_col] if count_col is not None else None)
+	if cdr_length is None:
+		cdr_length = cdr3_matrices.Modal_Length()
+
+	#Stack each position's amino acids from the least to the most frequent
+	composition = cdr3_matrices.Positional_Composition(cdr_length)
+	stack_order = numpy.argsort(composition, axis = 2, kind = "stable")
+	stacked_frequencies = numpy.take_along_axis(composition, stack_order, axis = 2)
+	stacked_tops = numpy.cumsum(stacked_frequencies, axis = 2)
+
+	code_letters = numpy.array(["?"] + list(amino_acids))
+	code_colors = numpy.array([missing_color.to_hex()] + [aminoacid_colors[aa].to_hex() for aa in amino_acids])
+
+	plots = []
+	for group_idx, sample in enumerate(cdr3_matrices.groups):
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"title": "{0} {1} (Length {2})".format(title, sample, cdr_length) if split_col is not None else title,
+			"y_range": Range1d(0.0, 1.0, bounds = (0.0, 1.0)),
+			"x_range": Range1d(0.5, cdr_length + 0.5) if not plots else plots[0].x_range,
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"toolbar_location": "right"
+		}
+		plot = figure(**figure_params)
+		plot.grid.visible = False
+		plot.xaxis.ticker = FixedTicker(ticks = list(range(1, cdr_length + 1)))
+		plot.xaxis.axis_label = "CDR3 Position"
+		plot.yaxis.axis_label = "Frequency"
+
+		frequencies = stacked_frequencies[group_idx]
+		shown = frequencies > 0
+		positions = numpy.broadcast_to(numpy.arange(1, cdr_length + 1)[:, None], frequencies.shape)[shown]
+		codes = stack_order[group_idx][shown]
+		logo_data = {
+			"left": positions - 0.45,
+			"right": positions + 0.45,
+			"top": stacked_tops[group_idx][shown],
+			"bottom": stacked_tops[group_idx][shown] - frequencies[shown],
+			"position": positions,
+			"amino_acid": code_letters[codes],
+			"frequency": frequencies[shown],
+			"color": code_colors[codes]
+		}
+		logo_data["label"] = numpy.where(logo_data["frequency"] >= min_label_frequency, logo_data["amino_acid"], "")
+		logo_data["label_y"] = (logo_data["top"] + logo_data["bottom"]) / 2.0
+		logo_source = ColumnDataSource(logo_data)
+
+		logo_renderer = plot.quad(left = "left", right = "right", top = "top", bottom = "bottom", fill_color = "color",
+								  line_color = "white", line_width = 0.5, source = logo_source)
+		plot.text(x = "position", y = "label_y", text = "label", text_color = "white", text_align = "center",
+				  text_baseline = "middle", text_font_size = "9pt", source = logo_source)
+
+		hover_tooltips = [("Position", "@position"), ("Amino Acid", "@amino_acid"), ("Frequency", "@frequency{0.0%}")]
+		plot.add_tools(HoverTool(tooltips = hover_tooltips, renderers = [logo_renderer]))
+		plots.append(plot)
+
+	composition_plot = gridplot(plots, ncols = 1, toolbar_location = "right")
+
+	if png is not None:
+		export_png(composition_plot, png)
+
+	return composition_plot
+
+def CDR3_Property_Profile_Plot(clone_df, png = None, title = "", cdr_col = "CDR3_AA", split_col = None,
+							   count_col = None, cdr_length = None, figsize = (1000, 600), cdr3_matrices = None):
+	"""Creates hydrophobicity and charge profiles of the CDR3s: by position for one length, and by CDR3 length.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) (can be None if cdr3_matrices is given)
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	cdr_col, split_col, count_col, cdr_length, cdr3_matrices:
+		See CDR3_Composition_Plot
+	figsize: tuple of (int, int)
+		The width and height of the four plots together; default is (1000, 600)
+
+	Returns
+	----------
+	plot: bokeh GridBox
+		The positional (top) and by length (bottom) hydrophobicity (left) and charge (right) profiles
+	"""
+
+	if cdr3_matrices is None:
+		cdr3_matrices = CDR3_Length_Matrices(clone_df[cdr_col], clone_df[split_col] if split_col is not None else None,
+											 clone_df[count_col] if count_col is not None else None)
+	if cdr_length is None:
+		cdr_length = cdr3_matrices.Modal_Length()
+
+	samples = [str(sample) for sample in cdr3_matrices.groups]
+	sample_colors = Sample_Colors(len(samples), ["#1EA078", "#DC5A00", "#786EB4", "#E6288C", "#B4D28C", "#A028B4"])
+
+	profiles = [
+		(cdr3_matrices.Positional_Property(cdr_length, "hydrophobicity"), "CDR3 Position (Length {0})".format(cdr_length),
+		 "Mean Hydropathy"),
+		(cdr3_matrices.Positional_Property(cdr_length, "charge"), "CDR3 Position (Length {0})".format(cdr_length),
+		 "Mean Charge"),
+		(cdr3_matrices.Property_By_Length("hydrophobicity", mean = True), "CDR3 Length", "Mean Hydropathy"),
+		(cdr3_matrices.Property_By_Length("charge"), "CDR3 Length", "Net Charge")
+	]
+
+	plots = []
+	for profile_df, x_label, y_label in profiles:
+		figure_params = {
+			"plot_width": figsize[0] // 2,
+			"plot_height": figsize[1] // 2,
+			"title": title if not plots else None,
+			"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
+			"toolbar_location": "right"
+		}
+		plot = figure(**figure_params)
+		plot.xgrid.grid_line_color = None
+		plot.xaxis.axis_label = x_label
+		plot.yaxis.axis_label = y_label
+
+		#All samples' profiles are drawn with one renderer; lengths without clones are left out of each line
+		profile_xs = []
+		profile_ys = []
+		for _, profile in profile_df.iterrows():
+			profile = profile.dropna()
+			profile_xs.append(profile.index.values)
+			profile_ys.append(profile.values)
+		profile_data = {"xs": profile_xs, "ys": profile_ys, "color": list(sample_colors)[:len(samples)],
+						"sample": samples}
+		profile_renderer = plot.multi_line(xs = "xs", ys = "ys", line_color = "color", line_width = 2,
+										   legend = "sample", source = ColumnDataSource(profile_data))
+		plot.add_tools(HoverTool(tooltips = [("Sample", "@sample"), (y_label, "$y{0.00}")],
+								 renderers = [profile_renderer]))
+		plot.legend.visible = len(plots) == 0 and len(samples) > 1
+		plots.append(plot)
+
+	profile_plot = gridplot(plots, ncols = 2, toolbar_location = "right")
+
+	if png is not None:
+		export_png(profile_plot, png)
+
+	return profile_plot
+
 def Rarefaction_Plot(align_df, png = None, title = "", cdr_col = "CDR3_AA", split_col = None, cdr_identity = 0.96,
 					 steps = 50, reads = None, figsize = (800, 600), hover_tooltip = True, save_to_file = False):
 	figure_params = {
@@ -290,8 +687,8 @@ def Rarefaction_Plot(align_df, png = None, title = "", cdr_col = "CDR3_AA", spli
 		samples = ["Repertoire"]
 		reads_dfs = [align_df[[cdr_col]]]
 
-	sample_colors = ["#1EA078", "#DC5A00", "#786EB4", "#E6288C", "#B4D28C", "#A028B4"]
-	for sample, df, color in zip(samples, reads_dfs, sample_colors[:len(samples)]):
+	sample_colors = Sample_Colors(len(samples), ["#1EA078", "#DC5A00", "#786EB4", "#E6288C", "#B4D28C", "#A028B4"])
+	for sample, df, color in zip(samples, reads_dfs, sample_colors):
 		total_reads = len(df)
 		subsamp_sizes = []
 		cur_total = 0
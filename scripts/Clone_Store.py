@@ -0,0 +1,273 @@
+import os
+import json
+
+import numpy
+import pandas
+from numpy.lib.format import open_memmap
+from pandas.api.types import is_categorical_dtype, is_numeric_dtype, is_bool_dtype
+
+from .Repertoire_Data import Category_Codes
+
+class Clone_Store(object):
+	def __init__(self, store_dir):
+		"""Opens an on-disk columnar clone store (written with Clone_Store.Create) for memory-mapped access.
+
+		Rows are sorted by sample, so every sample is one contiguous row range of each column. Numeric columns are .npy
+		files, categorical columns .npy codes with their categories in the store metadata, and string columns an
+		offsets .npy and a UTF-8 bytes .npy; all are memory-mapped, so reading some samples only reads their bytes.
+
+		Parameters
+		----------
+		store_dir: str
+			Directory of the store
+		"""
+
+		self.store_dir = store_dir
+		with open(os.path.join(store_dir, "store.json"), "r") as metadata_file:
+			metadata = json.load(metadata_file)
+
+		self.columns = metadata["columns"]
+		self.samples = metadata["samples"]
+		self.sample_col = metadata["sample_col"]
+		self.sample_offsets = numpy.array(metadata["sample_offsets"], dtype = numpy.int64)
+		self.total_rows = int(self.sample_offsets[-1])
+		self._arrays = {}
+
+	@classmethod
+	def Create(cls, clone_dfs, store_dir, sample_col = "Sample", columns = None, categorical_cols = None):
+		"""Writes repertoire DataFrame(s) to a new columnar clone store, sorted by sample.
+
+		Parameters
+		----------
+		clone_dfs: pandas DataFrame or dict of {str: DataFrame}
+			Input repertoire(s) as a dict of sample name: DataFrame or a single DataFrame with the column sample_col
+		store_dir: str
+			Directory to write the store to (created if needed; existing store files are overwritten)
+		sample_col: str
+			Header / name for the column containing the sample names (for a single DataFrame); default is "Sample"
+		columns: list of str or None
+			Columns to store, or None for all columns (except sample_col); default is None
+		categorical_cols: list of str or None
+			String columns to store as categorical codes (for example genes and isotypes) in addition to the columns
+			that are already categorical; other string columns are stored as strings; default is None
+
+		Returns
+		----------
+		clone_store: Clone_Store
+			The opened store
+		"""
+
+		#The input is described as (sample, DataFrame, row positions or None) parts in store order
+		if isinstance(clone_dfs, dict):
+			parts = [(str(sample), df, None) for sample, df in clone_dfs.items()]
+			first_df = next(iter(clone_dfs.values()))
+		else:
+			if is_categorical_dtype(clone_dfs[sample_col]):
+				sample_series = clone_dfs[sample_col].cat.remove_unused_categories()
+				sample_codes, samples = sample_series.cat.codes.values, list(sample_series.cat.categories)
+			else:
+				sample_codes, samples = pandas.factorize(clone_dfs[sample_col], sort = True)
+
+			row_order = numpy.argsort(sample_codes, kind = "stable")
+			row_order = row_order[sample_codes[row_order] >= 0]
+			sample_bounds = numpy.searchsorted(sample_codes[row_order], numpy.arange(len(samples) + 1))
+			parts = [(str(sample), clone_dfs, row_order[start:stop])
+					 for sample, start, stop in zip(samples, sample_bounds[:-1], sample_bounds[1:])]
+			first_df = clone_dfs
+
+		if columns is None:
+			columns = [col for col in first_df.columns if col != sample_col]
+		categorical_cols = set(categorical_cols or [])
+
+		sample_lengths = [len(df) if rows is None else len(rows) for _, df, rows in parts]
+		sample_offsets = numpy.concatenate([[0], numpy.cumsum(sample_lengths)]).astype(numpy.int64)
+		total_rows = int(sample_offsets[-1])
+
+		if not os.path.isdir(store_dir):
+			os.makedirs(store_dir)
+
+		def Part_Values(col):
+			for (_, df, rows), start in zip(parts, sample_offsets[:-1]):
+				values = df[col] if rows is None else df[col].iloc[rows]
+				yield start, values
+
+		column_metadata = {}
+		for col in columns:
+			first_col = first_df[col]
+
+			if is_categorical_dtype(first_col) or col in categorical_cols:
+				#Categories are the union over all samples, so the codes are comparable between samples
+				part_categories = [Category_Codes(values)[1] for _, values in Part_Values(col)]
+				categories = pandas.Index(numpy.concatenate([part.values for part in part_categories])).unique()
+				codes = open_memmap(cls._Column_File(store_dir, col, "codes"), mode = "w+",
+									dtype = numpy.int32, shape = (total_rows,))
+				for start, values in Part_Values(col):
+					codes[start:start + len(values)] = pandas.Categorical(values, categories = categories).codes
+				codes.flush()
+				column_metadata[col] = {"kind": "categorical", "categories": categories.tolist()}
+
+			elif is_numeric_dtype(first_col) or is_bool_dtype(first_col):
+				dtype = numpy.result_type(*[values.dtype for _, values in Part_Values(col)])
+				column = open_memmap(cls._Column_File(store_dir, col, "values"), mode = "w+", dtype = dtype,
+									 shape = (total_rows,))
+				for start, values in Part_Values(col):
+					column[start:start + len(values)] = values.values
+				column.flush()
+				column_metadata[col] = {"kind": "numeric"}
+
+			else:
+				#Strings are concatenated UTF-8 bytes with the start offset of every row (missing values are empty)
+				offsets = open_memmap(cls._Column_File(store_dir, col, "offsets"), mode = "w+", dtype = numpy.int64,
+									  shape = (total_rows + 1,))
+				offsets[0] = 0
+				part_bytes = []
+				for start, values in Part_Values(col):
+					encoded = [value.encode("utf-8") if isinstance(value, str) else b"" for value in values.values]
+					offsets[start + 1:start + 1 + len(encoded)] = (offsets[start] +
+																   numpy.cumsum([len(value) for value in encoded]))
+					part_bytes.append(b"".join(encoded))
+				offsets.flush()
+
+				string_bytes = open_memmap(cls._Column_File(store_dir, col, "bytes"), mode = "w+", dtype = numpy.uint8,
+										   shape = (int(offsets[-1]),))
+				byte_start = 0
+				for part in part_bytes:
+					string_bytes[byte_start:byte_start + len(part)] = numpy.frombuffer(part, dtype = numpy.uint8)
+					byte_start += len(part)
+				string_bytes.flush()
+				column_metadata[col] = {"kind": "string"}
+
+		metadata = {"columns": column_metadata, "samples": [sample for sample, _, _ in parts], "sample_col": sample_col,
+					"sample_offsets": sample_offsets.tolist()}
+		with open(os.path.join(store_dir, "store.json"), "w") as metadata_file:
+			json.dump(metadata, metadata_file)
+
+		return cls(store_dir)
+
+	@staticmethod
+	def _Column_File(store_dir, col, part):
+		return os.path.join(store_dir, "{0}.{1}.npy".format(col, part))
+
+	def _Array(self, col, part):
+		"""Gets a column part's memory-mapped array, opened once."""
+
+		if (col, part) not in self._arrays:
+			self._arrays[(col, part)] = numpy.load(self._Column_File(self.store_dir, col, part), mmap_mode = "r")
+
+		return self._arrays[(col, part)]
+
+	def Sample_Range(self, sample):
+		"""Gets the (start, stop) row range of a sample."""
+
+		sample_idx = self.samples.index(str(sample))
+		return int(self.sample_offsets[sample_idx]), int(self.sample_offsets[sample_idx + 1])
+
+	def Sample_Clone_Counts(self):
+		"""Gets the number of rows (clones) of every sample as a Series."""
+
+		return pandas.Series(numpy.diff(self.sample_offsets), index = self.samples)
+
+	def Column(self, col, start = 0, stop = None):
+		"""Gets the values of one column for a row range; numeric and categorical columns are zero-copy views.
+
+		Parameters
+		----------
+		col: str
+			Column name
+		start, stop: int
+			Row range (see Sample_Range); default is all rows
+
+		Returns
+		----------
+		values: numpy memmap, pandas Categorical or numpy array of objects
+			Numeric values (a memory-mapped view), a Categorical over the memory-mapped codes or the decoded strings
+		"""
+
+		stop = self.total_rows if stop is None else stop
+		column_kind = self.columns[col]["kind"]
+
+		if column_kind == "numeric":
+			return self._Array(col, "values")[start:stop]
+
+		elif column_kind == "categorical":
+			codes = self._Array(col, "codes")[start:stop]
+			return pandas.Categorical.from_codes(codes, categories = self.columns[col]["categories"])
+
+		else:
+			offsets = numpy.asarray(self._Array(col, "offsets")[start:stop + 1])
+			string_bytes = self._Array(col, "bytes")[offsets[0]:offsets[-1]].tobytes()
+			offsets = offsets - offsets[0]
+			strings = numpy.array([string_bytes[row_start:row_stop].decode("utf-8")
+								   for row_start, row_stop in zip(offsets[:-1], offsets[1:])], dtype = object)
+			strings[offsets[:-1] == offsets[1:]] = numpy.nan
+			return strings
+
+	def Sample_DataFrame(self, sample, columns = None):
+		"""Gets one sample's rows as a DataFrame, reading only that sample's row range of the columns."""
+
+		start, stop = self.Sample_Range(sample)
+		columns = list(self.columns) if columns is None else columns
+
+		return pandas.DataFrame({col: self.Column(col, start, stop) for col in columns}, columns = columns)
+
+	def Sample_DataFrames(self, samples = None, columns = None):
+		"""Gets a dict of sample name: DataFrame for the given samples (default all), as Repertoire_Dashboard accepts."""
+
+		samples = self.samples if samples is None else [str(sample) for sample in samples]
+		return {sample: self.Sample_DataFrame(sample, columns) for sample in samples}
+
+	def To_DataFrame(self, samples = None, columns = None, sample_col = None):
+		"""Gets the rows of the given samples (default all) as one DataFrame with a categorical sample column.
+
+		Parameters
+		----------
+		samples: list of str or None
+			Samples to read (in store order), or None for all samples; default is None
+		columns: list of str or None
+			Columns to read, or None for all columns; default is None
+		sample_col: str or None
+			Header / name for the sample column, or None for the store's sample column name; default is None
+
+		Returns
+		----------
+		comparison_df: pandas DataFrame
+			The selected samples' rows, in store (sample) order
+		"""
+
+		sample_col = self.sample_col if sample_col is None else sample_col
+		columns = [col for col in (list(self.columns) if columns is None else columns) if col != sample_col]
+
+		if samples is None:
+			sample_idxs = numpy.arange(len(self.samples))
+		else:
+			selected = set([str(sample) for sample in samples])
+			missing = selected.difference(self.samples)
+			if missing:
+				raise KeyError("Samples not found in the clone store: {0}".format(", ".join(sorted(missing))))
+			sample_idxs = numpy.array([idx for idx, sample in enumerate(self.samples) if sample in selected])
+
+		#Adjacent selected samples are read as one row range
+		row_ranges = []
+		for sample_idx in sample_idxs:
+			start, stop = self.sample_offsets[sample_idx], self.sample_offsets[sample_idx + 1]
+			if row_ranges and row_ranges[-1][1] == start:
+				row_ranges[-1][1] = stop
+			else:
+				row_ranges.append([start, stop])
+
+		comparison_df = pandas.DataFrame(index = pandas.RangeIndex(sum([stop - start for start, stop in row_ranges])))
+		for col in columns:
+			range_values = [self.Column(col, start, stop) for start, stop in row_ranges]
+			if self.columns[col]["kind"] == "categorical":
+				comparison_df[col] = pandas.Categorical.from_codes(numpy.concatenate([values.codes
+																					  for values in range_values]),
+																   categories = self.columns[col]["categories"])
+			else:
+				comparison_df[col] = numpy.concatenate(range_values) if range_values else []
+
+		sample_lengths = numpy.diff(self.sample_offsets)[sample_idxs]
+		sample_codes = numpy.repeat(numpy.arange(len(sample_idxs), dtype = numpy.int32), sample_lengths)
+		comparison_df[sample_col] = pandas.Categorical.from_codes(sample_codes,
+																  categories = [self.samples[idx] for idx in sample_idxs])
+
+		return comparison_df
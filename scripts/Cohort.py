@@ -0,0 +1,319 @@
+import os
+import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+import pandas
+
+from .Repertoire_Data import Sample_Set_Keys, Repertoire_Sample_Name
+
+#Fixed SHM sketch bins (fraction of mutated positions), so sketches from any file can be merged by adding them
+shm_sketch_bins = numpy.linspace(0.0, 1.0, 1001)
+
+def _Add_Counts(total_counts, counts):
+	"""Adds two Series of counts by index (either can be None for no counts yet)."""
+
+	if total_counts is None:
+		return counts
+	elif counts is None:
+		return total_counts
+
+	return total_counts.add(counts, fill_value = 0)
+
+def _Map_Repertoire_File(file_idx, filename, sample, shard_dir, n_shards, columns, sep, chunksize):
+	"""Reads one repertoire file in chunks and computes its mergeable partial aggregates (runs in a worker process).
+
+	The clone IDs are hashed and split into n_shards membership shard files; everything else is returned.
+	"""
+
+	clone_col, vgene_col, jgene_col, count_col, shm_cols = columns
+	usecols = [col for col in [clone_col, vgene_col, jgene_col, count_col] + list(shm_cols) if col is not None]
+
+	partial = {
+		"sample": sample,
+		"vj_counts": None,
+		"abundance_counts": None,
+		"shm_sketches": {col: numpy.zeros(len(shm_sketch_bins) - 1, dtype = numpy.int64) for col in shm_cols},
+		"total_clones": 0
+	}
+	shard_hashes = [[] for _ in range(n_shards)]
+
+	#Clone IDs are read as strings so the same clone hashes identically in every file
+	repertoire_chunks = pandas.read_csv(filename, sep = sep, usecols = usecols, dtype = {clone_col: str},
+										chunksize = chunksize)
+	for chunk in repertoire_chunks:
+		clone_hashes = pandas.util.hash_array(chunk[clone_col].values.astype(object))
+		clone_shards = clone_hashes % numpy.uint64(n_shards)
+		for shard in numpy.unique(clone_shards):
+			shard_hashes[shard].append(clone_hashes[clone_shards == shard])
+
+		if vgene_col is not None and jgene_col is not None:
+			chunk_vj_counts = chunk.groupby([vgene_col, jgene_col])[count_col].sum()
+			partial["vj_counts"] = _Add_Counts(partial["vj_counts"], chunk_vj_counts)
+
+		chunk_abundance_counts = chunk[count_col].value_counts()
+		partial["abundance_counts"] = _Add_Counts(partial["abundance_counts"], chunk_abundance_counts)
+
+		for col in shm_cols:
+			partial["shm_sketches"][col] += numpy.histogram(chunk[col].dropna(), bins = shm_sketch_bins)[0]
+
+	for shard, hashes in enumerate(shard_hashes):
+		if hashes:
+			hashes = numpy.unique(numpy.concatenate(hashes))
+			partial["total_clones"] += len(hashes)
+			numpy.save(os.path.join(shard_dir, "shard{0:05d}_file{1:06d}.npy".format(shard, file_idx)), hashes)
+
+	return partial
+
+def _Reduce_Membership_Shard(shard, shard_dir, total_files, sample_keys, min_shared, max_shared):
+	"""Counts the clones of one membership shard shared by each set of samples (runs in a worker process).
+
+	Each sample set is identified by the (wrapping) sum of random 64-bit keys of its samples, so sets are counted with
+	sorting and reductions instead of building a set of sample names per clone.
+	"""
+
+	shard_files = []
+	for file_idx in range(total_files):
+		shard_filename = os.path.join(shard_dir, "shard{0:05d}_file{1:06d}.npy".format(shard, file_idx))
+		if os.path.isfile(shard_filename):
+			shard_files.append((file_idx, numpy.load(shard_filename)))
+
+	if not shard_files:
+		return {}
+
+	hashes = numpy.concatenate([file_hashes for _, file_hashes in shard_files])
+	file_idxs = numpy.concatenate([numpy.full(len(file_hashes), file_idx, dtype = numpy.int64)
+								   for file_idx, file_hashes in shard_files])
+
+	#A stable sort keeps the samples of each clone in input file order
+	sort_order = numpy.argsort(hashes, kind = "stable")
+	hashes = hashes[sort_order]
+	file_idxs = file_idxs[sort_order]
+
+	_, clone_starts, sample_counts = numpy.unique(hashes, return_index = True, return_counts = True)
+	with numpy.errstate(over = "ignore"):
+		set_keys = numpy.add.reduceat(sample_keys[file_idxs], clone_starts)
+
+	shared = numpy.ones(len(clone_starts), dtype = bool)
+	if min_shared is not None:
+		shared &= sample_counts >= min_shared
+	if max_shared is not None:
+		shared &= sample_counts <= max_shared
+
+	unique_keys, first_clones, set_counts = numpy.unique(set_keys[shared], return_index = True, return_counts = True)
+	set_starts = clone_starts[shared][first_clones]
+	set_sizes = sample_counts[shared][first_clones]
+
+	#Keep one representative list of file indices per sample set
+	return {int(set_key): (file_idxs[start:start + size].tolist(), int(count))
+			for set_key, start, size, count in zip(unique_keys, set_starts, set_sizes, set_counts)}
+
+class Cohort_Aggregate(object):
+	def __init__(self, samples, clone_col = "CloneID", vgene_col = "VGene", jgene_col = "JGene",
+				 count_col = "Clustered", sample_col = "Sample"):
+		"""Creates an empty container of merged cohort-level aggregates for a list of samples.
+
+		Parameters
+		----------
+		samples: list of str
+			Names of the cohort samples, in input file order
+		clone_col, vgene_col, jgene_col, count_col, sample_col: str
+			Column names used for the DataFrames given to the plots
+		"""
+
+		self.samples = list(samples)
+		self.clone_col = clone_col
+		self.vgene_col = vgene_col
+		self.jgene_col = jgene_col
+		self.count_col = count_col
+		self.sample_col = sample_col
+
+		self.vj_counts = {}
+		self.abundance_counts = {}
+		self.shm_sketches = {}
+		self.total_clones = pandas.Series(0, index = self.samples, dtype = numpy.int64)
+		self._shared_sets = {}
+
+	def Merge_Partial(self, partial):
+		"""Adds the partial aggregates of one repertoire file (or chunk) to the cohort aggregates."""
+
+		sample = partial["sample"]
+
+		if sample in self.vj_counts:
+			self.vj_counts[sample] = _Add_Counts(self.vj_counts[sample], partial["vj_counts"])
+			self.abundance_counts[sample] = _Add_Counts(self.abundance_counts[sample], partial["abundance_counts"])
+			for col in partial["shm_sketches"]:
+				self.shm_sketches[sample][col] = self.shm_sketches[sample][col] + partial["shm_sketches"][col]
+		else:
+			self.vj_counts[sample] = partial["vj_counts"]
+			self.abundance_counts[sample] = partial["abundance_counts"]
+			self.shm_sketches[sample] = dict(partial["shm_sketches"])
+
+		self.total_clones[sample] += partial["total_clones"]
+
+	def Merge_Shared_Sets(self, shared_sets):
+		"""Adds the shared sample set clone counts of one membership shard to the cohort aggregates."""
+
+		for set_key, (file_idxs, count) in shared_sets.items():
+			if set_key in self._shared_sets:
+				self._shared_sets[set_key][1] += count
+			else:
+				self._shared_sets[set_key] = [file_idxs, count]
+
+	def Overlap_Counts(self):
+		"""Gets the total clones shared by each set of samples, as used by Repertoire_Upset_Plot.
+
+		Returns
+		----------
+		overlap_counts: pandas Series
+			Shared clone counts indexed by the JSON list of sample names of each set, largest first
+		"""
+
+		set_names = [json.dumps([self.samples[file_idx] for file_idx in file_idxs])
+					 for file_idxs, _ in self._shared_sets.values()]
+		overlap_counts = pandas.Series([count for _, count in self._shared_sets.values()], index = set_names,
+									   dtype = numpy.int64)
+
+		return overlap_counts.sort_values(ascending = False)
+
+	def VJ_Counts_DataFrame(self, sample = None):
+		"""Gets the V-J gene pair counts of one sample (or of the whole cohort if None) for VJ_Gene_Plot."""
+
+		if sample is not None:
+			vj_counts = self.vj_counts[sample]
+		else:
+			vj_counts = pandas.concat([counts for counts in self.vj_counts.values() if counts is not None])
+			vj_counts = vj_counts.groupby(level = [0, 1]).sum()
+
+		vj_df = vj_counts.rename(self.count_col).reset_index()
+		vj_df.columns = [self.vgene_col, self.jgene_col, self.count_col]
+
+		return vj_df
+
+	def Abundance_DataFrame(self, weight_col = "Clones"):
+		"""Gets the clone abundance histograms of all samples for Diversity_Plot (with weight_col).
+
+		Returns
+		----------
+		abundance_df: pandas DataFrame
+			DataFrame of clone count (count_col), number of clones with that count (weight_col) and sample (sample_col)
+		"""
+
+		abundance_dfs = []
+		for sample in self.samples:
+			abundance_counts = self.abundance_counts[sample].sort_index().astype(numpy.int64)
+			abundance_dfs.append(pandas.DataFrame({
+				self.count_col: abundance_counts.index.values,
+				weight_col: abundance_counts.values,
+				self.sample_col: sample
+			}))
+
+		return pandas.concat(abundance_dfs, ignore_index = True)
+
+	def SHM_Quantiles(self, shm_col, quantiles = (0.25, 0.5, 0.75)):
+		"""Estimates SHM quantiles of every sample from its SHM sketch (to the sketch bin width of 0.001).
+
+		Returns
+		----------
+		shm_quantiles: pandas DataFrame
+			DataFrame of samples x quantiles
+		"""
+
+		shm_quantiles = {}
+		for sample in self.samples:
+			cumulative_counts = numpy.cumsum(self.shm_sketches[sample][shm_col])
+			total_counts = max(cumulative_counts[-1], 1)
+			quantile_bins = numpy.searchsorted(cumulative_counts, numpy.asarray(quantiles) * total_counts)
+			shm_quantiles[sample] = shm_sketch_bins[numpy.minimum(quantile_bins + 1, len(shm_sketch_bins) - 1)]
+
+		return pandas.DataFrame.from_dict(shm_quantiles, orient = "index", columns = list(quantiles))
+
+def Cohort_Aggregate_Files(filenames, sample_names = None, clone_col = "CloneID", vgene_col = "VGene",
+						   jgene_col = "JGene", count_col = "Clustered", shm_cols = ("V_SHM", "J_SHM"),
+						   sample_col = "Sample", min_shared = 2, max_shared = None, sep = "\t", chunksize = 500000,
+						   n_shards = 64, n_jobs = 4, work_dir = None):
+	"""Aggregates a cohort of repertoire files with bounded memory, processing the files in worker processes.
+
+	Every file is read in chunks by a worker process which returns its V-J gene pair counts, clone abundance
+	histogram and SHM sketches and writes its hashed clone IDs to membership shard files; the shards are then reduced
+	in worker processes to the clones shared by each set of samples. Memory use is set by chunksize and the size of
+	one shard instead of the size of the cohort.
+
+	Parameters
+	----------
+	filenames: list of str
+		Delimited repertoire files, one per sample
+	sample_names: list of str or None
+		Sample name for each file, or None to use the file names without (compression) extensions; default is None
+	clone_col: str
+		Header / name for the column containing the clone IDs (shared between samples); default is "CloneID"
+	vgene_col: str or None
+		Header / name for the column containing the V genes, or None to skip V-J counts; default is "VGene"
+	jgene_col: str or None
+		Header / name for the column containing the J genes, or None to skip V-J counts; default is "JGene"
+	count_col: str
+		Header / name for the column containing the clone counts; default is "Clustered"
+	shm_cols: iterable of str
+		Columns of SHM levels to sketch; default is ("V_SHM", "J_SHM")
+	sample_col: str
+		Header / name for the sample column of the DataFrames given to the plots; default is "Sample"
+	min_shared: int or None
+		Minimum number of samples a clone must be in to be counted as shared; default is 2
+	max_shared: int or None
+		Maximum number of samples a clone can be in to be counted as shared; default is None
+	sep: str
+		Delimiter of the repertoire files; default is "\\t"
+	chunksize: int
+		Number of rows read from a file at a time; default is 500000
+	n_shards: int
+		Number of clone membership shards; default is 64
+	n_jobs: int
+		Number of worker processes; default is 4
+	work_dir: str or None
+		Directory for the membership shard files, or None to use (and remove) a temporary directory; default is None
+
+	Returns
+	----------
+	cohort: Cohort_Aggregate
+		The merged cohort aggregates; for example cohort.Overlap_Counts() and cohort.total_clones for
+		Repertoire_Upset_Plot, cohort.Abundance_DataFrame() for Diversity_Plot (weight_col = "Clones") and
+		cohort.VJ_Counts_DataFrame() for VJ_Gene_Plot
+	"""
+
+	if sample_names is None:
+		sample_names = [Repertoire_Sample_Name(filename) for filename in filenames]
+	if len(set(sample_names)) != len(filenames):
+		raise ValueError("Every repertoire file must have a unique sample name!")
+
+	shard_dir = work_dir if work_dir is not None else tempfile.mkdtemp(prefix = "cohort_shards_")
+	if not os.path.isdir(shard_dir):
+		os.makedirs(shard_dir)
+
+	columns = (clone_col, vgene_col, jgene_col, count_col, tuple(shm_cols))
+	cohort = Cohort_Aggregate(sample_names, clone_col = clone_col, vgene_col = vgene_col, jgene_col = jgene_col,
+							  count_col = count_col, sample_col = sample_col)
+
+	#Random 64-bit keys identify the samples of each shared set within the shard reductions
+	sample_keys = Sample_Set_Keys(len(filenames))
+
+	try:
+		with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+			map_jobs = [executor.submit(_Map_Repertoire_File, file_idx, filename, sample, shard_dir, n_shards, columns,
+										sep, chunksize)
+						for file_idx, (filename, sample) in enumerate(zip(filenames, sample_names))]
+			for map_job in map_jobs:
+				cohort.Merge_Partial(map_job.result())
+
+			reduce_jobs = [executor.submit(_Reduce_Membership_Shard, shard, shard_dir, len(filenames), sample_keys,
+										   min_shared, max_shared)
+						   for shard in range(n_shards)]
+			for reduce_job in reduce_jobs:
+				cohort.Merge_Shared_Sets(reduce_job.result())
+
+	finally:
+		if work_dir is None:
+			shutil.rmtree(shard_dir, ignore_errors = True)
+
+	return cohort
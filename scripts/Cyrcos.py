@@ -2,54 +2,46 @@ import numpy
 from itertools import combinations
 
 from bokeh.plotting import figure
-from bokeh.models import Range1d, ColumnDataSource
+from bokeh.models import Range1d, ColumnDataSource, HoverTool, TapTool
 from bokeh.palettes import all_palettes
 from bokeh.io import save, show
 from bokeh.embed import components
 
+from .Raster import Rasterize_Quadratic_Links
+from .Gene_Colors import Sample_Colors
+from .Abundance_Matrix import Clone_Abundance_Matrix
+
 class Cyrcos_Repertoire_Comparison_Plot(object):
 	def __init__(self, clone_dfs, title = "", top_clones = None, normalize_segments = True, gap_size = 10,
 				 start_pos = "top", clockwise = True, offset_segments = None, segment_face_colors = "Category10",
 				 segment_outline_colors = None, fade_segments = True, clone_col = "CloneID", count_col = "Clustered",
-				 sample_col = "Sample", figsize = (1000, 1000)):
-		"""Creates a Circos-like Chord graph for comparing multiple immune repertoire clonotype profiles."""
+				 sample_col = "Sample", figsize = (1000, 1000), raster_links = False, raster_size = None,
+				 raster_hover_clones = 100, n_jobs = 4, abundance_matrix = None, clone_details = False):
+		"""Creates a Circos-like Chord graph for comparing multiple immune repertoire clonotype profiles.
+
+		The clone counts can also be given as a prebuilt Clone_Abundance_Matrix (abundance_matrix), in which case
+		clone_dfs can be None. With clone_details, both ends of every link get a point carrying only the clone ID,
+		which can be tapped to show the full clone records from a Bokeh server (see Clone_Detail_Panel).
+		"""
 
 		#Plot visual aspect definitions
 		segment_width = 0.07 #Thickness of the circle arc segments
 		offset_shift_amount = 0.1 #Increase in radius for segments to offset
 		min_segment_alpha = 0.2
 
-		#Gather the samples and their respective DataFrames
-		df_cols = [clone_col, count_col]
-		self.samples = []
-		comparison_dfs = []
-		if isinstance(clone_dfs, dict): #Input is a dictionary of {sample_name: DataFrame}
-			for sample in clone_dfs:
-				self.samples.append(sample)
-				clone_df = clone_dfs[sample][df_cols].sort_values([count_col], ascending = [False])
-
-				if top_clones is not None:
-					clone_df = clone_df.head(top_clones)
-
-				comparison_dfs.append(clone_df)
-
-		else: #Input is a single DataFrame with all samples; sample_col gives the sample to split on
-			df_cols.append(sample_col)
-			for sample, df in clone_dfs[df_cols].groupby([sample_col]):
-				self.samples.append(sample)
-				clone_df = df.sort_values([count_col], ascending = [False])
-
-				if top_clones is not None:
-					clone_df = clone_df.head(top_clones)
-
-				comparison_dfs.append(clone_df)
+		#Rank the clones of every sample from the sparse clone x sample matrix (largest clone being rank 0)
+		if abundance_matrix is None:
+			abundance_matrix = Clone_Abundance_Matrix.From_DataFrame(clone_dfs, clone_col = clone_col,
+																	 sample_col = sample_col, count_col = count_col)
+		self.samples = abundance_matrix.samples
+		ranked_rows = [abundance_matrix.Sample_Ranks(sample, top_clones = top_clones)[0] for sample in self.samples]
 
 		self.total_samples = len(self.samples)
 
 		#Create the figure plot
 		self.Create_Plot(title = title, figsize = figsize)
 
-		sample_clone_counts = [len(df) for df in comparison_dfs]
+		sample_clone_counts = [len(rows) for rows in ranked_rows]
 		total_gap_size = gap_size * self.total_samples
 		total_segment_len = 360 - total_gap_size
 
@@ -91,7 +83,7 @@ class Cyrcos_Repertoire_Comparison_Plot(object):
 
 		if isinstance(segment_face_colors, str):
 			if segment_face_colors in all_palettes:
-				self.segment_face_colors = all_palettes[segment_face_colors][self.total_samples]
+				self.segment_face_colors = Sample_Colors(self.total_samples, segment_face_colors)
 			else:
 				self.segment_face_colors = [segment_face_colors] * self.total_samples
 		elif hasattr(segment_face_colors, "__iter__") and not isinstance(segment_face_colors, str):
@@ -102,7 +94,7 @@ class Cyrcos_Repertoire_Comparison_Plot(object):
 		else:
 			print("Warning: segment_face_colors should be a colormap or list of colors for each segment!")
 			print("Defaulting to \"Category10\"...")
-			self.segment_face_colors = all_palettes["Category10"][self.total_samples]
+			self.segment_face_colors = Sample_Colors(self.total_samples, "Category10")
 
 		if segment_outline_colors is None:
 			self.segment_outline_colors = ["transparent"] * self.total_samples
@@ -116,14 +108,9 @@ class Cyrcos_Repertoire_Comparison_Plot(object):
 		#Add the repertoire circle segments to the figure
 		self.Create_Segments(start_position, gap_size, clockwise, fade_segments, min_alpha = min_segment_alpha)
 
-		#Add rank and segment position columns to the clone DataFrames
-		for idx, _ in enumerate(comparison_dfs):
-			#Rank clones by total count / frequency (largest clone being rank 0, second largest rank 1, etc.)
-			clone_ranks = comparison_dfs[idx][count_col].rank(method = "first", ascending = False).astype(int)
-			comparison_dfs[idx]["Rank"] = clone_ranks - 1
-
-			#Convert the rank to a relative position from 0.0 to 1.0 for placement along the segments
-			comparison_dfs[idx]["Position"] = comparison_dfs[idx]["Rank"] / len(comparison_dfs[idx])
+		#The links of all sample pairs are collected and drawn afterwards with one renderer (or one image in raster mode)
+		link_coords = {"x0": [], "y0": [], "x1": [], "y1": []}
+		hover_points = {"x": [], "y": [], "CloneID": [], "Sample": [], "Rank": []}
 
 		#Iterate through all combinations of two samples and create the links from clone to clone
 		for comb in combinations(range(self.total_samples), 2):
@@ -131,18 +118,20 @@ class Cyrcos_Repertoire_Comparison_Plot(object):
 			idx2 = comb[1]
 			sample1 = self.samples[idx1]
 			sample2 = self.samples[idx2]
-			sample_df1 = comparison_dfs[idx1].set_index([clone_col])
-			sample_df2 = comparison_dfs[idx2].set_index([clone_col])
 
-			#Join the samples into a DataFrame containing only the shared clones and their positions
-			joined_df = sample_df1.join(sample_df2, how = "inner", lsuffix = "1", rsuffix = "2")
+			#Find the shared clones; their positions in the ranked rows of each sample are their ranks
+			shared_rows, ranks1, ranks2 = numpy.intersect1d(ranked_rows[idx1], ranked_rows[idx2], assume_unique = True,
+															return_indices = True)
+			if len(shared_rows) == 0:
+				continue
 
 			#Calculate the angular position for the clones (segment start location + clone position * segment length)
 			#If the plot is drawn clockwise, subtract the segment start instead of adding it
 			seg1_start = -self.segment_starts[idx1] if self.direction == "clock" else self.segment_starts[idx1]
 			seg2_start = -self.segment_starts[idx2] if self.direction == "clock" else self.segment_starts[idx2]
-			pos1 = joined_df["Position1"] * self.segment_lengths[idx1] + seg1_start
-			pos2 = joined_df["Position2"] * self.segment_lengths[idx2] + seg2_start
+			#Convert the ranks to relative positions from 0.0 to 1.0 for placement along the segments
+			pos1 = ranks1 / len(ranked_rows[idx1]) * self.segment_lengths[idx1] + seg1_start
+			pos2 = ranks2 / len(ranked_rows[idx2]) * self.segment_lengths[idx2] + seg2_start
 
 			#Convert the positions to the start and end xy coordinates
 			inner_rad1 = self.inner_radii[idx1]
@@ -159,12 +148,51 @@ class Cyrcos_Repertoire_Comparison_Plot(object):
 				"x1": xs2,
 				"y1": ys2
 			}
-			link_source = ColumnDataSource(link_data)
+			for coord in link_coords:
+				link_coords[coord].append(numpy.asarray(link_data[coord], dtype = float))
+
+			if raster_links or clone_details:
+				#Keep hover points at both link ends for the top ranked shared clones (all links for clone details)
+				if clone_details:
+					top_links = numpy.ones(len(shared_rows), dtype = bool)
+				else:
+					top_links = numpy.minimum(ranks1, ranks2) < raster_hover_clones
+				for xs, ys, sample, ranks in ((xs1, ys1, sample1, ranks1), (xs2, ys2, sample2, ranks2)):
+					hover_points["x"] += numpy.asarray(xs)[top_links].tolist()
+					hover_points["y"] += numpy.asarray(ys)[top_links].tolist()
+					hover_points["CloneID"] += abundance_matrix.clones[shared_rows[top_links]].tolist()
+					hover_points["Sample"] += [sample] * int(top_links.sum())
+					hover_points["Rank"] += (ranks[top_links] + 1).tolist()
+
+		has_links = sum([len(xs) for xs in link_coords["x0"]]) > 0
+		if has_links:
+			link_coords = {coord: numpy.concatenate(link_coords[coord]) for coord in link_coords}
+
+		if has_links and not raster_links:
+			link_source = ColumnDataSource(link_coords)
 
 			#Plot the links matching clone positions between repertoires; control points are the center of the circle
 			self.plot.quadratic(x0 = "x0", y0 = "y0", x1 = "x1", y1 = "y1", cx = 0.5, cy = 0.5, source = link_source,
 								color = "black", line_width = 1)
 
+		elif has_links and raster_links:
+			if raster_size is None:
+				raster_size = figsize
+
+			link_image = Rasterize_Quadratic_Links(link_coords["x0"], link_coords["y0"], link_coords["x1"],
+												   link_coords["y1"], 0.5, 0.5, raster_size,
+												   bounds = (-0.5, 1.5, -0.5, 1.5), n_jobs = n_jobs)
+			self.plot.image_rgba(image = [link_image], x = -0.5, y = -0.5, dw = 2.0, dh = 2.0)
+
+		if has_links and (raster_links or clone_details):
+			hover_source = ColumnDataSource(hover_points, name = "clone_links" if clone_details else None)
+			link_ends = self.plot.circle(x = "x", y = "y", radius = 0.004, fill_color = "black", line_color = None,
+										 source = hover_source, name = "link_hover")
+			hover_tooltips = [("Clone ID", "@CloneID"), ("Sample", "@Sample"), ("Rank", "@Rank")]
+			self.plot.add_tools(HoverTool(tooltips = hover_tooltips, names = ["link_hover"]))
+			if clone_details:
+				self.plot.add_tools(TapTool(renderers = [link_ends]))
+
 	def Create_Plot(self, title, figsize):
 		plot_params = {
 			"plot_width": figsize[0],
@@ -0,0 +1,204 @@
+import os
+import glob
+import json
+import hashlib
+import inspect
+import tempfile
+
+import pandas
+
+import bokeh
+from bokeh.document import Document
+from bokeh.util.serialization import make_id
+
+class Dashboard_Section_Cache(object):
+	def __init__(self, cache_dir = None):
+		"""Creates an on-disk cache of serialized Bokeh dashboard sections keyed by a fingerprint of their inputs.
+
+		Parameters
+		----------
+		cache_dir: str or None
+			Directory to store the cached section JSON documents in, or None to disable caching; default is None
+		"""
+
+		self.cache_dir = cache_dir
+		self.hits = []
+		self.misses = []
+		self._source_hashes = {}
+
+		if self.cache_dir is not None and not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+
+	def Code_Version(self, code):
+		"""Hashes the source file(s) defining the given functions/classes so code changes invalidate cached sections.
+
+		Every module of the scripts package is hashed too, since sections also depend on the helpers they call.
+
+		Parameters
+		----------
+		code: function/class or list of functions/classes
+			The code objects used to build a dashboard section
+
+		Returns
+		----------
+		code_version: str
+			Hex digest of the Bokeh version, the scripts package modules and the source files of the code objects
+		"""
+
+		if not isinstance(code, (list, tuple)):
+			code = [code]
+
+		package_files = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+		source_files = package_files + [inspect.getsourcefile(code_obj) for code_obj in code]
+
+		code_hash = hashlib.sha1(bokeh.__version__.encode("utf-8"))
+		for source_file in source_files:
+			if source_file not in self._source_hashes:
+				with open(source_file, "rb") as source:
+					self._source_hashes[source_file] = hashlib.sha1(source.read()).hexdigest()
+			code_hash.update(self._source_hashes[source_file].encode("utf-8"))
+
+		return code_hash.hexdigest()
+
+	def Fingerprint(self, section, clone_df = None, data_cols = None, params = None, code = None):
+		"""Calculates the fingerprint of a dashboard section from its input columns, parameters and code version.
+
+		Parameters
+		----------
+		section: str
+			Name of the dashboard section (for example "Mosaic_Sample1")
+		clone_df: pandas DataFrame or None
+			DataFrame containing the section's input data; default is None
+		data_cols: list of str or None
+			Columns of clone_df the section depends on, or None to use every column; default is None
+		params: dict or None
+			Keyword parameters of the section; values must be JSON serializable or have a stable str(); default is None
+		code: function/class or list of functions/classes or None
+			The code objects used to build the section; default is None
+
+		Returns
+		----------
+		fingerprint: str
+			Hex digest uniquely identifying the section inputs
+		"""
+
+		fingerprint = hashlib.sha1(section.encode("utf-8"))
+
+		if code is not None:
+			fingerprint.update(self.Code_Version(code).encode("utf-8"))
+
+		if params is not None:
+			fingerprint.update(json.dumps(params, sort_keys = True, default = str).encode("utf-8"))
+
+		if clone_df is not None:
+			if data_cols is not None:
+				clone_df = clone_df[[col for col in data_cols if col is not None]]
+
+			fingerprint.update(json.dumps([str(col) for col in clone_df.columns]).encode("utf-8"))
+			row_hashes = pandas.util.hash_pandas_object(clone_df, index = False).values
+			fingerprint.update(row_hashes.tobytes())
+
+		return fingerprint.hexdigest()
+
+	def Get_Section(self, section, build_func, clone_df = None, data_cols = None, params = None, code = None):
+		"""Loads a dashboard section from the cache if its inputs are unchanged, otherwise builds and caches it.
+
+		Parameters
+		----------
+		section: str
+			Name of the dashboard section (for example "Mosaic_Sample1")
+		build_func: function
+			Function with no arguments which builds and returns the section's Bokeh model
+		clone_df: pandas DataFrame or None
+			DataFrame containing the section's input data; default is None
+		data_cols: list of str or None
+			Columns of clone_df the section depends on, or None to use every column; default is None
+		params: dict or None
+			Keyword parameters of the section; default is None
+		code: function/class or list of functions/classes or None
+			The code objects used to build the section; default is build_func
+
+		Returns
+		----------
+		model: bokeh Model
+			The built or cached section Bokeh model (plot, layout, etc.)
+		"""
+
+		if self.cache_dir is None:
+			return build_func()
+
+		if code is None:
+			code = build_func
+
+		fingerprint = self.Fingerprint(section, clone_df = clone_df, data_cols = data_cols, params = params,
+									   code = code)
+		cache_path = os.path.join(self.cache_dir, fingerprint + ".json")
+
+		if os.path.isfile(cache_path):
+			with open(cache_path, "r") as cache_file:
+				model = self.Deserialize_Model(cache_file.read())
+			self.hits.append(section)
+
+		else:
+			model = build_func()
+			#Write to a unique temporary file first so an interrupted (or concurrent) rebuild never leaves a truncated
+			#cache entry
+			with tempfile.NamedTemporaryFile("w", dir = self.cache_dir, suffix = ".tmp", delete = False) as cache_file:
+				try:
+					cache_file.write(self.Serialize_Model(model))
+				except BaseException:
+					cache_file.close()
+					os.remove(cache_file.name)
+					raise
+			os.replace(cache_file.name, cache_path)
+			self.misses.append(section)
+
+		return model
+
+	def Serialize_Model(self, model):
+		"""Serializes a Bokeh model (and all of its references) to a Bokeh Document JSON string."""
+
+		section_doc = Document()
+		section_doc.add_root(model)
+		model_json = section_doc.to_json_string()
+		#Detach the model again so it can be added to the final dashboard layout
+		section_doc.remove_root(model)
+
+		return model_json
+
+	def Deserialize_Model(self, model_json):
+		"""Recreates a Bokeh model from a Document JSON string created by Serialize_Model.
+
+		The model IDs are regenerated, since IDs from a previous run can collide with the IDs of newly built models.
+		"""
+
+		doc_json = json.loads(model_json)
+		new_ids = {ref["id"]: make_id() for ref in doc_json["roots"]["references"]}
+
+		def Replace_IDs(obj):
+			if isinstance(obj, dict):
+				return {key: (new_ids.get(value, value) if key == "id" else Replace_IDs(value))
+						for key, value in obj.items()}
+			elif isinstance(obj, list):
+				return [Replace_IDs(value) for value in obj]
+			else:
+				return obj
+
+		doc_json["roots"] = Replace_IDs(doc_json["roots"])
+		doc_json["roots"]["root_ids"] = [new_ids[root_id] for root_id in doc_json["roots"]["root_ids"]]
+
+		section_doc = Document.from_json(doc_json)
+		model = section_doc.roots[0]
+		section_doc.remove_root(model)
+
+		return model
+
+	def Clear(self):
+		"""Removes all cached sections from the cache directory."""
+
+		if self.cache_dir is None:
+			return
+
+		for cache_filename in os.listdir(self.cache_dir):
+			if cache_filename.endswith(".json"):
+				os.remove(os.path.join(self.cache_dir, cache_filename))
@@ -0,0 +1,376 @@
+import io
+import os
+import json
+import hashlib
+import inspect
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pandas
+
+from bokeh.embed import json_item
+from bokeh.resources import INLINE
+
+from Repertoire_Dashboard import Repertoire_Dashboard
+from .Clone_Store import Clone_Store
+from .Dashboard_Cache import Dashboard_Section_Cache
+
+#Dashboard parameters set by the service itself (output files, browser windows and server sessions are not allowed)
+reserved_params = ["clone_dfs", "filename", "show_plots", "site_dir", "lazy_panel_dir", "cache_dir", "clone_details",
+				   "doc", "return_html"]
+table_separators = {"text/csv": ",", "text/tab-separated-values": "\t"}
+
+def _Warm_Worker():
+	"""Loads the inline BokehJS files once per worker process (the dashboard modules and gene palettes are imported with
+	this module), so its first request does not pay for them."""
+
+	INLINE.js_raw
+	INLINE.css_raw
+
+def _Worker_Ready():
+	"""Returns the worker's process ID once it has been started and warmed."""
+
+	return os.getpid()
+
+def _Read_Repertoire(path = None, table = None, sep = "\t"):
+	"""Reads a repertoire from a local file / Clone_Store directory or from the bytes of a posted table."""
+
+	if table is not None:
+		return pandas.read_csv(io.BytesIO(table), sep = sep)
+
+	if os.path.isdir(path):
+		return Clone_Store(path)
+
+	if ".csv" in os.path.basename(path).lower():
+		sep = ","
+
+	return pandas.read_csv(path, sep = sep)
+
+def _Render_Dashboard(input_spec, params, output_format):
+	"""Builds one dashboard from its input and parameters and returns the HTML page or panel JSON (runs in a worker)."""
+
+	clone_dfs = _Read_Repertoire(**input_spec)
+	if isinstance(clone_dfs, pandas.DataFrame) and params.get("sample_col") is None:
+		params = dict(params, sample_col = "Sample")
+
+	if output_format == "html":
+		return Repertoire_Dashboard(clone_dfs, show_plots = False, return_html = True, **params)
+
+	dashboard_doc = Repertoire_Dashboard(clone_dfs, show_plots = False, **params)
+	return json.dumps(json_item(dashboard_doc.roots[0], "repertoire-dashboard")).encode("utf-8")
+
+class Dashboard_Service_Error(Exception):
+	def __init__(self, message, status = 400):
+		"""Error in a dashboard request, reported to the client with the given HTTP status."""
+
+		Exception.__init__(self, message)
+		self.status = status
+
+class Dashboard_Service(object):
+	def __init__(self, n_workers = 4, cache_size = 32, max_cache_bytes = 512 * 1024 ** 2, allowed_dirs = None):
+		"""Creates a local HTTP service rendering Repertoire_Dashboard pages on a pool of pre-warmed worker processes.
+
+		A POST to /dashboard with a repertoire table (text/csv or text/tab-separated-values body) or a JSON body
+		{"path": local file or Clone_Store directory, "params": {...}, "format": "html" or "json"} returns the dashboard
+		HTML page or its Bokeh panel JSON (for bokeh.embed.embed_item). Results are kept in an LRU cache keyed by the
+		input fingerprint and parameters, and identical requests arriving while a dashboard is being built wait for
+		that build instead of starting their own. GET /status returns the cache and pool counters.
+
+		Parameters
+		----------
+		n_workers: int
+			Number of worker processes building dashboards; default is 4
+		cache_size: int
+			Maximum number of rendered dashboards kept in the result cache; default is 32
+		max_cache_bytes: int
+			Maximum total size of the rendered dashboards kept in the result cache; default is 512 MB
+		allowed_dirs: list of str or None
+			Directories the posted input paths must be in, or None to allow any local path; default is None
+		"""
+
+		self.n_workers = n_workers
+		self.cache_size = cache_size
+		self.max_cache_bytes = max_cache_bytes
+		self.allowed_dirs = None if allowed_dirs is None else [os.path.realpath(path) for path in allowed_dirs]
+
+		self.dashboard_params = set(inspect.signature(Repertoire_Dashboard).parameters) - set(reserved_params)
+		self.fingerprinter = Dashboard_Section_Cache()
+
+		self.lock = threading.Lock()
+		self.results = OrderedDict()
+		self.cache_bytes = 0
+		self.pending = {}
+		self.counts = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+		self.pool = None
+		self.server = None
+
+	def Start_Workers(self):
+		"""Starts and warms all the worker processes, so the first requests do not pay their start-up costs.
+
+		Returns
+		----------
+		worker_pids: list of int
+			Process IDs of the started workers
+		"""
+
+		if self.pool is None:
+			self.pool = ProcessPoolExecutor(max_workers = self.n_workers, initializer = _Warm_Worker)
+
+		#Workers are started on demand, so one task per worker submitted at once starts all of them
+		ready_futures = [self.pool.submit(_Worker_Ready) for _ in range(self.n_workers)]
+
+		return [future.result() for future in ready_futures]
+
+	def Request_Key(self, input_spec, params, output_format):
+		"""Calculates the result cache key of a request from its input fingerprint, parameters and output format.
+
+		Posted tables are hashed by content; local files and Clone_Store directories by path, size and modification
+		time, so a changed file is rendered again without reading it here.
+		"""
+
+		if input_spec.get("table") is not None:
+			input_fingerprint = hashlib.sha1(input_spec["table"]).hexdigest()
+		else:
+			path = input_spec["path"]
+			stat_paths = [path]
+			if os.path.isdir(path):
+				stat_paths += sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+			input_fingerprint = [(stat_path, os.stat(stat_path).st_size, os.stat(stat_path).st_mtime_ns)
+								 for stat_path in stat_paths]
+
+		request_params = {"input": input_fingerprint, "sep": input_spec.get("sep"), "params": params,
+						  "format": output_format}
+
+		return self.fingerprinter.Fingerprint("Dashboard_Service", params = request_params, code = Repertoire_Dashboard)
+
+	def Parse_Request(self, body, content_type, query):
+		"""Gets the input, dashboard parameters and output format of a POST /dashboard request.
+
+		Returns
+		----------
+		input_spec: dict
+			Keyword arguments of the repertoire reader (path or table and separator)
+		params: dict
+			Keyword parameters for Repertoire_Dashboard
+		output_format: str
+			"html" or "json"
+		"""
+
+		content_type = (content_type or "").split(";")[0].strip().lower()
+		output_format = query.get("format", ["html"])[0]
+
+		if content_type in table_separators:
+			input_spec = {"table": body, "sep": table_separators[content_type]}
+			try:
+				params = json.loads(query.get("params", ["{}"])[0])
+			except ValueError:
+				raise Dashboard_Service_Error("The params query argument is not valid JSON!")
+
+		elif content_type == "application/json":
+			try:
+				request = json.loads(body.decode("utf-8"))
+			except ValueError:
+				raise Dashboard_Service_Error("The request body is not valid JSON!")
+			if not isinstance(request, dict) or not isinstance(request.get("path"), str):
+				raise Dashboard_Service_Error("JSON requests must give the repertoire file as \"path\"!")
+
+			path = os.path.realpath(request["path"])
+			if self.allowed_dirs is not None and not any(os.path.commonpath([path, allowed_dir]) == allowed_dir
+														 for allowed_dir in self.allowed_dirs):
+				raise Dashboard_Service_Error("The repertoire path is not in an allowed directory!", status = 403)
+			if not os.path.exists(path):
+				raise Dashboard_Service_Error("The repertoire path {0} was not found!".format(request["path"]), 404)
+
+			input_spec = {"path": path}
+			if "sep" in request:
+				input_spec["sep"] = request["sep"]
+			params = request.get("params", {})
+			output_format = request.get("format", output_format)
+
+		else:
+			raise Dashboard_Service_Error("Unsupported content type {0}!".format(content_type or "(none)"), status = 415)
+
+		if not isinstance(params, dict):
+			raise Dashboard_Service_Error("The dashboard params must be a JSON object!")
+		unknown_params = sorted(set(params) - self.dashboard_params)
+		if unknown_params:
+			raise Dashboard_Service_Error("Unsupported dashboard params: {0}".format(", ".join(unknown_params)))
+		if output_format not in ["html", "json"]:
+			raise Dashboard_Service_Error("format must be either \"html\" or \"json\"!")
+
+		return input_spec, params, output_format
+
+	def Render(self, input_spec, params, output_format = "html"):
+		"""Gets a rendered dashboard from the result cache, from an identical build in progress, or from a new build.
+
+		Returns
+		----------
+		result: bytes
+			The dashboard HTML page or panel JSON
+		cache_status: str
+			"hit", "coalesced" or "miss"
+		"""
+
+		key = self.Request_Key(input_spec, params, output_format)
+
+		with self.lock:
+			if key in self.results:
+				self.results.move_to_end(key)
+				self.counts["hits"] += 1
+				return self.results[key], "hit"
+
+			future = self.pending.get(key)
+			if future is not None:
+				self.counts["coalesced"] += 1
+				cache_status = "coalesced"
+			else:
+				self.counts["misses"] += 1
+				cache_status = "miss"
+				future = self.pool.submit(_Render_Dashboard, input_spec, params, output_format)
+				self.pending[key] = future
+
+		#Registered outside the lock, since a build which already finished runs the callback (and its locking)
+		#immediately on this thread
+		if cache_status == "miss":
+			future.add_done_callback(lambda done_future: self.Store_Result(key, done_future))
+
+		return future.result(), cache_status
+
+	def Store_Result(self, key, future):
+		"""Moves a finished build from the pending builds into the result cache, evicting the least recently used."""
+
+		with self.lock:
+			self.pending.pop(key, None)
+			if future.cancelled() or future.exception() is not None:
+				self.counts["errors"] += 1
+				return
+
+			result = future.result()
+			if len(result) > self.max_cache_bytes:
+				return
+
+			self.results[key] = result
+			self.cache_bytes += len(result)
+			while len(self.results) > self.cache_size or self.cache_bytes > self.max_cache_bytes:
+				_, evicted = self.results.popitem(last = False)
+				self.cache_bytes -= len(evicted)
+
+	def Status(self):
+		"""Gets the cache and pool counters of the service as a dict."""
+
+		with self.lock:
+			status = dict(self.counts, cached = len(self.results), cache_bytes = self.cache_bytes,
+						  pending = len(self.pending), workers = self.n_workers)
+
+		return status
+
+	def Serve(self, port = 8050, address = "localhost", run_forever = True):
+		"""Starts the workers and the HTTP server; every request is handled on its own thread.
+
+		Parameters
+		----------
+		port: int
+			Port for the server to listen on (0 picks a free port); default is 8050
+		address: str
+			Address for the server to listen on; default is "localhost"
+		run_forever: bool
+			Whether to block and handle requests until the server is stopped; default is True
+
+		Returns
+		----------
+		server: ThreadingHTTPServer
+			The started server; its URL is "http://{address}:{server.server_port}/"
+		"""
+
+		self.Start_Workers()
+
+		self.server = ThreadingHTTPServer((address, port), Dashboard_Request_Handler)
+		self.server.daemon_threads = True
+		self.server.service = self
+
+		if run_forever:
+			self.server.serve_forever()
+
+		return self.server
+
+	def Serve_In_Thread(self, port = 8050, address = "localhost"):
+		"""Starts the service on a background thread, for example to send it requests from the calling thread.
+
+		Returns
+		----------
+		server: ThreadingHTTPServer
+			The started server; its URL is "http://{address}:{server.server_port}/"
+		"""
+
+		self.Serve(port = port, address = address, run_forever = False)
+		threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+		return self.server
+
+	def Stop(self):
+		"""Stops the HTTP server and shuts the worker processes down."""
+
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+		if self.pool is not None:
+			self.pool.shutdown(wait = True)
+			self.pool = None
+
+class Dashboard_Request_Handler(BaseHTTPRequestHandler):
+	"""Handles the HTTP requests of a Dashboard_Service (the server's service attribute)."""
+
+	protocol_version = "HTTP/1.1"
+
+	def Send(self, status, body, content_type, headers = None):
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		for header, value in (headers or {}).items():
+			self.send_header(header, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def Send_Error(self, status, message):
+		self.Send(status, json.dumps({"error": message}).encode("utf-8"), "application/json")
+
+	def do_GET(self):
+		if urlparse(self.path).path != "/status":
+			return self.Send_Error(404, "Not found")
+
+		self.Send(200, json.dumps(self.server.service.Status()).encode("utf-8"), "application/json")
+
+	def do_POST(self):
+		url = urlparse(self.path)
+		body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		if url.path != "/dashboard":
+			return self.Send_Error(404, "Not found")
+
+		service = self.server.service
+		try:
+			input_spec, params, output_format = service.Parse_Request(body, self.headers.get("Content-Type"),
+																	  parse_qs(url.query))
+			result, cache_status = service.Render(input_spec, params, output_format)
+		except Dashboard_Service_Error as error:
+			return self.Send_Error(error.status, str(error))
+		except Exception as error:
+			traceback.print_exc()
+			return self.Send_Error(500, "{0}: {1}".format(type(error).__name__, error))
+
+		content_type = "text/html; charset=utf-8" if output_format == "html" else "application/json"
+		self.Send(200, result, content_type, headers = {"X-Dashboard-Cache": cache_status})
+
+	def log_message(self, format, *args):
+		#Request lines are not printed for every (possibly cached) dashboard request
+		pass
+
+if __name__ == "__main__":
+	service = Dashboard_Service()
+	print("Serving repertoire dashboards on http://localhost:8050/dashboard")
+	service.Serve()
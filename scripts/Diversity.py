@@ -1,17 +1,29 @@
 import numpy
+import pandas
+from scipy.special import zeta, gammaln, digamma
+from scipy.optimize import minimize_scalar
+from scipy.stats import hypergeom, norm
+from concurrent.futures import ThreadPoolExecutor
 
 from bokeh.plotting import figure
-from bokeh.models import Range1d, BasicTickFormatter
+from bokeh.models import Range1d, BasicTickFormatter, ColumnDataSource, HoverTool
 from bokeh.colors import RGB
 from bokeh.io.export import export_png
+from bokeh.layouts import gridplot
 
-def Shannon_Wiener_Index(clone_counts):
+from .Gene_Colors import Sample_Colors
+from .Repertoire_Data import Split_Columns, Facet_Cells, Cell_Rows, Facet_Panels
+
+def Shannon_Wiener_Index(clone_counts, clone_weights = None):
 	"""Calculates the Shannon-Wiener index of diversity given an iterable of clone frequencies.
 
 	Parameters
 	----------
 	clone_counts: iterable of floats
 		Frequencies of all clones/members of a population
+	clone_weights: iterable of ints or None
+		Number of clones with each frequency if clone_counts is an abundance histogram, or None if every entry is one
+		clone; default is None
 
 	Returns
 	----------
@@ -19,16 +31,16 @@ def Shannon_Wiener_Index(clone_counts):
 		The Shannon-Wiener index value
 	"""
 
-	total_clone_counts = float(sum(clone_counts))
-	sw_index = 0.0
+	clone_counts = numpy.asarray(clone_counts, dtype = float)
+	clone_weights = numpy.ones(len(clone_counts)) if clone_weights is None else numpy.asarray(clone_weights, float)
 
-	for clone in clone_counts:
-		clone_freq = clone / total_clone_counts
-		sw_index -= (clone_freq * numpy.log(clone_freq))
+	total_clone_counts = (clone_counts * clone_weights).sum()
+	clone_freqs = clone_counts / total_clone_counts
+	sw_index = -(clone_weights * clone_freqs * numpy.log(clone_freqs)).sum()
 
 	return sw_index
 
-def Hill_Diversity_Index(clone_counts, N = (0.0, 10.0), step = 0.1):
+def Hill_Diversity_Index(clone_counts, N = (0.0, 10.0), step = 0.1, clone_weights = None):
 	"""Calculates the Hill Diversity index/indices; will return the indices from orders 0 to 10 by default.
 
 	Parameters
@@ -39,6 +51,9 @@ def Hill_Diversity_Index(clone_counts, N = (0.0, 10.0), step = 0.1):
 		Start and stop point for orders to calculate the diversity index from (both inclusive); default is (0.0, 10.0)
 	step: float
 		Step value to create the range from the start and stop point in N; default is 0.1
+	clone_weights: iterable of ints or None
+		Number of clones with each frequency if clone_counts is an abundance histogram (such as from
+		Cohort_Aggregate_Files), or None if every entry is one clone; default is None
 
 	Returns
 	----------
@@ -50,26 +65,27 @@ def Hill_Diversity_Index(clone_counts, N = (0.0, 10.0), step = 0.1):
 		if len(N) != 2 or N[1] <= N[0]:
 			raise ValueError("If N is an iterable it must be of length 2 for the start/end orders.")
 		chunks = numpy.floor(N[1] / step) + 1
-		orders = numpy.linspace(start = N[0], stop = N[1], num = chunks)
+		orders = numpy.linspace(start = N[0], stop = N[1], num = int(chunks))
 	else:
 		orders = [N]
 
-	total_clone_counts = float(sum(clone_counts))
+	clone_counts = numpy.asarray(clone_counts, dtype = float)
+	clone_weights = numpy.ones(len(clone_counts)) if clone_weights is None else numpy.asarray(clone_weights, float)
+
+	total_clone_counts = (clone_counts * clone_weights).sum()
+	clone_freqs = clone_counts / total_clone_counts
 	hill_indices = []
 
 	for order in orders:
-		hill_index = 0.0
 		if order == 0.0:
 			#Hill index at zero is simply the species richness (total number of clones)
-			hill_index = len(clone_counts)
+			hill_index = clone_weights.sum()
 		elif order == 1.0:
 			#Hill index at one is the exponential of the Shannon-Wiener index
-			sw_index = Shannon_Wiener_Index(clone_counts)
+			sw_index = Shannon_Wiener_Index(clone_counts, clone_weights)
 			hill_index = numpy.exp(sw_index)
 		else:
-			for clone in clone_counts:
-				clone_freq = clone / total_clone_counts
-				hill_index += (clone_freq ** order)
+			hill_index = (clone_weights * clone_freqs ** order).sum()
 			order_exponent = 1.0 / (1.0 - order)
 			hill_index = hill_index ** order_exponent
 
@@ -82,7 +98,8 @@ def Hill_Diversity_Index(clone_counts, N = (0.0, 10.0), step = 0.1):
 		return hill_indices
 
 def Diversity_Plot(clone_df, png = None, title = "", count_col = "Clustered", split_col = None, line_width = 3,
-				   add_control_diversities = True, figsize = (1000, 700)):
+				   add_control_diversities = True, figsize = (1000, 700), weight_col = None, abundance_matrix = None,
+				   richness_estimates = False, n_bootstraps = 50, n_jobs = 4, ncols = 2):
 	"""Creates a plot comparing clonal repertoire diversity rates, using the Hill Diversity metric.
 
 	Parameters
@@ -95,91 +112,901 @@ def Diversity_Plot(clone_df, png = None, title = "", count_col = "Clustered", sp
 		Title of the output graph; default is ""
 	count_col: str
 		Column name in clone_df of the clone counts/frequencies; default is "Clustered"
-	split_col: str
-		Column separating various repertoire subsets in clone_df or None if single repertoire; default is None
+	split_col: str, list of str or None
+		Column separating various repertoire subsets in clone_df or None if single repertoire; a list of columns (for
+		example ["Sample", "Isotype"]) draws the subsets of the first column in one small multiple panel per combination
+		of the others; default is None
 	line_width: int
 		Width for the plot lines
 	add_control_diversities: bool
 		Whether to add lines for control diversities of artificial polarity; default is True
 	figsize: tuple of (int, int)
 		The width and height of the output plot; default is (100, 700)
+	weight_col: str or None
+		Column name in clone_df of the number of clones with each count, if clone_df holds abundance histograms (such
+		as Cohort_Aggregate.Abundance_DataFrame) instead of one row per clone; default is None
+	abundance_matrix: Clone_Abundance_Matrix or None
+		Prebuilt clone x sample abundance matrix to take the sample clone counts from instead of splitting clone_df
+		(which can then be None); default is None
+	richness_estimates: bool
+		Whether to add dotted lines of the estimated Hill numbers of order 0 to 2 including unseen clones (Chao1, the
+		Chao-Wang-Jost entropy and the unbiased Simpson index), with bootstrap confidence intervals; requires integer
+		clone counts; default is False
+	n_bootstraps: int
+		Number of bootstrap samples for the confidence intervals of the estimates; default is 50
+	n_jobs: int
+		Number of threads used for the bootstrap samples; default is 4
+	ncols: int
+		Number of facet panels per row; default is 2
+
+	Returns
+	----------
+	plot: bokeh figure or GridBox
+		The figure object for the diversity plot, or the grid of facet panels
+	"""
+
+	split_cols = Split_Columns(split_col)
+	series_cols, facet_cols = split_cols[:1], split_cols[1:]
+
+	#The clone counts of every sample (and facet) cell are gathered once, with one sort of their combined codes
+	diversity_cols = [count_col] if weight_col is None else [count_col, weight_col]
+	if abundance_matrix is not None and not facet_cols:
+		#Each sample's clone counts are one column slice of the sparse matrix
+		cells = pandas.DataFrame({"Sample": pandas.Categorical(abundance_matrix.samples,
+															categories = abundance_matrix.samples)})
+		series_cols = ["Sample"]
+		diversity_dfs = [pandas.DataFrame({count_col: abundance_matrix.Sample_Counts(sample)})
+						 for sample in abundance_matrix.samples]
+		weight_col = None
+
+	else:
+		cell_codes, cells = Facet_Cells(clone_df, facet_cols + series_cols)
+		diversity_df = clone_df[diversity_cols]
+		diversity_dfs = [diversity_df.take(rows) for rows in Cell_Rows(cell_codes, len(cells))]
+
+	if series_cols:
+		samples = cells[series_cols[0]].astype(str).tolist()
+		sample_codes = cells[series_cols[0]].cat.codes.values
+		total_samples = len(cells[series_cols[0]].cat.categories)
+	else:
+		samples = ["Repertoire"] * len(cells)
+		sample_codes = numpy.zeros(len(cells), dtype = int)
+		total_samples = 1
+
+	#Samples keep the same color in every facet panel
+	sample_colors = Sample_Colors(total_samples, (RGB(30, 160, 120), RGB(220, 90, 0), RGB(120, 110, 180),
+												  RGB(230, 40, 140)))
+
+	if add_control_diversities:
+		if weight_col is not None:
+			total_clones = int(max([df[weight_col].sum() for df in diversity_dfs]))
+			total_counts = max([(df[count_col] * df[weight_col]).sum() for df in diversity_dfs])
+		else:
+			total_clones = max([len(i) for i in diversity_dfs])
+			total_counts = max([df[count_col].sum() for df in diversity_dfs])
+
+		#Control repertoires with the top 20 clones at a fixed share of the total, from very highly to lowly polarized
+		control_lines = [
+			(0.2, RGB(160, 200, 230), "Very Highly Polarized (Top 20 Clones 20%)"),
+			(0.15, RGB(30, 120, 180), "Highly Polarized (Top 20 Clones 15%)"),
+			(0.1, RGB(180, 220, 140), "Moderately Polarized (Top 20 Clones 10%)"),
+			(0.05, RGB(50, 160, 40), "Lowly Polarized (Top 20 Clones 5%)")
+		]
+
+		#The controls are sized by the largest cell, so they are the same in every facet panel
+		control_lines_data = {"xs": [], "ys": [], "color": [], "control": []}
+		for top20_share, line_color, control in control_lines:
+			#The top 20 clones and the remaining clones each share one count, so they are weighted instead of repeated
+			if total_clones > 20:
+				control_data = [total_counts * top20_share / 20, total_counts * (1.0 - top20_share) / (total_clones - 20)]
+				control_weights = [20, total_clones - 20]
+			elif total_clones > 0:
+				#Repertoires of at most 20 clones have no remaining clones, so their control is evenly distributed
+				control_data = [total_counts / total_clones]
+				control_weights = [total_clones]
+			else:
+				continue
+			control_diversities = Hill_Diversity_Index(control_data, clone_weights = control_weights)
+
+			control_lines_data["xs"].append([i[0] for i in control_diversities])
+			control_lines_data["ys"].append([i[1] for i in control_diversities])
+			control_lines_data["color"].append(line_color)
+			control_lines_data["control"].append(control)
+
+	plots = []
+	for panel_title, panel_cells in Facet_Panels(cells, facet_cols):
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"x_range": Range1d(0, 10),
+			"y_axis_type": "log",
+			"title": " ".join([text for text in (title, panel_title) if text]),
+			"tools": "save, help",
+			"toolbar_location": "right"
+		}
+
+		plot = figure(**figure_params)
+		plot.xgrid.grid_line_alpha = 0.0
+		plot.xaxis.axis_label = "Order (N)"
+		plot.yaxis.axis_label = "Hill Diversity Constant"
+		plot.yaxis.formatter = BasicTickFormatter()
+
+		#All sample lines are drawn with a single multi_line renderer, grouped into legend entries by the sample column
+		sample_lines_data = {"xs": [], "ys": [], "color": [], "sample": []}
+		for cell in panel_cells:
+			df = diversity_dfs[cell]
+			clone_weights = df[weight_col] if weight_col is not None else None
+			hill_indices = Hill_Diversity_Index(df[count_col], clone_weights = clone_weights)
+
+			sample_lines_data["xs"].append([i[0] for i in hill_indices])
+			sample_lines_data["ys"].append([i[1] for i in hill_indices])
+			sample_lines_data["color"].append(sample_colors[sample_codes[cell]])
+			sample_lines_data["sample"].append(samples[cell])
+
+		#ADD MORE LINE STYLES (dotted, etc.)
+		plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = line_width, legend = "sample",
+						source = ColumnDataSource(sample_lines_data))
+
+		if richness_estimates:
+			estimate_lines_data = {"xs": [], "ys": [], "color": [], "estimate": []}
+			estimate_points_data = {"x": [], "y": [], "lower": [], "upper": [], "color": [], "sample": [],
+									"note": []}
+			for cell in panel_cells:
+				df = diversity_dfs[cell]
+				line_color = sample_colors[sample_codes[cell]]
+				clone_weights = df[weight_col] if weight_col is not None else None
+				clone_sizes, size_clones = Clone_Size_Frequencies(df[count_col], clone_weights)
+				estimates = Asymptotic_Hill_Numbers(clone_sizes, size_clones)
+				bootstrap_estimates = Bootstrap_Statistic(clone_sizes, size_clones, Asymptotic_Hill_Numbers,
+														  n_bootstraps = n_bootstraps, n_jobs = n_jobs)
+				#Without clones seen twice the order 2 estimate is unbounded (inf), so it is left out of the plot and
+				#the interval only uses the finite bootstrap estimates
+				finite_bootstraps = numpy.where(numpy.isfinite(bootstrap_estimates), bootstrap_estimates, numpy.nan)
+				with numpy.errstate(invalid = "ignore"):
+					half_widths = 1.96 * numpy.nanstd(finite_bootstraps, axis = 0, ddof = 1)
+				finite_orders = numpy.flatnonzero(numpy.isfinite(estimates))
+				has_interval = numpy.isfinite(half_widths[finite_orders])
+				estimate_notes = numpy.where(has_interval, "", "No interval (too few finite bootstrap estimates)")
+				if len(finite_orders) < 3:
+					unbounded_orders = ", ".join([str(order) for order in range(3) if order not in finite_orders])
+					estimate_notes = [(note + "; " if note else "") + "Order {0} unbounded (no clone seen twice)".format(
+						unbounded_orders) for note in estimate_notes]
+
+				finite_estimates = estimates[finite_orders]
+				finite_half_widths = numpy.where(has_interval, half_widths[finite_orders], 0.0)
+				estimate_lines_data["xs"].append(finite_orders.tolist())
+				estimate_lines_data["ys"].append(finite_estimates)
+				estimate_lines_data["color"].append(line_color)
+				estimate_lines_data["estimate"].append(samples[cell] + " (Estimated)")
+				estimate_points_data["x"].extend(finite_orders.tolist())
+				estimate_points_data["y"].extend(finite_estimates)
+				estimate_points_data["lower"].extend(numpy.maximum(finite_estimates - finite_half_widths, 1.0))
+				estimate_points_data["upper"].extend(finite_estimates + finite_half_widths)
+				estimate_points_data["color"].extend([line_color] * len(finite_orders))
+				estimate_points_data["sample"].extend([samples[cell]] * len(finite_orders))
+				estimate_points_data["note"].extend(list(estimate_notes))
+
+			plot.multi_line(xs = "xs", ys = "ys", color = "color", line_dash = "dotted", line_width = line_width,
+							legend = "estimate", source = ColumnDataSource(estimate_lines_data))
+			estimate_points_source = ColumnDataSource(estimate_points_data)
+			plot.segment(x0 = "x", y0 = "lower", x1 = "x", y1 = "upper", color = "color", line_width = 2,
+						 source = estimate_points_source)
+			estimate_points = plot.circle(x = "x", y = "y", color = "color", size = 7, source = estimate_points_source)
+			plot.add_tools(HoverTool(renderers = [estimate_points],
+									 tooltips = [("Sample", "@sample"), ("Order", "@x"), ("Estimated", "@y{0,0.0}"),
+												 ("Interval", "@lower{0,0.0} - @upper{0,0.0}"), ("Note", "@note")]))
+
+		if add_control_diversities:
+			plot.multi_line(xs = "xs", ys = "ys", color = "color", alpha = 0.8, line_dash = (12,),
+							line_width = line_width, legend = "control", source = ColumnDataSource(control_lines_data))
+
+		plots.append(plot)
+
+	#Facets are shown as small multiples; a single panel is returned as the plain figure
+	if facet_cols:
+		plot = gridplot(plots, ncols = ncols, toolbar_location = "right")
+	else:
+		plot = plots[0]
+
+	if png is not None:
+		export_png(plot, png)
+
+	return plot
+
+def Clone_Size_Frequencies(clone_counts, clone_weights = None):
+	"""Counts the number of clones of every clone size (the frequency of frequencies).
+
+	Parameters
+	----------
+	clone_counts: iterable of ints
+		Counts (sizes) of all clones, or the distinct sizes of an abundance histogram
+	clone_weights: iterable of ints or None
+		Number of clones with each count if clone_counts is an abundance histogram, or None if every entry is one
+		clone; default is None
+
+	Returns
+	----------
+	clone_sizes: numpy array
+		The distinct clone sizes in ascending order
+	size_clones: numpy array of floats
+		The number of clones of each size
+	"""
+
+	clone_counts = numpy.asarray(clone_counts)
+	clone_weights = None if clone_weights is None else numpy.asarray(clone_weights, dtype = float)
+
+	if clone_counts.dtype.kind in "iu" and len(clone_counts) and 0 <= clone_counts.min() and \
+	   clone_counts.max() <= 16 * len(clone_counts) + 4096:
+		#Integer sizes of a bounded range are counted with one bincount pass
+		size_clones = numpy.bincount(clone_counts, weights = clone_weights).astype(float)
+		clone_sizes = numpy.flatnonzero(size_clones)
+		size_clones = size_clones[clone_sizes]
+	else:
+		clone_sizes, size_codes = numpy.unique(clone_counts, return_inverse = True)
+		size_clones = numpy.bincount(size_codes, weights = clone_weights, minlength = len(clone_sizes)).astype(float)
+
+	positive_sizes = (clone_sizes > 0) & (size_clones > 0)
+
+	return clone_sizes[positive_sizes], size_clones[positive_sizes]
+
+def Rank_Abundance(clone_sizes, size_clones):
+	"""Gets the rank-abundance steps from the frequency of frequencies: each size spans the ranks of its clones.
+
+	Returns
+	----------
+	ranks: numpy array
+		The first and last rank (from 1 for the largest clone) of every distinct size, largest size first
+	sizes: numpy array
+		The clone size at each rank
+	"""
+
+	clone_sizes, size_clones = clone_sizes[::-1], size_clones[::-1]
+	last_ranks = numpy.cumsum(size_clones)
+	first_ranks = last_ranks - size_clones + 1
+
+	ranks = numpy.column_stack([first_ranks, last_ranks]).ravel()
+	sizes = numpy.repeat(clone_sizes, 2)
+
+	return ranks, sizes
+
+def Log_Binned_Frequencies(clone_sizes, size_clones, bins_per_decade = 10):
+	"""Bins the frequency of frequencies into logarithmic size bins, as the fraction of clones per unit size.
+
+	Returns
+	----------
+	bin_centers: numpy array
+		Geometric centers of the non-empty bins
+	bin_densities: numpy array
+		Fraction of all clones in each bin divided by the bin width
+	"""
+
+	decades = numpy.log10(clone_sizes.max()) + 1e-9 if len(clone_sizes) else 1.0
+	bin_edges = numpy.logspace(0.0, numpy.ceil(decades * bins_per_decade) / bins_per_decade,
+							   int(numpy.ceil(decades * bins_per_decade)) + 1)
+	bin_edges[0] = min(bin_edges[0], clone_sizes.min()) if len(clone_sizes) else bin_edges[0]
+
+	bin_clones, _ = numpy.histogram(clone_sizes, bins = bin_edges, weights = size_clones)
+	if numpy.array_equal(clone_sizes, numpy.round(clone_sizes)):
+		#Integer sizes: a bin's width is the number of integer sizes it holds
+		bin_widths = numpy.ceil(bin_edges[1:]) - numpy.ceil(bin_edges[:-1])
+		#The last bin includes its upper edge
+		bin_widths[-1] = numpy.floor(bin_edges[-1]) - numpy.ceil(bin_edges[-2]) + 1.0
+	else:
+		bin_widths = numpy.diff(bin_edges)
+	bin_densities = bin_clones / size_clones.sum() / numpy.where(bin_widths > 0, bin_widths, 1.0)
+	bin_centers = numpy.sqrt(bin_edges[:-1] * bin_edges[1:])
+
+	return bin_centers[bin_clones > 0], bin_densities[bin_clones > 0]
+
+def Power_Law_Exponent(clone_sizes, size_clones, size_min = 1):
+	"""Fits the exponent alpha of a discrete power law P(size) ~ size^-alpha to the clone sizes of at least size_min.
+
+	The maximum likelihood exponent (Clauset, Shalizi & Newman, 2009) is found with the Hurwitz zeta normalization, so
+	each likelihood evaluation only sums over the distinct clone sizes.
+
+	Returns
+	----------
+	alpha: float
+		The fitted exponent (NaN if there are no clones of at least size_min)
+	alpha_error: float
+		The standard error of the exponent, from the curvature of the log likelihood
+	"""
+
+	fitted = clone_sizes >= size_min
+	total_fitted = size_clones[fitted].sum()
+	if total_fitted == 0 or len(numpy.unique(clone_sizes[fitted])) < 2:
+		return numpy.nan, numpy.nan
+
+	log_size_sum = (size_clones[fitted] * numpy.log(clone_sizes[fitted])).sum()
+	def Negative_Log_Likelihood(alpha):
+		return alpha * log_size_sum + total_fitted * numpy.log(zeta(alpha, size_min))
+
+	alpha = minimize_scalar(Negative_Log_Likelihood, bounds = (1.0001, 10.0), method = "bounded").x
+
+	step = 1e-4
+	curvature = (Negative_Log_Likelihood(alpha + step) - 2.0 * Negative_Log_Likelihood(alpha) +
+				 Negative_Log_Likelihood(alpha - step)) / step ** 2
+
+	return alpha, 1.0 / numpy.sqrt(curvature) if curvature > 0 else numpy.nan
+
+def Clone_Size_Distribution_Plot(clone_df, png = None, title = "", count_col = "Clustered", split_col = None,
+								 line_width = 2, size_min = 1, bins_per_decade = 10, figsize = (1000, 500),
+								 weight_col = None, abundance_matrix = None):
+	"""Creates log-log rank-abundance and frequency of frequencies plots of the clone sizes, with power law fits.
+
+	Each sample is reduced to the number of clones of every distinct clone size first, so the plots only depend on the
+	number of distinct sizes.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) to plot
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	count_col: str
+		Column name in clone_df of the (integer) clone counts; default is "Clustered"
+	split_col: str
+		Column separating various repertoire subsets in clone_df or None if single repertoire; default is None
+	line_width: int
+		Width for the plot lines; default is 2
+	size_min: int
+		Smallest clone size included in the power law fits; default is 1
+	bins_per_decade: int
+		Number of logarithmic clone size bins per power of 10; default is 10
+	figsize: tuple of (int, int)
+		The width and height of the two plots together; default is (1000, 500)
+	weight_col, abundance_matrix:
+		See Diversity_Plot
 
 	Returns
 	----------
-	plot: bokeh figure
-		The figure object for the diversity plot
+	plot: bokeh GridBox
+		The rank-abundance (left) and frequency of frequencies (right) plots
 	"""
 
-	figure_params = {
-		"plot_width": figsize[0],
+	size_cols = [count_col] if weight_col is None else [count_col, weight_col]
+	if abundance_matrix is not None:
+		samples = abundance_matrix.samples
+		size_dfs = [pandas.DataFrame({count_col: abundance_matrix.Sample_Counts(sample)}) for sample in samples]
+		weight_col = None
+
+	elif split_col is not None:
+		samples = []
+		size_dfs = []
+		for sample, df in clone_df[size_cols + [split_col]].groupby([split_col]):
+			samples.append(sample)
+			size_dfs.append(df)
+
+	else:
+		samples = ["Repertoire"]
+		size_dfs = [clone_df[size_cols]]
+
+	sample_colors = Sample_Colors(len(samples), (RGB(30, 160, 120), RGB(220, 90, 0), RGB(120, 110, 180),
+												 RGB(230, 40, 140)))
+
+	rank_params = {
+		"plot_width": figsize[0] // 2,
 		"plot_height": figsize[1],
-		"x_range": Range1d(0, 10),
+		"x_axis_type": "log",
 		"y_axis_type": "log",
 		"title": title,
-		"tools": "save, help",
+		"tools": "pan, wheel_zoom, box_zoom, save, reset, help",
 		"toolbar_location": "right"
 	}
+	rank_plot = figure(**rank_params)
+	rank_plot.xaxis.axis_label = "Clone Rank"
+	rank_plot.yaxis.axis_label = "Clone Size"
 
-	plot = figure(**figure_params)
-	plot.xgrid.grid_line_alpha = 0.0
-	plot.xaxis.axis_label = "Order (N)"
-	plot.yaxis.axis_label = "Hill Diversity Constant"
-	plot.yaxis.formatter = BasicTickFormatter()
+	frequency_params = dict(rank_params, title = None)
+	frequency_plot = figure(**frequency_params)
+	frequency_plot.xaxis.axis_label = "Clone Size"
+	frequency_plot.yaxis.axis_label = "Fraction of Clones"
 
-	#If comparing multiple samples, add the sample column to split on to the DataFrame
-	if split_col is not None:
-		diversity_df = clone_df[[count_col, split_col]]
+	rank_lines_data = {"xs": [], "ys": [], "color": [], "sample": []}
+	fit_lines_data = {"xs": [], "ys": [], "color": [], "sample": [], "alpha": []}
+	binned_data = {"x": [], "y": [], "color": [], "sample": []}
+	for sample, df, line_color in zip(samples, size_dfs, sample_colors):
+		clone_weights = df[weight_col].values if weight_col is not None else None
+		clone_sizes, size_clones = Clone_Size_Frequencies(df[count_col].values, clone_weights)
+		if not len(clone_sizes):
+			continue
 
-		samples = []
-		diversity_dfs = []
-		for sample, df in diversity_df.groupby([split_col]):
-			samples.append(sample)
-			diversity_dfs.append(df)
+		ranks, rank_sizes = Rank_Abundance(clone_sizes, size_clones)
+		rank_lines_data["xs"].append(ranks)
+		rank_lines_data["ys"].append(rank_sizes)
+		rank_lines_data["color"].append(line_color)
+		rank_lines_data["sample"].append(str(sample))
+
+		bin_centers, bin_densities = Log_Binned_Frequencies(clone_sizes, size_clones, bins_per_decade)
+		binned_data["x"].append(bin_centers)
+		binned_data["y"].append(bin_densities)
+		binned_data["color"] += [line_color] * len(bin_centers)
+		binned_data["sample"] += [str(sample)] * len(bin_centers)
+
+		#The fitted power law is scaled to the fraction of clones at or above size_min
+		alpha, alpha_error = Power_Law_Exponent(clone_sizes, size_clones, size_min)
+		if numpy.isfinite(alpha):
+			fit_sizes = numpy.array([max(size_min, 1), clone_sizes.max()], dtype = float)
+			fitted_fraction = size_clones[clone_sizes >= size_min].sum() / size_clones.sum()
+			fit_lines_data["xs"].append(fit_sizes)
+			fit_lines_data["ys"].append(fitted_fraction * fit_sizes ** -alpha / zeta(alpha, max(size_min, 1)))
+			fit_lines_data["color"].append(line_color)
+			fit_lines_data["sample"].append("{0} (alpha = {1:.2f} ± {2:.2f})".format(sample, alpha, alpha_error))
+			fit_lines_data["alpha"].append(alpha)
+
+	for col in ("x", "y"):
+		binned_data[col] = numpy.concatenate(binned_data[col]) if binned_data[col] else []
+
+	rank_renderer = rank_plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = line_width,
+										 legend = "sample", source = ColumnDataSource(rank_lines_data))
+	rank_plot.add_tools(HoverTool(tooltips = [("Sample", "@sample"), ("Rank", "$x{0,0}"), ("Size", "$y{0,0}")],
+								  renderers = [rank_renderer]))
+
+	binned_renderer = frequency_plot.circle(x = "x", y = "y", color = "color", size = 6,
+											source = ColumnDataSource(binned_data))
+	frequency_plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = line_width, line_dash = (8,),
+							  legend = "sample", source = ColumnDataSource(fit_lines_data))
+	frequency_plot.add_tools(HoverTool(tooltips = [("Sample", "@sample"), ("Clone Size", "@x{0,0.0}"),
+												   ("Fraction of Clones", "@y{0.000e+0}")],
+									   renderers = [binned_renderer]))
+
+	size_distribution_plot = gridplot([rank_plot, frequency_plot], ncols = 2, toolbar_location = "right")
+
+	if png is not None:
+		export_png(size_distribution_plot, png)
+
+	return size_distribution_plot
+
+def _Size_Summary(clone_sizes, size_clones):
+	"""Gets the sample size n, observed richness and singleton / doubleton counts from the frequency of frequencies."""
+
+	sample_size = (clone_sizes * size_clones).sum()
+	observed_clones = size_clones.sum()
+	singletons = size_clones[clone_sizes == 1].sum()
+	doubletons = size_clones[clone_sizes == 2].sum()
+
+	return sample_size, observed_clones, singletons, doubletons
+
+def Chao1_Richness(clone_sizes, size_clones, confidence = 0.95):
+	"""Estimates the total richness (including unseen clones) with the bias-corrected Chao1 estimator.
+
+	Parameters
+	----------
+	clone_sizes, size_clones: numpy arrays
+		Frequency of frequencies of integer clone counts (see Clone_Size_Frequencies)
+	confidence: float
+		Level of the log-normal confidence interval (Chao, 1987); default is 0.95
+
+	Returns
+	----------
+	chao1: float
+		The estimated richness
+	lower, upper: float
+		The confidence interval of the estimate
+	"""
+
+	sample_size, observed_clones, f1, f2 = _Size_Summary(clone_sizes, size_clones)
+	if sample_size == 0:
+		return 0.0, 0.0, 0.0
+
+	correction = (sample_size - 1.0) / sample_size
+	if f2 > 0:
+		unseen_clones = correction * f1 ** 2 / (2.0 * f2)
+		ratio = f1 / f2
+		variance = f2 * (correction / 2.0 * ratio ** 2 + correction ** 2 * ratio ** 3 + correction ** 2 / 4.0 * ratio ** 4)
+	else:
+		unseen_clones = correction * f1 * (f1 - 1.0) / 2.0
+		variance = (correction * f1 * (f1 - 1.0) / 2.0 + correction ** 2 * f1 * (2.0 * f1 - 1.0) ** 2 / 4.0 -
+					correction ** 2 * f1 ** 4 / (4.0 * (observed_clones + unseen_clones)))
+
+	chao1 = observed_clones + unseen_clones
+	if unseen_clones <= 0 or variance <= 0:
+		return chao1, chao1, chao1
+
+	interval_factor = numpy.exp(norm.ppf(0.5 + confidence / 2.0) * numpy.sqrt(numpy.log(1.0 + variance /
+																						 unseen_clones ** 2)))
+
+	return chao1, observed_clones + unseen_clones / interval_factor, observed_clones + unseen_clones * interval_factor
+
+def ACE_Richness(clone_sizes, size_clones, rare_threshold = 10):
+	"""Estimates the total richness with the abundance-based coverage estimator (ACE) of Chao & Lee (1992).
+
+	Clones with counts up to rare_threshold are treated as rare; their coverage and count variation estimate the
+	number of unseen clones.
+	"""
+
+	rare = clone_sizes <= rare_threshold
+	rare_clones = size_clones[rare].sum()
+	abundant_clones = size_clones[~rare].sum()
+	rare_size = (clone_sizes[rare] * size_clones[rare]).sum()
+	f1 = size_clones[clone_sizes == 1].sum()
+
+	if rare_size == 0:
+		return abundant_clones
+
+	rare_coverage = 1.0 - f1 / rare_size
+	if rare_coverage <= 0 or rare_size < 2:
+		#All rare clones are singletons, where the ACE coverage is undefined
+		return Chao1_Richness(clone_sizes, size_clones)[0]
+
+	rare_pairs = (clone_sizes[rare] * (clone_sizes[rare] - 1.0) * size_clones[rare]).sum()
+	cv_squared = max(rare_clones / rare_coverage * rare_pairs / (rare_size * (rare_size - 1.0)) - 1.0, 0.0)
+
+	return abundant_clones + rare_clones / rare_coverage + f1 / rare_coverage * cv_squared
+
+def Sample_Coverage(clone_sizes, size_clones):
+	"""Estimates the sample coverage (the share of the repertoire's cells / reads in the sampled clones) of Chao &
+	Jost (2012) from the singleton and doubleton counts."""
+
+	sample_size, _, f1, f2 = _Size_Summary(clone_sizes, size_clones)
+	if f1 == 0 or sample_size == 0:
+		return 1.0
+
+	if f2 > 0:
+		unseen_share = (sample_size - 1.0) * f1 / ((sample_size - 1.0) * f1 + 2.0 * f2)
+	else:
+		unseen_share = (sample_size - 1.0) * (f1 - 1.0) / ((sample_size - 1.0) * (f1 - 1.0) + 2.0)
+
+	return 1.0 - f1 / sample_size * unseen_share
+
+def Shannon_Entropy_Estimate(clone_sizes, size_clones):
+	"""Estimates the Shannon entropy of the whole repertoire (including unseen clones) with the estimator of Chao, Wang
+	& Jost (2013)."""
+
+	sample_size, _, f1, f2 = _Size_Summary(clone_sizes, size_clones)
+	if sample_size < 2:
+		return 0.0
+
+	seen = clone_sizes <= sample_size - 1
+	entropy = (size_clones[seen] * clone_sizes[seen] / sample_size *
+			   (digamma(sample_size) - digamma(clone_sizes[seen]))).sum()
+
+	if f1 > 0:
+		if f2 > 0:
+			unseen_share = 2.0 * f2 / ((sample_size - 1.0) * f1 + 2.0 * f2)
+		else:
+			unseen_share = 2.0 / ((sample_size - 1.0) * (f1 - 1.0) + 2.0)
+
+		if unseen_share < 1.0:
+			#The series tail sum over r >= n of (1 - A)^(r + 1 - n) / r, truncated where its terms vanish
+			total_terms = int(min(numpy.ceil(-36.0 / numpy.log1p(-unseen_share)), 10 ** 7)) if unseen_share > 0 else 0
+			tail_offsets = numpy.arange(total_terms)
+			tail_sum = ((1.0 - unseen_share) ** (tail_offsets + 1) / (sample_size + tail_offsets)).sum()
+			entropy += f1 / sample_size * tail_sum
+
+	return entropy
+
+def _Interpolated_Shannon(clone_sizes, size_clones, sample_size, subsample_size):
+	"""Gets the expected Shannon entropy of subsamples of subsample_size drawn without replacement.
+
+	Each clone's subsample count is hypergeometric; only counts within 10 standard deviations of the mean are summed,
+	for all distinct sizes in one vectorized evaluation.
+	"""
+
+	means = subsample_size * clone_sizes / sample_size
+	deviations = numpy.sqrt(means * (1.0 - clone_sizes / sample_size) * (sample_size - subsample_size) /
+							max(sample_size - 1.0, 1.0))
+	lowest = numpy.maximum.reduce([numpy.ones_like(means), subsample_size - (sample_size - clone_sizes),
+								   numpy.floor(means - 10.0 * deviations - 1.0)])
+	highest = numpy.minimum.reduce([clone_sizes.astype(float), numpy.full_like(means, subsample_size),
+									numpy.ceil(means + 10.0 * deviations + 1.0)])
+	range_lengths = numpy.maximum(highest - lowest + 1, 0).astype(numpy.int64)
+
+	size_idxs = numpy.repeat(numpy.arange(len(clone_sizes)), range_lengths)
+	offsets = numpy.arange(range_lengths.sum()) - numpy.repeat(numpy.cumsum(range_lengths) - range_lengths,
+															   range_lengths)
+	subsample_counts = lowest[size_idxs] + offsets
+
+	probabilities = numpy.exp(hypergeom.logpmf(subsample_counts, sample_size, clone_sizes[size_idxs], subsample_size))
+	frequencies = subsample_counts / subsample_size
+	size_entropies = numpy.bincount(size_idxs, weights = -probabilities * frequencies * numpy.log(frequencies),
+									minlength = len(clone_sizes))
+
+	return (size_entropies * size_clones).sum()
+
+def Hill_Curve(clone_sizes, size_clones, sample_sizes, order):
+	"""Gets the expected Hill number of order 0, 1 or 2 at the given sample sizes, interpolated (rarefied) below and
+	extrapolated above the observed sample size as in iNEXT (Chao et al., 2014).
+
+	Parameters
+	----------
+	clone_sizes, size_clones: numpy arrays
+		Frequency of frequencies of integer clone counts (see Clone_Size_Frequencies)
+	sample_sizes: iterable of ints
+		Sample sizes (total counts) to get the Hill numbers at
+	order: int
+		Order of the Hill number (0: richness, 1: exponential Shannon entropy, 2: inverse Simpson index)
+
+	Returns
+	----------
+	hill_numbers: numpy array of floats
+		The expected Hill number at each sample size
+	"""
+
+	sample_size, observed_clones, f1, _ = _Size_Summary(clone_sizes, size_clones)
+	sample_sizes = numpy.asarray(sample_sizes, dtype = float)
+	hill_numbers = numpy.zeros(len(sample_sizes))
+	interpolated = sample_sizes <= sample_size
+
+	if order == 0:
+		#Expected richness: a clone of size X is missed by a subsample of m with probability C(n - X, m) / C(n, m)
+		for idx in numpy.flatnonzero(interpolated):
+			subsample_size = sample_sizes[idx]
+			kept = sample_size - clone_sizes >= subsample_size
+			log_missed = (gammaln(sample_size - clone_sizes[kept] + 1) + gammaln(sample_size - subsample_size + 1) -
+						  gammaln(sample_size - clone_sizes[kept] - subsample_size + 1) - gammaln(sample_size + 1))
+			hill_numbers[idx] = observed_clones - (size_clones[kept] * numpy.exp(log_missed)).sum()
+
+		unseen_clones = Chao1_Richness(clone_sizes, size_clones)[0] - observed_clones
+		if unseen_clones > 0:
+			extra_sizes = sample_sizes[~interpolated] - sample_size
+			hill_numbers[~interpolated] = observed_clones + unseen_clones * \
+				(1.0 - (1.0 - f1 / (sample_size * unseen_clones + f1)) ** extra_sizes)
+		else:
+			hill_numbers[~interpolated] = observed_clones
+
+	elif order == 1:
+		for idx in numpy.flatnonzero(interpolated):
+			hill_numbers[idx] = numpy.exp(_Interpolated_Shannon(clone_sizes, size_clones, sample_size,
+																sample_sizes[idx]))
+
+		#Extrapolated entropies move from the observed towards the estimated entropy with the sample size
+		observed_entropy = Shannon_Wiener_Index(clone_sizes, size_clones)
+		estimated_entropy = Shannon_Entropy_Estimate(clone_sizes, size_clones)
+		observed_share = sample_size / sample_sizes[~interpolated]
+		hill_numbers[~interpolated] = numpy.exp(observed_share * observed_entropy +
+												(1.0 - observed_share) * estimated_entropy)
+
+	elif order == 2:
+		#The expected Simpson index of a subsample of m is 1 / m + (1 - 1 / m) * sum(X (X - 1)) / (n (n - 1))
+		pair_share = (size_clones * clone_sizes * (clone_sizes - 1.0)).sum() / max(sample_size * (sample_size - 1.0), 1.0)
+		hill_numbers = 1.0 / (1.0 / sample_sizes + (1.0 - 1.0 / sample_sizes) * pair_share)
 
+	else:
+		raise ValueError("Rarefaction / extrapolation is only available for the Hill numbers of order 0, 1 and 2!")
+
+	return hill_numbers
+
+def Asymptotic_Hill_Numbers(clone_sizes, size_clones):
+	"""Gets the estimated Hill numbers of order 0 (Chao1), 1 (Chao-Wang-Jost entropy) and 2 (unbiased Simpson) of the
+	whole repertoire, including unseen clones."""
+
+	sample_size = (clone_sizes * size_clones).sum()
+	pair_share = (size_clones * clone_sizes * (clone_sizes - 1.0)).sum() / max(sample_size * (sample_size - 1.0), 1.0)
+
+	return numpy.array([Chao1_Richness(clone_sizes, size_clones)[0],
+						numpy.exp(Shannon_Entropy_Estimate(clone_sizes, size_clones)),
+						1.0 / pair_share if pair_share > 0 else numpy.inf])
+
+def _Bootstrap_Population(clone_sizes, size_clones):
+	"""Gets the clone probabilities of the bootstrap repertoire of iNEXT: the observed clones' frequencies adjusted for
+	the sample coverage, plus the estimated unseen clones sharing the uncovered remainder equally."""
+
+	sample_size, observed_clones, _, _ = _Size_Summary(clone_sizes, size_clones)
+	coverage = Sample_Coverage(clone_sizes, size_clones)
+	unseen_clones = int(numpy.ceil(Chao1_Richness(clone_sizes, size_clones)[0] - observed_clones))
+
+	frequencies = clone_sizes / sample_size
+	if coverage < 1.0 and unseen_clones > 0:
+		adjustment = (1.0 - coverage) / (size_clones * frequencies * numpy.exp(-clone_sizes)).sum()
+		frequencies = frequencies * (1.0 - adjustment * numpy.exp(-clone_sizes))
+		unseen_frequencies = numpy.full(unseen_clones, (1.0 - coverage) / unseen_clones)
+	else:
+		unseen_frequencies = numpy.empty(0)
+
+	probabilities = numpy.concatenate([numpy.repeat(frequencies, size_clones.astype(numpy.int64)), unseen_frequencies])
+
+	return probabilities / probabilities.sum()
+
+def Bootstrap_Statistic(clone_sizes, size_clones, statistic, n_bootstraps = 50, seed = 0, n_jobs = 4):
+	"""Calculates a statistic of the frequency of frequencies on bootstrap samples of the iNEXT bootstrap repertoire.
+
+	Every bootstrap sample is drawn with its own seed spawned from seed, on a thread pool.
+
+	Parameters
+	----------
+	clone_sizes, size_clones: numpy arrays
+		Frequency of frequencies of integer clone counts (see Clone_Size_Frequencies)
+	statistic: function
+		Function of (clone_sizes, size_clones) returning a number or numpy array
+	n_bootstraps: int
+		Number of bootstrap samples; default is 50
+	seed: int
+		Seed of the bootstrap samples; default is 0
+	n_jobs: int
+		Number of threads; default is 4
+
+	Returns
+	----------
+	bootstrap_statistics: numpy array
+		The statistic of every bootstrap sample (one row per sample)
+	"""
+
+	sample_size = int((clone_sizes * size_clones).sum())
+	probabilities = _Bootstrap_Population(clone_sizes, size_clones)
+
+	def Bootstrap_Sample(seed_sequence):
+		bootstrap_counts = numpy.random.default_rng(seed_sequence).multinomial(sample_size, probabilities)
+		return statistic(*Clone_Size_Frequencies(bootstrap_counts[bootstrap_counts > 0]))
+
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		bootstrap_statistics = list(executor.map(Bootstrap_Sample, numpy.random.SeedSequence(seed).spawn(n_bootstraps)))
+
+	return numpy.array(bootstrap_statistics)
+
+def Hill_Rarefaction_Extrapolation(clone_sizes, size_clones, orders = (0, 1, 2), sample_sizes = None, n_points = 40,
+								   extrapolation_factor = 2.0, n_bootstraps = 50, confidence = 0.95, seed = 0,
+								   n_jobs = 4):
+	"""Calculates iNEXT-style rarefaction / extrapolation curves of the Hill numbers with bootstrap confidence bands.
+
+	Parameters
+	----------
+	clone_sizes, size_clones: numpy arrays
+		Frequency of frequencies of integer clone counts (see Clone_Size_Frequencies)
+	orders: iterable of ints
+		Hill number orders (0, 1 and / or 2); default is (0, 1, 2)
+	sample_sizes: iterable of ints or None
+		Sample sizes to calculate the curves at, or None for n_points sizes up to extrapolation_factor times the
+		observed sample size; default is None
+	n_points: int
+		Number of sample sizes if sample_sizes is None; default is 40
+	extrapolation_factor: float
+		Largest sample size as a multiple of the observed sample size if sample_sizes is None; default is 2.0
+	n_bootstraps: int
+		Number of bootstrap samples for the confidence bands, or 0 for none; default is 50
+	confidence: float
+		Level of the confidence bands; default is 0.95
+	seed, n_jobs:
+		See Bootstrap_Statistic
+
+	Returns
+	----------
+	curves_df: pandas DataFrame
+		One row per order and sample size, with the columns Order, Sample_Size, Method ("Rarefied", "Observed" or
+		"Extrapolated"), Diversity, Lower and Upper
+	"""
+
+	sample_size = int((clone_sizes * size_clones).sum())
+	if sample_sizes is None:
+		sample_sizes = numpy.concatenate([numpy.linspace(1, sample_size, n_points // 2),
+										  numpy.linspace(sample_size, sample_size * extrapolation_factor,
+														 n_points - n_points // 2)])
+	sample_sizes = numpy.unique(numpy.round(numpy.append(sample_sizes, sample_size)).astype(numpy.int64))
+	sample_sizes = sample_sizes[sample_sizes > 0]
+	orders = list(orders)
+
+	def Curves(clone_sizes, size_clones):
+		return numpy.array([Hill_Curve(clone_sizes, size_clones, sample_sizes, order) for order in orders])
+
+	curves = Curves(clone_sizes, size_clones)
+	if n_bootstraps:
+		bootstrap_curves = Bootstrap_Statistic(clone_sizes, size_clones, Curves, n_bootstraps = n_bootstraps,
+											   seed = seed, n_jobs = n_jobs)
+		half_widths = norm.ppf(0.5 + confidence / 2.0) * bootstrap_curves.std(axis = 0, ddof = 1)
+	else:
+		half_widths = numpy.zeros_like(curves)
+
+	methods = numpy.where(sample_sizes < sample_size, "Rarefied",
+						  numpy.where(sample_sizes == sample_size, "Observed", "Extrapolated"))
+
+	return pandas.DataFrame({
+		"Order": numpy.repeat(orders, len(sample_sizes)),
+		"Sample_Size": numpy.tile(sample_sizes, len(orders)),
+		"Method": numpy.tile(methods, len(orders)),
+		"Diversity": curves.ravel(),
+		"Lower": numpy.maximum(curves - half_widths, 0.0).ravel(),
+		"Upper": (curves + half_widths).ravel()
+	})
+
+def Rarefaction_Extrapolation_Plot(clone_df, png = None, title = "", count_col = "Clustered", split_col = None,
+								   line_width = 2, orders = (0, 1, 2), extrapolation_factor = 2.0, n_bootstraps = 50,
+								   figsize = (1000, 350), weight_col = None, abundance_matrix = None, n_jobs = 4):
+	"""Creates iNEXT-style rarefaction / extrapolation curves of the Hill numbers against the sample size, one plot per
+	order, so samples of different sequencing depths are compared at equal size or coverage.
+
+	Parameters
+	----------
+	clone_df, png, title, count_col, split_col, line_width, weight_col, abundance_matrix:
+		See Diversity_Plot; clone counts must be integers
+	orders: iterable of ints
+		Hill number orders (0, 1 and / or 2) to plot; default is (0, 1, 2)
+	extrapolation_factor: float
+		Largest sample size as a multiple of every sample's observed size; default is 2.0
+	n_bootstraps: int
+		Number of bootstrap samples for the confidence bands, or 0 for none; default is 50
+	figsize: tuple of (int, int)
+		The width and height of every order's plot; default is (1000, 350)
+	n_jobs: int
+		Number of threads used for the bootstrap samples; default is 4
+
+	Returns
+	----------
+	plot: bokeh GridBox
+		The order plots stacked in one column
+	"""
+
+	diversity_cols = [count_col] if weight_col is None else [count_col, weight_col]
+	if abundance_matrix is not None:
+		samples = abundance_matrix.samples
+		sample_frequencies = [Clone_Size_Frequencies(abundance_matrix.Sample_Counts(sample)) for sample in samples]
+	elif split_col is not None:
+		samples, sample_frequencies = [], []
+		for sample, df in clone_df[diversity_cols + [split_col]].groupby([split_col]):
+			samples.append(sample)
+			sample_frequencies.append(Clone_Size_Frequencies(df[count_col], df[weight_col] if weight_col else None))
 	else:
 		samples = ["Repertoire"]
-		diversity_dfs = [clone_df[[count_col]]]
+		sample_frequencies = [Clone_Size_Frequencies(clone_df[count_col],
+													 clone_df[weight_col] if weight_col else None)]
 
-	sample_colors = (RGB(30, 160, 120), RGB(220, 90, 0), RGB(120, 110, 180), RGB(230, 40, 140))
-	for sample, df, line_color in zip(samples, diversity_dfs, sample_colors[:len(samples)]):
-		hill_indices = Hill_Diversity_Index(df[count_col])
-		n_orders = [i[0] for i in hill_indices]
-		order_diversities = [i[1] for i in hill_indices]
+	sample_colors = Sample_Colors(len(samples), (RGB(30, 160, 120), RGB(220, 90, 0), RGB(120, 110, 180),
+												 RGB(230, 40, 140)))
+	sample_curves = [Hill_Rarefaction_Extrapolation(clone_sizes, size_clones, orders = orders,
+													extrapolation_factor = extrapolation_factor,
+													n_bootstraps = n_bootstraps, n_jobs = n_jobs)
+					 for clone_sizes, size_clones in sample_frequencies]
 
-		#ADD MORE LINE STYLES (dotted, etc.)
-		plot.line(x = n_orders, y = order_diversities, color = line_color, line_width = line_width, legend = sample)
+	order_names = {0: "Richness (Order 0)", 1: "Exponential Shannon (Order 1)", 2: "Inverse Simpson (Order 2)"}
+	plots = []
+	for order in orders:
+		figure_params = {
+			"plot_width": figsize[0],
+			"plot_height": figsize[1],
+			"title": title + " - " + order_names[order] if title else order_names[order],
+			"tools": "pan, wheel_zoom, box_zoom, reset, save, help",
+			"toolbar_location": "right"
+		}
+		plot = figure(**figure_params)
+		plot.xaxis.axis_label = "Sample Size"
+		plot.yaxis.axis_label = "Hill Number"
+		plot.xaxis.formatter = BasicTickFormatter(use_scientific = False)
+		plot.yaxis.formatter = BasicTickFormatter(use_scientific = False)
 
-	if add_control_diversities:
-		total_clones = max([len(i) for i in diversity_dfs])
-		total_counts = max([df[count_col].sum() for df in diversity_dfs])
-
-		#Very highly polarized data creates a sample in which the top 20 clones are 20% of the total by prevalence
-		top20_20_data = [total_counts * 0.2 / 20] * 20
-		top20_20_data += [total_counts * 0.8 / (total_clones - 20) for _ in range(total_clones - 20)]
-		#Highly polarized data has the top 20 clones at 15% of the total
-		top20_15_data = [total_counts * 0.15 / 20] * 20
-		top20_15_data += [total_counts * 0.85 / (total_clones - 20) for _ in range(total_clones - 20)]
-		#Moderately polarized data has the top 20 clones at 10% of the total
-		top20_10_data = [total_counts * 0.1 / 20] * 20
-		top20_10_data += [total_counts * 0.9 / (total_clones - 20) for _ in range(total_clones - 20)]
-		#Lowly polarized data has the top 20 clones at 5% of the total
-		top20_5_data = [total_counts * 0.05 / 20] * 20
-		top20_5_data += [total_counts * 0.95 / (total_clones - 20) for _ in range(total_clones - 20)]
-
-		top20_20_diversities = [i[1] for i in Hill_Diversity_Index(top20_20_data)]
-		top20_15_diversities = [i[1] for i in Hill_Diversity_Index(top20_15_data)]
-		top20_10_diversities = [i[1] for i in Hill_Diversity_Index(top20_10_data)]
-		top20_5_diversities = [i[1] for i in Hill_Diversity_Index(top20_5_data)]
-		plot.line(x = n_orders, y = top20_20_diversities, color = RGB(160, 200, 230), alpha = 0.8, line_dash = (12,),
-				  line_width = line_width, legend = "Very Highly Polarized (Top 20 Clones 20%)")
-		plot.line(x = n_orders, y = top20_15_diversities, color = RGB(30, 120, 180), alpha = 0.8, line_dash = (12,),
-				  line_width = line_width, legend = "Highly Polarized (Top 20 Clones 15%)")
-		plot.line(x = n_orders, y = top20_10_diversities, color = RGB(180, 220, 140), alpha = 0.8, line_dash = (12,),
-				  line_width = line_width, legend = "Moderately Polarized (Top 20 Clones 10%)")
-		plot.line(x = n_orders, y = top20_5_diversities, color = RGB(50, 160, 40), alpha = 0.8, line_dash = (12,),
-				  line_width = line_width, legend = "Lowly Polarized (Top 20 Clones 5%)")
+		#Rarefied (solid) and extrapolated (dashed) segments share the observed point, so the curves are continuous
+		bands_data = {"xs": [], "ys": [], "color": []}
+		lines_data = {"Rarefied": {"xs": [], "ys": [], "color": [], "sample": []},
+					  "Extrapolated": {"xs": [], "ys": [], "color": [], "sample": []}}
+		observed_data = {"x": [], "y": [], "color": [], "sample": []}
+		for sample, curves_df, line_color in zip(samples, sample_curves, sample_colors):
+			order_df = curves_df[curves_df["Order"] == order]
+			sizes = order_df["Sample_Size"].values
+			bands_data["xs"].append(numpy.concatenate([sizes, sizes[::-1]]))
+			bands_data["ys"].append(numpy.concatenate([order_df["Lower"].values, order_df["Upper"].values[::-1]]))
+			bands_data["color"].append(line_color)
+
+			for method, method_rows in [("Rarefied", order_df["Method"] != "Extrapolated"),
+										("Extrapolated", order_df["Method"] != "Rarefied")]:
+				lines_data[method]["xs"].append(sizes[method_rows.values])
+				lines_data[method]["ys"].append(order_df["Diversity"].values[method_rows.values])
+				lines_data[method]["color"].append(line_color)
+				lines_data[method]["sample"].append(str(sample))
+
+			observed = order_df[order_df["Method"] == "Observed"]
+			observed_data["x"].extend(observed["Sample_Size"].tolist())
+			observed_data["y"].extend(observed["Diversity"].tolist())
+			observed_data["color"].extend([line_color] * len(observed))
+			observed_data["sample"].extend([str(sample)] * len(observed))
+
+		if n_bootstraps:
+			plot.patches(xs = "xs", ys = "ys", color = "color", alpha = 0.15, line_alpha = 0.0,
+						 source = ColumnDataSource(bands_data))
+		plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = line_width, legend = "sample",
+						source = ColumnDataSource(lines_data["Rarefied"]))
+		plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = line_width, line_dash = "dashed",
+						source = ColumnDataSource(lines_data["Extrapolated"]))
+		observed_points = plot.circle(x = "x", y = "y", color = "color", size = 8,
+									  source = ColumnDataSource(observed_data))
+		plot.add_tools(HoverTool(renderers = [observed_points],
+								 tooltips = [("Sample", "@sample"), ("Sample Size", "@x{0,0}"),
+											 ("Hill Number", "@y{0,0.0}")]))
+		plot.legend.location = "bottom_right"
+		plots.append(plot)
+
+	rarefaction_plot = gridplot(plots, ncols = 1, toolbar_location = "right")
 
 	if png is not None:
-		export_png(plot, png)
+		export_png(rarefaction_plot, png)
 
-	return plot
+	return rarefaction_plot
@@ -1,6 +1,247 @@
+import re
+import numpy
+import hashlib
+import colorsys
+from functools import lru_cache
+
 from bokeh.colors import RGB
+from bokeh.palettes import all_palettes
+
+from .Repertoire_Data import Category_Codes
+
+#Color used for missing (NaN) genes / isotypes in vectorized lookups
+missing_color = RGB(190, 190, 190)
+
+@lru_cache(maxsize = None)
+def Generate_Gene_Color(gene):
+	"""Generates a stable color for a gene name from a hash of the name, so it is the same in every run and plot.
+
+	Parameters
+	----------
+	gene: str
+		Name of the gene / isotype / family to generate a color for
+
+	Returns
+	----------
+	color: bokeh RGB
+		The generated color
+	"""
+
+	gene_hash = hashlib.md5(str(gene).encode("utf-8")).digest()
+	hue = int.from_bytes(gene_hash[:4], "little") / 2.0 ** 32
+	saturation = 0.55 + 0.4 * gene_hash[4] / 255.0
+	value = 0.7 + 0.25 * gene_hash[5] / 255.0
+	red, green, blue = colorsys.hsv_to_rgb(hue, saturation, value)
+
+	return RGB(int(red * 255), int(green * 255), int(blue * 255))
+
+@lru_cache(maxsize = None)
+def Generate_Gene_Palette(genes, locus = ""):
+	"""Generates distinguishable colors for the genes of one locus by spreading their hues evenly in sorted order.
+
+	Parameters
+	----------
+	genes: tuple of str
+		Sorted, unique names of the genes to generate colors for
+	locus: str
+		Name of the locus; each locus palette starts at its own (hashed) hue, so loci drawn together differ
+
+	Returns
+	----------
+	gene_palette: dict of {str: bokeh RGB}
+		The generated color for each gene
+	"""
+
+	locus_hash = hashlib.md5(locus.encode("utf-8")).digest()
+	first_hue = int.from_bytes(locus_hash[:4], "little") / 2.0 ** 32
+
+	return dict(zip(genes, Generate_Sample_Palette(len(genes), first_hue = first_hue)))
+
+def Gene_Locus(gene):
+	"""Gets the locus / segment prefix of a gene, family or isotype name (for example "IGKV1-39*01" to "IGKV")."""
+
+	return re.match(r"[A-Za-z]*", str(gene)).group(0)
+
+def Locus_Gene_Colors(genes):
+	"""Generates distinguishable colors for any set of genes, with a separate evenly spaced palette for each locus.
+
+	Colors only depend on the set of genes of each locus, so they are the same in every plot given the same genes.
+
+	Parameters
+	----------
+	genes: iterable of str
+		Names of the genes / families / isotypes to generate colors for
+
+	Returns
+	----------
+	gene_colors: dict of {str: bokeh RGB}
+		The generated color for each gene
+	"""
+
+	locus_genes = {}
+	for gene in set(genes):
+		locus_genes.setdefault(Gene_Locus(gene), []).append(gene)
+
+	gene_colors = {}
+	for locus in locus_genes:
+		gene_colors.update(Generate_Gene_Palette(tuple(sorted(locus_genes[locus])), locus))
+
+	return gene_colors
+
+@lru_cache(maxsize = None)
+def Generate_Sample_Palette(total_colors, first_hue = 0.05):
+	"""Generates any number of distinguishable colors by spreading their hues around the color wheel.
+
+	Parameters
+	----------
+	total_colors: int
+		Number of colors to generate
+	first_hue: float
+		Hue (0 to 1) of the first color; default is 0.05
+
+	Returns
+	----------
+	palette: tuple of bokeh RGB
+		The generated colors; the first colors of a longer palette are the same as those of a shorter one
+	"""
+
+	#Golden ratio hue steps keep neighboring (similarly named) genes / samples far apart on the color wheel
+	hues = (numpy.arange(total_colors) * 0.618033988749895 + first_hue) % 1.0
+	saturations = (0.95, 0.7, 0.85)
+	values = (0.95, 0.8, 0.65)
+
+	palette = []
+	for idx, hue in enumerate(hues):
+		red, green, blue = colorsys.hsv_to_rgb(hue, saturations[idx % 3], values[(idx // 3) % 3])
+		palette.append(RGB(int(red * 255), int(green * 255), int(blue * 255)))
+
+	return tuple(palette)
+
+def Sample_Colors(total_samples, palette = None):
+	"""Gets a color for each of any number of samples, starting from a preferred palette.
+
+	Parameters
+	----------
+	total_samples: int
+		Number of samples to color
+	palette: str or iterable of colors or None
+		Name of a Bokeh palette (for example "Category10") or the preferred colors; samples beyond the length of the
+		palette get generated colors; default is None (all colors generated)
 
-vgene_colors = {
+	Returns
+	----------
+	sample_colors: list of colors
+		The color of each sample
+	"""
+
+	if isinstance(palette, str):
+		#Use the smallest size of the named palette which covers all samples, or else its largest size
+		palette_sizes = sorted(all_palettes[palette])
+		covering_sizes = [size for size in palette_sizes if size >= total_samples]
+		palette = all_palettes[palette][covering_sizes[0] if covering_sizes else palette_sizes[-1]]
+	elif palette is None:
+		palette = ()
+
+	sample_colors = list(palette)[:total_samples]
+	sample_colors += Generate_Sample_Palette(total_samples)[len(sample_colors):]
+
+	return sample_colors
+
+class Gene_Color_Map(dict):
+	"""Dict of gene name: RGB color which generates a stable color for any gene missing from the table."""
+
+	def __missing__(self, gene):
+		#Generated colors are memoized by Generate_Gene_Color, so shared tables are never modified by lookups
+		return Generate_Gene_Color(gene)
+
+	def Extended(self, genes):
+		"""Gets a copy of the table with distinguishable per-locus colors for the genes missing from it (for example
+		light chain or TCR genes), leaving the table itself unchanged.
+
+		Parameters
+		----------
+		genes: iterable of str
+			All genes the copy should have a color for, for example every gene of a dashboard
+
+		Returns
+		----------
+		extended_colors: Gene_Color_Map
+			The copy of the table including the colors of the missing genes
+		"""
+
+		extended_colors = Gene_Color_Map(self)
+		extended_colors.update(Locus_Gene_Colors([gene for gene in genes if gene not in self]))
+
+		return extended_colors
+
+def Used_Gene_Colors(gene_colors, genes):
+	"""Gets the colors of only the genes present in a Series, for example to fingerprint a cached plot section.
+
+	Parameters
+	----------
+	gene_colors: Gene_Color_Map or dict
+		Table of gene: RGB color; genes missing from it get the colors Category_Color_Array gives them
+	genes: pandas Series
+		Categorical or object Series of the genes / isotypes / families a plot colors
+
+	Returns
+	----------
+	used_colors: dict of {str: str}
+		The hex color of each gene present in the Series
+	"""
+
+	codes, categories = Category_Codes(genes)
+	category_colors = _Category_Colors(categories, gene_colors)
+	used_codes = numpy.unique(codes[codes >= 0])
+
+	return {str(categories[code]): category_colors[code].to_hex() for code in used_codes}
+
+def _Category_Colors(categories, gene_colors):
+	"""Gets the color of each category from the table, or from per-locus palettes of the categories missing from it."""
+
+	if not isinstance(gene_colors, Gene_Color_Map):
+		gene_colors = Gene_Color_Map(gene_colors)
+
+	locus_colors = Locus_Gene_Colors([category for category in categories if category not in gene_colors])
+
+	return [locus_colors[category] if category in locus_colors else gene_colors[category] for category in categories]
+
+def Pack_RGBA(colors):
+	"""Packs an iterable of bokeh RGB colors into opaque RGBA uint32 values (as used by Bokeh image_rgba)."""
+
+	rgb = numpy.array([(color.r, color.g, color.b) for color in colors], dtype = numpy.uint32).reshape(-1, 3)
+	return rgb[:, 0] | (rgb[:, 1] << 8) | (rgb[:, 2] << 16) | numpy.uint32(255 << 24)
+
+def Category_Color_Array(series, gene_colors, color_format = "hex"):
+	"""Looks up colors for a gene / isotype Series once per category and expands them to rows by category code.
+
+	Parameters
+	----------
+	series: pandas Series
+		Categorical or object Series of genes / isotypes / families
+	gene_colors: Gene_Color_Map or dict
+		Table of gene: RGB color; categories missing from it get distinguishable per-locus colors
+	color_format: str
+		"hex" for an array of hex color strings or "uint32" for an array of packed RGBA values; default is "hex"
+
+	Returns
+	----------
+	colors: numpy array
+		The color of each row of the Series
+	"""
+
+	codes, categories = Category_Codes(series)
+
+	#Append the missing value color so -1 codes index the last entry
+	category_colors = _Category_Colors(categories, gene_colors) + [missing_color]
+	if color_format == "uint32":
+		category_colors = Pack_RGBA(category_colors)
+	else:
+		category_colors = numpy.array([color.to_hex() for color in category_colors], dtype = object)
+
+	return category_colors.take(codes)
+
+vgene_colors = Gene_Color_Map({
 	"IGHV1-17": RGB(255, 0, 0),
 	"IGHV1-18": RGB(255, 24, 0),
 	"IGHV1-2": RGB(255, 47, 0),
@@ -63,9 +304,9 @@ vgene_colors = {
 	"IGHV6-1": RGB(255, 0, 95),
 	"IGHV7-27": RGB(255, 0, 71),
 	"IGHV7-81": RGB(255, 0, 47)
-}
+})
 
-vfamily_colors = {
+vfamily_colors = Gene_Color_Map({
 	"IGHV1": RGB(254, 131, 0),
 	"IGHV2": RGB(185, 255, 0),
 	"IGHV3": RGB(27, 164, 172),
@@ -73,9 +314,9 @@ vfamily_colors = {
 	"IGHV5": RGB(150, 0, 210),
 	"IGHV6": RGB(255, 0, 95),
 	"IGHV7": RGB(35, 140, 20)
-}
+})
 
-jgene_colors = {
+jgene_colors = Gene_Color_Map({
 	"IGHJ1": RGB(57, 59, 121),
 	"IGHJ2": RGB(82, 84, 163),
 	"IGHJ3": RGB(107, 110, 207),
@@ -83,9 +324,9 @@ jgene_colors = {
 	"IGHJ5": RGB(99, 121, 57),
 	"IGHJ6": RGB(140, 162, 82),
 	"IGHJ2P": RGB(181, 207, 107)
-}
+})
 
-isotype_colors = {
+isotype_colors = Gene_Color_Map({
 	"IgG": RGB(55, 126, 184),
 	"IgG1": RGB(55, 126, 184),
 	"IgG2": RGB(55, 126, 184),
@@ -108,4 +349,14 @@ isotype_colors = {
 	"IGHD": RGB(152, 78, 163),
 	"IgE": RGB(255, 127, 0),
 	"IGHE": RGB(255, 127, 0)
-}
+})
+
+#Amino acids colored by side chain chemistry, as in sequence logos
+aminoacid_colors = Gene_Color_Map({
+	"A": RGB(40, 40, 40), "V": RGB(40, 40, 40), "L": RGB(40, 40, 40), "I": RGB(40, 40, 40), "P": RGB(40, 40, 40),
+	"W": RGB(40, 40, 40), "F": RGB(40, 40, 40), "M": RGB(40, 40, 40),
+	"G": RGB(51, 160, 44), "S": RGB(51, 160, 44), "T": RGB(51, 160, 44), "Y": RGB(51, 160, 44), "C": RGB(51, 160, 44),
+	"N": RGB(152, 78, 163), "Q": RGB(152, 78, 163),
+	"K": RGB(31, 120, 180), "R": RGB(31, 120, 180), "H": RGB(31, 120, 180),
+	"D": RGB(227, 26, 28), "E": RGB(227, 26, 28)
+})
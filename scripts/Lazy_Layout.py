@@ -0,0 +1,278 @@
+import os
+import json
+import gzip
+import html
+from string import Template
+
+from bokeh.models import CustomJS, Div
+from bokeh.models.widgets import Tabs, Panel
+from bokeh.embed import json_item
+from bokeh.resources import Resources, CDN
+from bokeh.util.serialization import make_id
+
+#Embeds a deferred panel the first time its tab is opened; the panel is either inline JSON or fetched from a URL
+LAZY_PANEL_JS = """
+var item = items[String(cb_obj.active)];
+window._lazy_panels = window._lazy_panels || {};
+if (item == null || window._lazy_panels[item.target]) {
+	return;
+}
+window._lazy_panels[item.target] = true;
+
+if (item.url != null) {
+	fetch(item.url).then(function(response) { return response.json(); }).then(function(panel_item) {
+		Bokeh.embed.embed_item(panel_item, item.target);
+	});
+} else {
+	Bokeh.embed.embed_item(JSON.parse(item.json), item.target);
+}
+"""
+
+def Model_Size(model, default_size = (1000, 800)):
+	"""Estimates the width and height of a Bokeh plot or (row / column) layout from its fixed plot sizes."""
+
+	if hasattr(model, "plot_width") and hasattr(model, "plot_height"):
+		return (model.plot_width, model.plot_height)
+
+	children = getattr(model, "children", None)
+	if not children:
+		#Widgets (such as the Mosaic color Select) only count with their fixed sizes
+		if hasattr(model, "width") and hasattr(model, "height"):
+			return (model.width or 0, model.height or 0)
+		return default_size
+
+	#Layout children may be (child, row, column) tuples for grids
+	child_sizes = [Model_Size(child[0] if isinstance(child, tuple) else child, default_size) for child in children]
+	if type(model).__name__ == "Row":
+		return (sum([size[0] for size in child_sizes]), max([size[1] for size in child_sizes]))
+	else:
+		return (max([size[0] for size in child_sizes]), sum([size[1] for size in child_sizes]))
+
+def Lazy_Tabs(panels, lazy = True, json_dir = None, json_url = None, active = 0, placeholder_size = None):
+	"""Creates tabs of (per-sample) panels where only the active tab is serialized with the page.
+
+	The other panels are serialized separately and embedded by BokehJS when their tab is first opened, so pages with
+	many samples load and lay out only the panels being viewed.
+
+	Parameters
+	----------
+	panels: list of (str, bokeh Model)
+		Tab title and plot / layout of each panel
+	lazy: bool
+		Whether to defer the panels of inactive tabs; if False all panels are added to the tabs directly; default is True
+	json_dir: str or None
+		Directory to write the deferred panel JSON documents to, which are then fetched when their tab is opened; if
+		None the panel JSON is stored in the page and only parsed and embedded when the tab is opened; default is None
+	json_url: str or None
+		URL / path of json_dir relative to the output HTML page; default is None (json_dir itself)
+		Note that browsers only allow fetching the panel files if the page is served over HTTP (not opened as a file)
+	active: int
+		Index of the tab shown first; default is 0
+	placeholder_size: tuple of (int, int) or None
+		Width and height reserved for each deferred panel, or None to use the panel's plot sizes; default is None
+
+	Returns
+	----------
+	tabs: bokeh Tabs
+		The tabs widget containing the panels / placeholders
+	"""
+
+	if json_dir is not None and not os.path.isdir(json_dir):
+		os.makedirs(json_dir)
+	if json_url is None:
+		json_url = json_dir
+
+	tab_panels = []
+	lazy_items = {}
+	for idx, (title, model) in enumerate(panels):
+		if not lazy or idx == active:
+			tab_panels.append(Panel(child = model, title = title))
+			continue
+
+		#The deferred panel is embedded into a placeholder element which reserves the panel's space
+		target = "lazy_panel_{0}".format(make_id())
+		panel_json = json.dumps(json_item(model, target = target))
+
+		if json_dir is not None:
+			json_filename = target + ".json"
+			with open(os.path.join(json_dir, json_filename), "w") as json_file:
+				json_file.write(panel_json)
+			lazy_items[str(idx)] = {"target": target, "url": json_url.rstrip("/") + "/" + json_filename}
+		else:
+			lazy_items[str(idx)] = {"target": target, "json": panel_json}
+
+		width, height = placeholder_size if placeholder_size is not None else Model_Size(model)
+		placeholder = Div(text = "<div id=\"{0}\"></div>".format(target), width = width, height = height)
+		tab_panels.append(Panel(child = placeholder, title = title))
+
+	tabs = Tabs(tabs = tab_panels, active = active)
+	if lazy_items:
+		tabs.js_on_change("active", CustomJS(args = {"items": lazy_items}, code = LAZY_PANEL_JS))
+
+	return tabs
+
+#Index page of a static site; panels are embedded as they near the viewport, fetching (and inflating) their JSON files
+STATIC_SITE_HTML = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+$resources
+<style>
+body { margin: 0 16px; font-family: sans-serif; }
+.lazy-panel { margin-bottom: 16px; }
+</style>
+</head>
+<body>
+<h2>$title</h2>
+$panel_divs
+<script type="application/json" id="panel-items">$panel_items</script>
+<script>
+(function() {
+	var panels = JSON.parse(document.getElementById("panel-items").textContent);
+
+	function Embed_Panel(panel) {
+		if (panel.embedded) {
+			return;
+		}
+		panel.embedded = true;
+
+		if (panel.item != null) {
+			Bokeh.embed.embed_item(panel.item, panel.target);
+			return;
+		}
+		fetch(panel.url).then(function(response) {
+			if (panel.compressed) {
+				return new Response(response.body.pipeThrough(new DecompressionStream("gzip"))).json();
+			}
+			return response.json();
+		}).then(function(panel_item) {
+			Bokeh.embed.embed_item(panel_item, panel.target);
+		});
+	}
+
+	var observer = null;
+	if ("IntersectionObserver" in window) {
+		observer = new IntersectionObserver(function(entries) {
+			entries.forEach(function(entry) {
+				if (entry.isIntersecting) {
+					observer.unobserve(entry.target);
+					Embed_Panel(panels[entry.target.dataset.panel]);
+				}
+			});
+		}, {rootMargin: "$preload_margin"});
+	}
+
+	panels.forEach(function(panel, idx) {
+		if (panel.item != null || observer == null) {
+			Embed_Panel(panel);
+		} else {
+			observer.observe(document.getElementById(panel.target).parentNode);
+		}
+	});
+})();
+</script>
+</body>
+</html>
+""")
+
+def Write_Static_Site(panels, site_dir, title = "Bokeh Dashboard", resources = "inline", inline_panels = 1,
+					  compress = False, preload_margin = 400):
+	"""Writes a sequence of Bokeh panels as a static site directory that loads its panels progressively.
+
+	The site holds a small index.html with one placeholder per panel and every panel serialized as a separate json_item
+	document in panels/. The first inline_panels panels are embedded in the page (so they are interactive right away);
+	the others are fetched and embedded when they scroll near the viewport. With inline resources the BokehJS files are
+	copied into static/, so the site works from a local file server without internet access. Note that browsers only
+	allow fetching the panel files if the site is served over HTTP (not opened as a file).
+
+	Parameters
+	----------
+	panels: list of (str, bokeh Model)
+		Name and plot / layout of each panel, in page order
+	site_dir: str
+		Directory to write the site to (created if needed; existing files are overwritten)
+	title: str
+		Title of the page; default is "Bokeh Dashboard"
+	resources: str
+		"inline" to copy the BokehJS files into the site, or "cdn" to load them from the Bokeh CDN; default is "inline"
+	inline_panels: int
+		Number of leading panels embedded in the page itself; default is 1
+	compress: bool
+		Whether to write the fetched panels gzip compressed (inflated in the browser with DecompressionStream); default
+		is False
+	preload_margin: int
+		Distance in pixels below the viewport at which panels start loading; default is 400
+
+	Returns
+	----------
+	index_filename: str
+		Path of the written index.html
+	"""
+
+	panel_dir = os.path.join(site_dir, "panels")
+	if not os.path.isdir(panel_dir):
+		os.makedirs(panel_dir)
+
+	if resources == "cdn":
+		resource_tags = CDN.render_js() + CDN.render_css()
+	elif resources == "inline":
+		static_dir = os.path.join(site_dir, "static")
+		if not os.path.isdir(static_dir):
+			os.makedirs(static_dir)
+
+		inline_resources = Resources(mode = "inline")
+		resource_tags = []
+		for kind, raw_files in (("js", inline_resources.js_raw), ("css", inline_resources.css_raw)):
+			for idx, raw in enumerate(raw_files):
+				static_filename = "bokeh_{0}.{1}".format(idx, kind)
+				with open(os.path.join(static_dir, static_filename), "w", encoding = "utf-8") as static_file:
+					static_file.write(raw)
+				if kind == "js":
+					resource_tags.append("<script src=\"static/{0}\"></script>".format(static_filename))
+				else:
+					resource_tags.append("<link rel=\"stylesheet\" href=\"static/{0}\">".format(static_filename))
+		resource_tags = "\n".join(resource_tags)
+	else:
+		raise ValueError("resources must be either \"inline\" or \"cdn\"!")
+
+	panel_divs = []
+	panel_items = []
+	for idx, (name, model) in enumerate(panels):
+		target = "panel_{0}".format(idx)
+		width, height = Model_Size(model)
+		#The wrapper reserves the panel's space, so the page does not jump as panels are embedded
+		panel_divs.append("<div class=\"lazy-panel\" data-panel=\"{0}\" title=\"{1}\" style=\"min-height: {2}px;\">"
+						  "<div id=\"{3}\"></div></div>".format(idx, html.escape(name), height, target))
+		standalone = model.document is None
+		item = json_item(model, target = target)
+		#json_item leaves a standalone panel as the root of a new document; release it so the panels can be added to
+		#another document (for example the dashboard's)
+		if standalone and model.document is not None:
+			model.document.remove_root(model)
+
+		if idx < inline_panels:
+			panel_items.append({"target": target, "item": item})
+			continue
+
+		panel_filename = "{0:03d}_{1}.json".format(idx, "".join([char if char.isalnum() else "_" for char in name]))
+		panel_json = json.dumps(item).encode("utf-8")
+		if compress:
+			panel_filename += ".gz"
+			with gzip.open(os.path.join(panel_dir, panel_filename), "wb") as panel_file:
+				panel_file.write(panel_json)
+		else:
+			with open(os.path.join(panel_dir, panel_filename), "wb") as panel_file:
+				panel_file.write(panel_json)
+		panel_items.append({"target": target, "url": "panels/" + panel_filename, "compressed": compress})
+
+	#Closing tags inside the embedded JSON would end its script element early
+	page = STATIC_SITE_HTML.substitute(title = html.escape(title), resources = resource_tags, panel_divs = "\n".join(panel_divs),
+									   panel_items = json.dumps(panel_items).replace("</", "<\\/"),
+									   preload_margin = "0px 0px {0}px 0px".format(preload_margin))
+
+	index_filename = os.path.join(site_dir, "index.html")
+	with open(index_filename, "w", encoding = "utf-8") as index_file:
+		index_file.write(page)
+
+	return index_filename
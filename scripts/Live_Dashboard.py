@@ -0,0 +1,460 @@
+import numpy
+import pandas
+import asyncio
+import threading
+from functools import partial
+from itertools import cycle
+from squarify import squarify
+
+from bokeh.plotting import figure
+from bokeh.models import Range1d, HoverTool, ColumnDataSource, BasicTickFormatter
+from bokeh.models.widgets import Select, Div
+from bokeh.colors import RGB
+from bokeh.layouts import column, row, gridplot
+from bokeh.application import Application
+from bokeh.application.handlers import FunctionHandler
+from bokeh.server.server import Server
+
+from .Diversity import Hill_Diversity_Index
+from .Gene_Colors import vgene_colors, vfamily_colors, jgene_colors, Sample_Colors, Category_Color_Array
+from .Repertoire_Data import Sample_Set_Keys, Recode_Categories, Strip_Allele, Gene_Family
+
+class Live_Repertoire_Dashboard(object):
+	def __init__(self, title = "Live Repertoire Dashboard", mosaic_top_clones = 2000, min_shared = 2,
+				 clone_col = "CloneID", count_col = "Clustered", sample_col = "Sample", vgene_col = "VGene",
+				 jgene_col = "JGene", figsize = (1200, 900)):
+		"""Creates a Bokeh server dashboard whose plots update in place as new clone batches are added.
+
+		Clone batches are merged into running per-sample aggregates with Add_Batch; every open browser session is then
+		updated through ColumnDataSource stream/patch calls (or a data swap for the re-tiled Mosaic) instead of
+		rebuilding its figures.
+
+		Parameters
+		----------
+		title: str
+			Title shown at the top of the dashboard page; default is "Live Repertoire Dashboard"
+		mosaic_top_clones: int
+			Limit for the total clones to display for the Mosaic plot; default is 2000
+		min_shared: int
+			Minimum number of samples a clone must be in to be counted in the UpSet shared sets; default is 2
+		clone_col: str
+			Header / name for the column containing the clone IDs; default is "CloneID"
+		count_col: str
+			Header / name for the column containing the clone counts; default is "Clustered"
+		sample_col: str
+			Header / name for the column containing the sample names of a batch; default is "Sample"
+		vgene_col: str or None
+			Header / name for the column containing the V genes used to color the Mosaic tiles; default is "VGene"
+		jgene_col: str or None
+			Header / name for the column containing the J genes used to color the Mosaic tiles; default is "JGene"
+		figsize: tuple of (int, int)
+			The width and height of the dashboard; default is (1200, 900)
+		"""
+
+		self.title = title
+		self.mosaic_top_clones = mosaic_top_clones
+		self.min_shared = min_shared
+		self.clone_col = clone_col
+		self.count_col = count_col
+		self.sample_col = sample_col
+		self.vgene_col = vgene_col
+		self.jgene_col = jgene_col
+		self.figsize = figsize
+
+		#Running aggregates: clone counts per sample, the genes of each clone and the set of samples containing each
+		#clone, identified by the (wrapping) sum of random 64-bit sample keys as in Clone_Abundance_Matrix
+		self.samples = []
+		self.sample_keys = Sample_Set_Keys(0)
+		self.sample_clone_counts = []
+		self.gene_cols = [gene_col for gene_col in (vgene_col, jgene_col) if gene_col is not None]
+		self.clone_genes = pandas.DataFrame(columns = self.gene_cols, dtype = object)
+		self.clone_set_keys = pandas.Series([], dtype = numpy.uint64)
+		self.clone_set_sizes = pandas.Series([], dtype = numpy.int64)
+		self.set_samples = {0: ()}
+
+		#Plot data derived from the aggregates, shared (read-only) by all sessions
+		self.sample_diversities = {}
+		self.sample_mosaics = {}
+		self.shared_set_counts = {}
+
+		self.lock = threading.Lock()
+		self.document_states = {}
+		self.server = None
+
+	def Add_Batch(self, batch_df, sample = None):
+		"""Merges a batch of clones into the running aggregates and schedules updates for all open sessions.
+
+		Parameters
+		----------
+		batch_df: pandas DataFrame
+			New clones with clone_col and count_col columns (and sample_col if sample is None)
+		sample: str or None
+			Sample name for all clones in the batch, or None to split the batch on sample_col; default is None
+		"""
+
+		if sample is not None:
+			sample_batches = [(sample, batch_df)]
+		else:
+			sample_batches = [sample_df_tup for sample_df_tup in batch_df.groupby(self.sample_col, sort = False)]
+
+		with self.lock:
+			for sample, df in sample_batches:
+				batch_counts = df.groupby(self.clone_col)[self.count_col].sum()
+
+				if sample not in self.samples:
+					self.samples.append(sample)
+					#Keys are generated from a fixed seed, so the keys of existing samples stay the same
+					self.sample_keys = Sample_Set_Keys(len(self.samples))
+					self.sample_clone_counts.append(pandas.Series([], dtype = batch_counts.dtype))
+
+				sample_idx = self.samples.index(sample)
+				new_clones = batch_counts.index.difference(self.sample_clone_counts[sample_idx].index)
+				merged_counts = self.sample_clone_counts[sample_idx].add(batch_counts, fill_value = 0)
+				self.sample_clone_counts[sample_idx] = merged_counts
+
+				#Clones new to the sample move to the set with the sample added
+				all_clones = self.clone_set_keys.index.union(new_clones)
+				set_keys = self.clone_set_keys.reindex(all_clones, fill_value = 0).values.astype(numpy.uint64)
+				set_sizes = self.clone_set_sizes.reindex(all_clones, fill_value = 0).values
+				new_idxs = all_clones.get_indexer(new_clones)
+				with numpy.errstate(over = "ignore"):
+					moved_keys = set_keys[new_idxs] + self.sample_keys[sample_idx]
+				for old_key, new_key in set(zip(set_keys[new_idxs].tolist(), moved_keys.tolist())):
+					self.set_samples.setdefault(new_key, self.set_samples[old_key] + (sample_idx,))
+				set_keys[new_idxs] = moved_keys
+				set_sizes[new_idxs] += 1
+				self.clone_set_keys = pandas.Series(set_keys, index = all_clones)
+				self.clone_set_sizes = pandas.Series(set_sizes, index = all_clones)
+
+				#Each clone keeps the genes it was first seen with
+				batch_gene_cols = [gene_col for gene_col in self.gene_cols if gene_col in df.columns]
+				if batch_gene_cols:
+					batch_genes = df.groupby(self.clone_col)[batch_gene_cols].first()
+					self.clone_genes = self.clone_genes.combine_first(batch_genes.astype(object))
+
+				self.sample_diversities[sample] = self.Sample_Diversity(merged_counts)
+				self.sample_mosaics[sample] = self.Sample_Mosaic(merged_counts)
+
+			self.shared_set_counts = self.Shared_Set_Counts()
+
+		for doc in list(self.document_states):
+			doc.add_next_tick_callback(partial(self.Update_Document, doc))
+
+	def Sample_Diversity(self, clone_counts):
+		"""Calculates the Hill diversity orders and indices for a sample's merged clone counts."""
+
+		hill_indices = Hill_Diversity_Index(clone_counts.values)
+		return [i[0] for i in hill_indices], [i[1] for i in hill_indices]
+
+	def Sample_Mosaic(self, clone_counts):
+		"""Calculates the Mosaic tile positions and gene colors of a sample's top clones."""
+
+		top_counts = clone_counts.nlargest(self.mosaic_top_clones)
+		clone_freqs = top_counts.values.astype(float) / float(top_counts.sum())
+		mosaic_rects = squarify(clone_freqs.tolist(), 0.0, 0.0, 1.0, 1.0)
+
+		alternating_colors = cycle([RGB(102, 194, 165).to_hex(), RGB(252, 141, 98).to_hex(),
+									RGB(141, 160, 203).to_hex()])
+		mosaic_data = {
+			"CloneID": top_counts.index.tolist(),
+			"Count": top_counts.values.tolist(),
+			"Clone_Frequencies": clone_freqs.tolist(),
+			"x": [rect["x"] + rect["dx"] / 2.0 for rect in mosaic_rects],
+			"y": [rect["y"] + rect["dy"] / 2.0 for rect in mosaic_rects],
+			"width": [rect["dx"] for rect in mosaic_rects],
+			"height": [rect["dy"] for rect in mosaic_rects],
+			"alternating_colors": [next(alternating_colors) for _ in mosaic_rects]
+		}
+
+		#Tiles are colored by gene as in Mosaic_Plot, looking colors up once per gene; clones without genes are gray
+		top_genes = self.clone_genes.reindex(top_counts.index)
+		missing_genes = pandas.Series([None] * len(top_genes), index = top_genes.index, dtype = object)
+		vgenes = top_genes[self.vgene_col] if self.vgene_col is not None else missing_genes
+		jgenes = top_genes[self.jgene_col] if self.jgene_col is not None else missing_genes
+		mosaic_data["VGene"] = vgenes.fillna("").tolist()
+		mosaic_data["JGene"] = jgenes.fillna("").tolist()
+		mosaic_data["vgene_colors"] = Category_Color_Array(Recode_Categories(vgenes, Strip_Allele), vgene_colors).tolist()
+		mosaic_data["vfamily_colors"] = Category_Color_Array(Recode_Categories(vgenes, Gene_Family),
+															 vfamily_colors).tolist()
+		mosaic_data["jgene_colors"] = Category_Color_Array(Recode_Categories(jgenes, Strip_Allele), jgene_colors).tolist()
+
+		return mosaic_data
+
+	def Shared_Set_Counts(self):
+		"""Counts the clones shared by each combination of samples from the clone sample set keys."""
+
+		shared_keys = self.clone_set_keys.values[self.clone_set_sizes.values >= self.min_shared]
+		set_keys, set_counts = numpy.unique(shared_keys, return_counts = True)
+
+		return dict(zip(set_keys.tolist(), set_counts.tolist()))
+
+	def Make_Document(self, doc):
+		"""Bokeh application handler which builds the dashboard figures for a new browser session."""
+
+		diversity_plot = figure(plot_width = int(self.figsize[0] * 0.5), plot_height = int(self.figsize[1] * 0.5),
+								x_range = Range1d(0, 10), y_axis_type = "log", title = "Repertoire Diversity",
+								tools = "save, help", toolbar_location = "right")
+		diversity_plot.xaxis.axis_label = "Order (N)"
+		diversity_plot.yaxis.axis_label = "Hill Diversity Constant"
+		diversity_plot.yaxis.formatter = BasicTickFormatter()
+		diversity_source = ColumnDataSource({"xs": [], "ys": [], "sample": [], "color": []})
+		diversity_plot.multi_line(xs = "xs", ys = "ys", color = "color", line_width = 3, legend = "sample",
+								  source = diversity_source)
+
+		upset_width = int(self.figsize[0] * 0.5)
+		upset_bars_plot = figure(plot_width = int(upset_width * 0.6), plot_height = int(self.figsize[1] * 0.375),
+								 title = "Shared Clone Sets", tools = "save, reset, help", outline_line_alpha = 0.0)
+		upset_bars_plot.grid.visible = False
+		upset_bars_plot.xaxis.visible = False
+		upset_bars_plot.yaxis.axis_label = "Total Shared Clones"
+		upset_bars_source = ColumnDataSource({"x": [], "top": [], "samples": []})
+		upset_bars_plot.vbar(x = "x", top = "top", width = 0.5, bottom = 0, color = "#96AAC8",
+							 source = upset_bars_source)
+		upset_bars_plot.add_tools(HoverTool(tooltips = [("Samples", "@samples"), ("Shared Clones", "@top")]))
+
+		sample_sets_plot = figure(plot_width = int(upset_width * 0.6), plot_height = int(self.figsize[1] * 0.125),
+								  x_range = upset_bars_plot.x_range, y_range = Range1d(-0.5, 0.5),
+								  tools = "save, reset, help", outline_line_alpha = 0.0)
+		sample_sets_plot.grid.visible = False
+		sample_sets_plot.axis.visible = False
+		set_links_source = ColumnDataSource({"x0": [], "y0": [], "x1": [], "y1": []})
+		set_circles_source = ColumnDataSource({"x": [], "y": []})
+		sample_sets_plot.segment(x0 = "x0", y0 = "y0", x1 = "x1", y1 = "y1", line_width = 5, line_color = "black",
+								 source = set_links_source)
+		sample_sets_plot.circle(x = "x", y = "y", radius = 0.15, fill_color = "black", line_color = None,
+								source = set_circles_source)
+
+		clone_bar_plot = figure(plot_width = int(upset_width * 0.4), plot_height = int(self.figsize[1] * 0.125),
+								y_range = sample_sets_plot.y_range, tools = "save, reset, help",
+								outline_line_alpha = 0.0, y_axis_location = "right")
+		clone_bar_plot.grid.visible = False
+		clone_bar_plot.x_range.flipped = True
+		clone_bar_plot.xaxis.axis_label = "Total Clones"
+		clone_bar_plot.yaxis.major_tick_line_color = None
+		clone_bars_source = ColumnDataSource({"y": [], "right": []})
+		clone_bar_plot.hbar(y = "y", right = "right", height = 0.5, left = 0, color = "#96AAC8",
+							source = clone_bars_source)
+
+		upset_grid = gridplot([None, upset_bars_plot, clone_bar_plot, sample_sets_plot], ncols = 2,
+							  toolbar_location = None)
+
+		mosaic_plot = figure(plot_width = int(self.figsize[0] * 0.5), plot_height = int(self.figsize[0] * 0.5),
+							 x_range = Range1d(-0.1, 1.1, bounds = (-1.0, 2.0)),
+							 y_range = Range1d(-0.1, 1.1, bounds = (-1.0, 2.0)), title = "Clonotype Frequencies Mosaic",
+							 tools = "pan, wheel_zoom, box_zoom, save, reset, help", active_scroll = "wheel_zoom")
+		mosaic_plot.grid.visible = False
+		mosaic_plot.axis.visible = False
+		mosaic_source = ColumnDataSource({key: [] for key in ["CloneID", "Count", "Clone_Frequencies", "x", "y",
+															   "width", "height", "VGene", "JGene", "vgene_colors",
+															   "vfamily_colors", "jgene_colors", "alternating_colors"]})
+		mosaic_tiles = mosaic_plot.rect(x = "x", y = "y", width = "width", height = "height",
+										fill_color = "vgene_colors", line_color = "black", line_width = 0.3,
+										source = mosaic_source)
+		mosaic_plot.add_tools(HoverTool(point_policy = "snap_to_data",
+										tooltips = [("Clone ID", "@CloneID"), ("Count", "@Count"),
+													("Clone Frequency", "@Clone_Frequencies{(0.00%)}"),
+													("V Gene", "@VGene"), ("J Gene", "@JGene")]))
+		mosaic_select = Select(title = "Mosaic sample:", options = [], value = "")
+
+		#The tile color columns are sent with the tile data, so recoloring only switches the glyph's color field
+		mosaic_color_cols = {"V Gene": "vgene_colors", "V Family": "vfamily_colors", "J Gene": "jgene_colors",
+							 "Alternating": "alternating_colors"}
+		mosaic_color_select = Select(title = "Color by:", options = list(mosaic_color_cols), value = "V Gene")
+		mosaic_color_select.on_change("value", lambda attr, old, new: setattr(mosaic_tiles.glyph, "fill_color",
+																			  mosaic_color_cols[new]))
+
+		doc_state = {
+			"diversity_source": diversity_source,
+			"diversity_rows": {},
+			"upset_bars_source": upset_bars_source,
+			"set_links_source": set_links_source,
+			"set_circles_source": set_circles_source,
+			"set_rows": {},
+			"sample_sets_plot": sample_sets_plot,
+			"clone_bar_plot": clone_bar_plot,
+			"clone_bars_source": clone_bars_source,
+			"mosaic_source": mosaic_source,
+			"mosaic_select": mosaic_select,
+			"mosaic_data": None,
+			"total_samples": 0
+		}
+		mosaic_select.on_change("value", lambda attr, old, new: self.Update_Document(doc))
+
+		with self.lock:
+			self.document_states[doc] = doc_state
+		doc.on_session_destroyed(lambda session_context: self.Remove_Document(doc))
+
+		self.Update_Document(doc)
+
+		doc.title = self.title
+		doc.add_root(column(Div(text = "<h2>{0}</h2>".format(self.title)), row(diversity_plot, upset_grid),
+							column(row(mosaic_select, mosaic_color_select), mosaic_plot)))
+
+	def Remove_Document(self, doc):
+		"""Stops sending updates to the document of a closed browser session."""
+
+		with self.lock:
+			self.document_states.pop(doc, None)
+
+	def Update_Document(self, doc):
+		"""Streams or patches the current aggregates into a session's data sources; runs on the session's IO loop."""
+
+		with self.lock:
+			doc_state = self.document_states.get(doc)
+			if doc_state is None:
+				return
+
+			samples = list(self.samples)
+			sample_diversities = dict(self.sample_diversities)
+			sample_mosaics = dict(self.sample_mosaics)
+			shared_set_counts = dict(self.shared_set_counts)
+			set_samples = {set_key: self.set_samples[set_key] for set_key in shared_set_counts}
+			sample_totals = [len(clone_counts) for clone_counts in self.sample_clone_counts]
+
+		#Diversity lines: stream newly seen samples and patch the lines of samples that received clones
+		diversity_rows = doc_state["diversity_rows"]
+		diversity_source = doc_state["diversity_source"]
+		new_lines = {"xs": [], "ys": [], "sample": [], "color": []}
+		line_patches = []
+		sample_colors = Sample_Colors(len(samples), "Category10")
+		for sample_idx, sample in enumerate(samples):
+			orders, diversities = sample_diversities[sample]
+			if sample not in diversity_rows:
+				diversity_rows[sample] = len(diversity_rows)
+				new_lines["xs"].append(orders)
+				new_lines["ys"].append(diversities)
+				new_lines["sample"].append(str(sample))
+				new_lines["color"].append(sample_colors[sample_idx])
+			elif diversity_source.data["ys"][diversity_rows[sample]] != diversities:
+				line_patches.append((diversity_rows[sample], diversities))
+		if new_lines["sample"]:
+			diversity_source.stream(new_lines)
+		if line_patches:
+			diversity_source.patch({"ys": line_patches})
+
+		#UpSet shared sets: bars keep the position they first appeared at so existing bars only need patching
+		set_rows = doc_state["set_rows"]
+		upset_bars_source = doc_state["upset_bars_source"]
+		new_bars = {"x": [], "top": [], "samples": []}
+		new_links = {"x0": [], "y0": [], "x1": [], "y1": []}
+		new_circles = {"x": [], "y": []}
+		bar_patches = []
+		for set_key, set_count in shared_set_counts.items():
+			if set_key not in set_rows:
+				x_pos = len(set_rows)
+				set_rows[set_key] = x_pos
+				set_ys = sorted(set_samples[set_key])
+
+				new_bars["x"].append(x_pos)
+				new_bars["top"].append(set_count)
+				new_bars["samples"].append(", ".join([str(samples[sample_idx]) for sample_idx in set_ys]))
+				new_links["x0"].append(x_pos)
+				new_links["y0"].append(min(set_ys))
+				new_links["x1"].append(x_pos)
+				new_links["y1"].append(max(set_ys))
+				new_circles["x"] += [x_pos] * len(set_ys)
+				new_circles["y"] += set_ys
+
+			elif upset_bars_source.data["top"][set_rows[set_key]] != set_count:
+				bar_patches.append((set_rows[set_key], set_count))
+		#Clones moving into larger sets can empty a previously shared set
+		for set_key, x_pos in set_rows.items():
+			if set_key not in shared_set_counts and upset_bars_source.data["top"][x_pos] != 0:
+				bar_patches.append((x_pos, 0))
+		if new_bars["x"]:
+			upset_bars_source.stream(new_bars)
+			doc_state["set_links_source"].stream(new_links)
+			doc_state["set_circles_source"].stream(new_circles)
+		if bar_patches:
+			upset_bars_source.patch({"top": bar_patches})
+
+		#Total clones per sample
+		clone_bars_source = doc_state["clone_bars_source"]
+		total_samples = doc_state["total_samples"]
+		if len(samples) > total_samples:
+			clone_bars_source.stream({"y": list(range(total_samples, len(samples))),
+									  "right": sample_totals[total_samples:]})
+			doc_state["sample_sets_plot"].y_range.end = len(samples) - 0.5
+			clone_bar_plot = doc_state["clone_bar_plot"]
+			clone_bar_plot.yaxis.ticker = list(range(len(samples)))
+			clone_bar_plot.yaxis.major_label_overrides = {str(idx): str(sample) for idx, sample in enumerate(samples)}
+			doc_state["total_samples"] = len(samples)
+		total_patches = [(idx, total) for idx, total in enumerate(sample_totals[:total_samples])
+						 if clone_bars_source.data["right"][idx] != total]
+		if total_patches:
+			clone_bars_source.patch({"right": total_patches})
+
+		#Mosaic tiles are re-laid out when the selected sample changes, so the tile data is swapped as a whole
+		mosaic_select = doc_state["mosaic_select"]
+		if len(mosaic_select.options) != len(samples):
+			mosaic_select.options = [str(sample) for sample in samples]
+			if not mosaic_select.value and samples:
+				mosaic_select.value = str(samples[0])
+		selected_samples = [sample for sample in samples if str(sample) == mosaic_select.value]
+		if selected_samples:
+			mosaic_data = sample_mosaics[selected_samples[0]]
+			if mosaic_data is not doc_state["mosaic_data"]:
+				doc_state["mosaic_source"].data = mosaic_data
+				doc_state["mosaic_data"] = mosaic_data
+
+	def Serve(self, port = 5006, address = "localhost", show_browser = False, run_forever = True):
+		"""Starts a local Bokeh server for the live dashboard.
+
+		Parameters
+		----------
+		port: int
+			Port for the Bokeh server to listen on (0 picks a free port); default is 5006
+		address: str
+			Address for the Bokeh server to listen on; default is "localhost"
+		show_browser: bool
+			Whether to open the dashboard page in a browser window once the server starts; default is False
+		run_forever: bool
+			Whether to block and run the server IO loop (False when the caller runs the loop); default is True
+
+		Returns
+		----------
+		server: bokeh Server
+			The started Bokeh server
+		"""
+
+		application = Application(FunctionHandler(self.Make_Document))
+		self.server = Server({"/": application}, port = port, address = address)
+		self.server.start()
+
+		if show_browser:
+			self.server.io_loop.add_callback(self.server.show, "/")
+		if run_forever:
+			self.server.io_loop.start()
+
+		return self.server
+
+	def Serve_In_Thread(self, port = 5006, address = "localhost"):
+		"""Starts the local Bokeh server on a background thread, so batches can be added from the calling thread.
+
+		Returns
+		----------
+		server: bokeh Server
+			The started Bokeh server; its URL is "http://{address}:{server.port}/"
+		"""
+
+		server_started = threading.Event()
+
+		def Run_Server():
+			asyncio.set_event_loop(asyncio.new_event_loop())
+			self.Serve(port = port, address = address, run_forever = False)
+			server_started.set()
+			self.server.io_loop.start()
+
+		server_thread = threading.Thread(target = Run_Server, daemon = True)
+		server_thread.start()
+		server_started.wait()
+
+		return self.server
+
+	def Stop(self):
+		"""Stops the running Bokeh server."""
+
+		if self.server is not None:
+			self.server.io_loop.add_callback(self.server.stop)
+			self.server.io_loop.add_callback(self.server.io_loop.stop)
+			self.server = None
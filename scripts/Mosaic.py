@@ -4,7 +4,7 @@ from squarify import squarify
 from itertools import cycle
 
 from bokeh.plotting import figure
-from bokeh.models import (Range1d, HoverTool, ColumnDataSource, CustomJS, ColorBar, LinearColorMapper,
+from bokeh.models import (Range1d, HoverTool, TapTool, ColumnDataSource, CustomJS, ColorBar, LinearColorMapper,
 						  NumeralTickFormatter, FixedTicker)
 from bokeh.models.widgets import Select
 from bokeh.colors import RGB
@@ -12,12 +12,23 @@ from bokeh.palettes import viridis
 from bokeh.io.export import export_png
 from bokeh.layouts import column
 
-from .Gene_Colors import vgene_colors, vfamily_colors, jgene_colors, isotype_colors
+from .Gene_Colors import vgene_colors, vfamily_colors, jgene_colors, isotype_colors, Category_Color_Array
+from .Repertoire_Data import Recode_Categories, Strip_Allele, Gene_Family, Top_Clone_Order
+from .Raster import Color_Array_To_RGBA, Rasterize_Rects
 
 def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col = "Clustered", vgene_col = "VGene",
 				jgene_col = "JGene", isotype_col = "Isotype", vshm_col = "V_SHM", jshm_col = "J_SHM",
 				vgene_colors = vgene_colors, vfamily_colors = vfamily_colors, jgene_colors = jgene_colors,
-				isotype_colors = isotype_colors, line_width = 0.3, figsize = (600, 600), hover_tooltip = True):
+				isotype_colors = isotype_colors, line_width = 0.3, figsize = (600, 600), hover_tooltip = True,
+				raster = False, raster_size = None, raster_color_by = "Alternating (3)", raster_hover_clones = 1000,
+				n_jobs = 4, clone_col = "CloneID", clone_details = False):
+	"""Creates a mosaic (treemap) plot of the top clones of a repertoire, with tile areas proportional to clone size.
+
+	In raster mode the tiles are drawn into one image colored by raster_color_by. With clone_details, the tiles carry
+	only their clone ID and an integer code of their raster_color_by color, and can be tapped to show the full clone
+	records from a Bokeh server (see Clone_Detail_Panel); the coloring is then fixed as in raster mode.
+	"""
+
 	figure_params = {
 		"plot_width": figsize[0],
 		"plot_height": figsize[1],
@@ -37,7 +48,7 @@ def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col =
 
 	hover_tooltips = [("Clone ID", "@CloneID")]
 
-	info_cols = [count_col]
+	info_cols = [count_col] if clone_col not in clone_df.columns else [clone_col, count_col]
 	if vgene_col is not None:
 		info_cols.append(vgene_col)
 		hover_tooltips.append(("V Gene", "@" + vgene_col))
@@ -55,14 +66,17 @@ def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col =
 		hover_tooltips.append(("J Gene SHM", "@" + jshm_col + "{(0.00%)}"))
 
 	if hover_tooltip:
+		#Clone detail tiles carry no gene / SHM columns, so their tooltip only shows the clone (and its frequency)
+		if clone_details:
+			hover_tooltips = hover_tooltips[:1]
 		hover_tool = HoverTool(point_policy = "snap_to_data", tooltips = hover_tooltips)
 		plot.add_tools(hover_tool)
 
-	mosaic_df = clone_df[info_cols]
-	mosaic_df = mosaic_df.sort_values([count_col], ascending = [False])
-
-	if top_clones:
-		mosaic_df = mosaic_df.head(top_clones)
+	#Only the top clones are selected and sorted (ties in DataFrame order)
+	ranked_rows = Top_Clone_Order(clone_df[count_col].values, top_clones if top_clones else None)
+	mosaic_df = clone_df[info_cols].take(ranked_rows)
+	if clone_col in mosaic_df.columns and clone_col != "CloneID":
+		mosaic_df = mosaic_df.rename(columns = {clone_col: "CloneID"})
 
 	total_area = float(mosaic_df[count_col].sum())
 	mosaic_df["Clone_Frequencies"] = mosaic_df[count_col].astype(float) / total_area
@@ -91,19 +105,22 @@ def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col =
 	#Set up various mosaic coloring options and associated legends
 	color_select_options = ["Alternating (2)", "Alternating (3)"]
 	if vgene_col in mosaic_df.columns:
-		mosaic_df["vgene_colors"] = mosaic_df[vgene_col].map(vgene_colors)
-		vfamilies = mosaic_df[vgene_col].str.split("-").str[0]
-		mosaic_df["vfamily_colors"] = vfamilies.map(vfamily_colors)
+		#Families and colors are looked up once per gene category rather than once per clone
+		vfamilies = Recode_Categories(mosaic_df[vgene_col], Gene_Family)
+		vgenes = Recode_Categories(mosaic_df[vgene_col], Strip_Allele)
+		mosaic_df["vgene_colors"] = Category_Color_Array(vgenes, vgene_colors)
+		mosaic_df["vfamily_colors"] = Category_Color_Array(vfamilies, vfamily_colors)
 		color_select_options.append("V Gene")
 		color_select_options.append("V Family")
 		mosaic_df["VGene_Legend"] = mosaic_df[vgene_col]
-		mosaic_df["VFamily_Legend"] = mosaic_df[vgene_col].str.split("-").str[0]
+		mosaic_df["VFamily_Legend"] = vfamilies
 	if jgene_col in mosaic_df.columns:
-		mosaic_df["jgene_colors"] = mosaic_df[jgene_col].map(jgene_colors)
+		jgenes = Recode_Categories(mosaic_df[jgene_col], Strip_Allele)
+		mosaic_df["jgene_colors"] = Category_Color_Array(jgenes, jgene_colors)
 		color_select_options.append("J Gene")
 		mosaic_df["JGene_Legend"] = mosaic_df[jgene_col]
 	if isotype_col in mosaic_df.columns:
-		mosaic_df["isotype_colors"] = mosaic_df[isotype_col].map(isotype_colors)
+		mosaic_df["isotype_colors"] = Category_Color_Array(mosaic_df[isotype_col], isotype_colors)
 		color_select_options.append("Isotype")
 		mosaic_df["Isotype_Legend"] = mosaic_df[isotype_col]
 
@@ -138,10 +155,52 @@ def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col =
 								 label_standoff = 12, formatter = colorbar_tick_formatter, ticker = jshm_ticks)
 		plot.add_layout(jshm_colorbar, "right")
 
-	mosaic_source = ColumnDataSource(mosaic_df)
+	color_option_cols = {
+		"Alternating (2)": "alternating2_colors",
+		"Alternating (3)": "alternating3_colors",
+		"V Gene": "vgene_colors",
+		"V Family": "vfamily_colors",
+		"J Gene": "jgene_colors",
+		"Isotype": "isotype_colors",
+		"V Gene SHM": "vshm_colors",
+		"J Gene SHM": "jshm_colors"
+	}
+
+	#Raster mode draws every tile into one image; only the top clones are kept as (invisible) tiles for the hover tool
+	if raster:
+		if raster_size is None:
+			raster_size = figsize
+
+		tile_colors = Color_Array_To_RGBA(mosaic_df[color_option_cols[raster_color_by]])
+		half_widths = mosaic_df["width"].values / 2.0
+		half_heights = mosaic_df["height"].values / 2.0
+		mosaic_image = Rasterize_Rects(mosaic_df["x"].values - half_widths, mosaic_df["y"].values - half_heights,
+									   mosaic_df["x"].values + half_widths, mosaic_df["y"].values + half_heights,
+									   tile_colors, raster_size, line_color = "#000000" if line_width else None,
+									   n_jobs = n_jobs)
+		plot.image_rgba(image = [mosaic_image], x = 0.0, y = 0.0, dw = 1.0, dh = 1.0)
 
-	plot.rect(x = "x", y = "y", width = "width", height = "height", fill_color = "fill_color", legend = "legend",
-			  line_color = "black", line_width = line_width, source = mosaic_source)
+		mosaic_df = mosaic_df.head(raster_hover_clones)
+
+	if clone_details and "CloneID" in mosaic_df.columns:
+		#Tiles keep only the clone ID and geometry; colors are integer codes into a palette of the distinct colors
+		color_codes, palette = pandas.factorize(pandas.Series(mosaic_df[color_option_cols[raster_color_by]].values,
+															  dtype = object).map(str))
+		mosaic_df = mosaic_df[["CloneID", "Clone_Frequencies", "x", "y", "width", "height", "legend"]].copy()
+		mosaic_df["color_code"] = color_codes.astype(numpy.int16)
+		tile_fill_color = {"field": "color_code",
+						   "transform": LinearColorMapper(palette = list(palette) or ["#000000"], low = 0,
+														  high = max(len(palette), 1))}
+	else:
+		tile_fill_color = "fill_color"
+
+	mosaic_source = ColumnDataSource(mosaic_df, name = "clone_tiles" if clone_details else None)
+
+	tiles = plot.rect(x = "x", y = "y", width = "width", height = "height", fill_color = tile_fill_color,
+					  legend = "legend", line_color = "black", line_width = line_width, source = mosaic_source,
+					  fill_alpha = 0.0 if raster else 1.0, line_alpha = 0.0 if raster else 1.0)
+	if clone_details:
+		plot.add_tools(TapTool(renderers = [tiles]))
 
 	#By default, the plot legend and ColorBar should be turned off (since the color is repeating and uninformative)
 	plot.legend[0].visible = False
@@ -150,9 +209,17 @@ def Mosaic_Plot(clone_df, png = None, title = "", top_clones = 5000, count_col =
 	vshm_colorbar.visible = False
 	jshm_colorbar.visible = False
 
+	if raster or clone_details:
+		vshm_colorbar.visible = raster_color_by == "V Gene SHM"
+		jshm_colorbar.visible = raster_color_by == "J Gene SHM"
+
 	if png is not None:
 		export_png(plot, png)
 
+	#The colors are fixed in raster and clone details modes, so there is no color selection
+	if raster or clone_details:
+		return column(plot)
+
 	change_args = {
 		"source": mosaic_source,
 		"legend_obj": plot.legend[0],
@@ -0,0 +1,93 @@
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype, is_integer_dtype
+from concurrent.futures import ThreadPoolExecutor
+
+def _Rarefy_Draw(counts, sample_bounds, depth, seed_sequence):
+	"""Subsamples every sample's segment of the counts to depth with one multivariate hypergeometric draw each."""
+
+	rng = numpy.random.default_rng(seed_sequence)
+	rarefied = numpy.zeros_like(counts)
+	for start, stop in sample_bounds:
+		#The marginals method draws clone by clone from the counts, so it never expands the counts into reads
+		rarefied[start:stop] = rng.multivariate_hypergeometric(counts[start:stop], depth, method = "marginals")
+
+	return rarefied
+
+def Rarefy_Repertoires(clone_df, count_col = "Clustered", sample_col = "Sample", depth = None, n_draws = 1, seed = 0,
+					   n_jobs = 4, drop_zeros = True):
+	"""Subsamples the clone counts of every sample without replacement to a common sequencing depth.
+
+	Every sample is drawn with one vectorized multivariate hypergeometric draw over its clone counts; repeated draws
+	run on a thread pool, each with its own seed spawned from seed, so results do not depend on n_jobs.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoires with integer clone counts
+	count_col: str
+		Column name in clone_df of the clone counts; default is "Clustered"
+	sample_col: str
+		Column name in clone_df of the sample names; default is "Sample"
+	depth: int or None
+		Total count every sample is subsampled to, or None for the smallest sample total; samples with a smaller total
+		are left out of the result; default is None
+	n_draws: int
+		Number of independent draws; default is 1
+	seed: int
+		Seed of the draws; default is 0
+	n_jobs: int
+		Number of threads used for the draws; default is 4
+	drop_zeros: bool
+		Whether to leave out the clones with a subsampled count of 0; default is True
+
+	Returns
+	----------
+	rarefied_df: pandas DataFrame or list of DataFrames
+		Copy of clone_df (in the same row order) with the subsampled counts, or a list of one per draw if n_draws > 1
+	"""
+
+	counts = clone_df[count_col].values
+	if not is_integer_dtype(counts.dtype):
+		if not numpy.array_equal(counts, numpy.round(counts)):
+			raise ValueError("Rarefying requires integer clone counts in column \"{0}\"!".format(count_col))
+	counts = counts.astype(numpy.int64)
+
+	if is_categorical_dtype(clone_df[sample_col]):
+		sample_codes, samples = clone_df[sample_col].cat.codes.values, clone_df[sample_col].cat.categories
+	else:
+		sample_codes, samples = pandas.factorize(clone_df[sample_col], sort = True)
+
+	sample_totals = numpy.bincount(sample_codes[sample_codes >= 0], weights = counts[sample_codes >= 0],
+								   minlength = len(samples)).astype(numpy.int64)
+	if depth is None:
+		depth = int(sample_totals[sample_totals > 0].min())
+
+	#Samples are drawn from contiguous segments of the rows sorted by sample
+	kept_samples = sample_totals >= depth
+	kept_rows = (sample_codes >= 0) & kept_samples[numpy.maximum(sample_codes, 0)]
+	row_order = numpy.flatnonzero(kept_rows)
+	row_order = row_order[numpy.argsort(sample_codes[row_order], kind = "stable")]
+	sample_bounds = numpy.searchsorted(sample_codes[row_order], numpy.arange(len(samples) + 1))
+	sample_bounds = [(start, stop) for start, stop, kept in zip(sample_bounds[:-1], sample_bounds[1:], kept_samples)
+					 if kept and stop > start]
+
+	seed_sequences = numpy.random.SeedSequence(seed).spawn(n_draws)
+	sorted_counts = counts[row_order]
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		draws = list(executor.map(lambda seed_sequence: _Rarefy_Draw(sorted_counts, sample_bounds, depth, seed_sequence),
+								  seed_sequences))
+
+	rarefied_dfs = []
+	for draw in draws:
+		rarefied_counts = numpy.zeros(len(clone_df), dtype = numpy.int64)
+		rarefied_counts[row_order] = draw
+
+		draw_rows = kept_rows & (rarefied_counts > 0) if drop_zeros else kept_rows
+		rarefied_df = clone_df[draw_rows].copy()
+		rarefied_df[count_col] = rarefied_counts[draw_rows]
+		if is_categorical_dtype(rarefied_df[sample_col]):
+			rarefied_df[sample_col] = rarefied_df[sample_col].cat.remove_unused_categories()
+		rarefied_dfs.append(rarefied_df)
+
+	return rarefied_dfs[0] if n_draws == 1 else rarefied_dfs
@@ -0,0 +1,201 @@
+import numpy
+import pandas
+from concurrent.futures import ThreadPoolExecutor
+
+from bokeh.colors import RGB
+
+def Color_Array_To_RGBA(colors, alpha = 255):
+	"""Converts an iterable of hex color strings / bokeh RGB colors to packed RGBA uint32 values, once per color.
+
+	Parameters
+	----------
+	colors: iterable of str or bokeh RGB
+		Colors to convert (for example the fill color column of a Mosaic plot)
+	alpha: int
+		Alpha value (0-255) for all colors; default is 255
+
+	Returns
+	----------
+	rgba: numpy array of uint32
+		The packed RGBA colors, as used by Bokeh image_rgba
+	"""
+
+	codes, unique_colors = pandas.factorize(pandas.Series(list(colors), dtype = object))
+
+	unique_rgba = []
+	for color in unique_colors:
+		if isinstance(color, RGB):
+			color = color.to_hex()
+		color = color.lstrip("#")
+		red, green, blue = int(color[0:2], 16), int(color[2:4], 16), int(color[4:6], 16)
+		unique_rgba.append(red | (green << 8) | (blue << 16) | (alpha << 24))
+	#Missing colors are fully transparent
+	unique_rgba.append(0)
+
+	return numpy.array(unique_rgba, dtype = numpy.uint32).take(codes)
+
+def _Tiles(total, n_tiles):
+	"""Splits range(total) into n_tiles contiguous (start, stop) tiles."""
+
+	bounds = numpy.linspace(0, total, n_tiles + 1).astype(int)
+	return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+def Rasterize_Rects(x0, y0, x1, y1, colors, image_size, bounds = (0.0, 1.0, 0.0, 1.0), line_color = "#000000",
+					n_jobs = 4):
+	"""Draws non-overlapping rectangles (such as Mosaic tiles) into an RGBA image buffer.
+
+	Rectangle pixels are labelled with a 2D difference array and two cumulative sums, which are run over row and
+	column tiles in a thread pool; rectangles smaller than a pixel are drawn as a single pixel at their center.
+
+	Parameters
+	----------
+	x0, y0, x1, y1: numpy arrays of floats
+		Left, bottom, right and top edges of the rectangles in data coordinates
+	colors: numpy array of uint32
+		Packed RGBA color of each rectangle (see Color_Array_To_RGBA)
+	image_size: tuple of (int, int)
+		Width and height of the output image in pixels
+	bounds: tuple of (float, float, float, float)
+		The x start, x end, y start and y end of the data area covered by the image; default is (0.0, 1.0, 0.0, 1.0)
+	line_color: str or None
+		Hex color for the rectangle outlines, or None for no outlines; default is "#000000"
+	n_jobs: int
+		Number of threads used for the tiled cumulative sums; default is 4
+
+	Returns
+	----------
+	image: numpy array of uint32 with shape (height, width)
+		The RGBA image; row 0 is the bottom of the data area (as expected by Bokeh image_rgba)
+	"""
+
+	width, height = image_size
+	x_scale = width / float(bounds[1] - bounds[0])
+	y_scale = height / float(bounds[3] - bounds[2])
+
+	#Pixel edges of each rectangle; equal data edges always round to equal pixel edges
+	cols0 = numpy.clip(numpy.round((numpy.asarray(x0) - bounds[0]) * x_scale), 0, width).astype(numpy.int64)
+	cols1 = numpy.clip(numpy.round((numpy.asarray(x1) - bounds[0]) * x_scale), 0, width).astype(numpy.int64)
+	rows0 = numpy.clip(numpy.round((numpy.asarray(y0) - bounds[2]) * y_scale), 0, height).astype(numpy.int64)
+	rows1 = numpy.clip(numpy.round((numpy.asarray(y1) - bounds[2]) * y_scale), 0, height).astype(numpy.int64)
+
+	#Labels start at 1 so 0 marks pixels not covered by any rectangle
+	labels = numpy.arange(1, len(cols0) + 1, dtype = numpy.int64)
+	visible = (cols1 > cols0) & (rows1 > rows0)
+
+	label_diffs = numpy.zeros((height + 1, width + 1), dtype = numpy.int64)
+	coverage_diffs = numpy.zeros((height + 1, width + 1), dtype = numpy.int32)
+	for diffs, values in ((label_diffs, labels[visible]), (coverage_diffs, numpy.ones(visible.sum(), numpy.int32))):
+		numpy.add.at(diffs, (rows0[visible], cols0[visible]), values)
+		numpy.add.at(diffs, (rows0[visible], cols1[visible]), -values)
+		numpy.add.at(diffs, (rows1[visible], cols0[visible]), -values)
+		numpy.add.at(diffs, (rows1[visible], cols1[visible]), values)
+
+	def Cumsum_Row_Tile(tile):
+		for diffs in (label_diffs, coverage_diffs):
+			numpy.cumsum(diffs[tile[0]:tile[1]], axis = 1, out = diffs[tile[0]:tile[1]])
+
+	def Cumsum_Col_Tile(tile):
+		for diffs in (label_diffs, coverage_diffs):
+			numpy.cumsum(diffs[:, tile[0]:tile[1]], axis = 0, out = diffs[:, tile[0]:tile[1]])
+
+	#Rows are independent for the horizontal pass and columns for the vertical one, so tiles run concurrently
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		list(executor.map(Cumsum_Row_Tile, _Tiles(height + 1, n_jobs)))
+		list(executor.map(Cumsum_Col_Tile, _Tiles(width + 1, n_jobs)))
+
+	pixel_labels = label_diffs[:height, :width]
+	#Pixels covered by two rectangles (from edge rounding) can't be resolved from the label sums; outline them instead
+	pixel_labels[coverage_diffs[:height, :width] > 1] = -1
+
+	#Sub-pixel rectangles are drawn at their center pixel
+	hidden = ~visible
+	center_rows = numpy.clip((rows0[hidden] + rows1[hidden]) // 2, 0, height - 1)
+	center_cols = numpy.clip((cols0[hidden] + cols1[hidden]) // 2, 0, width - 1)
+	pixel_labels[center_rows, center_cols] = labels[hidden]
+
+	line_rgba = Color_Array_To_RGBA([line_color])[0] if line_color is not None else numpy.uint32(0)
+	#Label 0 (uncovered) is transparent and label -1 (the last entry) is the line color
+	label_colors = numpy.concatenate([[0], numpy.asarray(colors, dtype = numpy.uint32), [line_rgba]])
+	image = label_colors.take(pixel_labels)
+
+	if line_color is not None:
+		#Outline rectangles wherever neighboring pixels belong to different rectangles
+		outlines = numpy.zeros(pixel_labels.shape, dtype = bool)
+		outlines[1:, :] |= pixel_labels[1:, :] != pixel_labels[:-1, :]
+		outlines[:, 1:] |= pixel_labels[:, 1:] != pixel_labels[:, :-1]
+		image[outlines & (pixel_labels != 0)] = line_rgba
+
+	return image.astype(numpy.uint32)
+
+def Rasterize_Quadratic_Links(x0, y0, x1, y1, cx, cy, image_size, bounds = (0.0, 1.0, 0.0, 1.0),
+							  line_color = "#000000", samples_per_link = 256, chunk_size = 2000, n_jobs = 4):
+	"""Draws quadratic Bezier links (such as Cyrcos clone links) as a density-shaded RGBA image buffer.
+
+	Every link is sampled at samples_per_link points; the link chunks are binned into per-pixel counts in a thread pool
+	and the summed density is mapped to the line color's alpha.
+
+	Parameters
+	----------
+	x0, y0, x1, y1: numpy arrays of floats
+		Start and end points of the links in data coordinates
+	cx, cy: float or numpy arrays of floats
+		Control point(s) of the links
+	image_size: tuple of (int, int)
+		Width and height of the output image in pixels
+	bounds: tuple of (float, float, float, float)
+		The x start, x end, y start and y end of the data area covered by the image; default is (0.0, 1.0, 0.0, 1.0)
+	line_color: str
+		Hex color for the links; default is "#000000"
+	samples_per_link: int
+		Number of points sampled along each link; default is 256
+	chunk_size: int
+		Number of links binned at a time; default is 2000
+	n_jobs: int
+		Number of threads used for binning the link chunks; default is 4
+
+	Returns
+	----------
+	image: numpy array of uint32 with shape (height, width)
+		The RGBA image; row 0 is the bottom of the data area (as expected by Bokeh image_rgba)
+	"""
+
+	width, height = image_size
+	x_scale = width / float(bounds[1] - bounds[0])
+	y_scale = height / float(bounds[3] - bounds[2])
+
+	x0, y0, x1, y1 = [numpy.asarray(coords, dtype = float) for coords in (x0, y0, x1, y1)]
+	cx = numpy.broadcast_to(numpy.asarray(cx, dtype = float), x0.shape)
+	cy = numpy.broadcast_to(numpy.asarray(cy, dtype = float), y0.shape)
+
+	t = numpy.linspace(0.0, 1.0, samples_per_link)
+	start_weights = (1.0 - t) ** 2
+	control_weights = 2.0 * (1.0 - t) * t
+	end_weights = t ** 2
+
+	def Bin_Link_Chunk(chunk):
+		start, stop = chunk
+		xs = (numpy.outer(x0[start:stop], start_weights) + numpy.outer(cx[start:stop], control_weights) +
+			  numpy.outer(x1[start:stop], end_weights))
+		ys = (numpy.outer(y0[start:stop], start_weights) + numpy.outer(cy[start:stop], control_weights) +
+			  numpy.outer(y1[start:stop], end_weights))
+		cols = numpy.clip(((xs - bounds[0]) * x_scale).astype(numpy.int64), 0, width - 1)
+		rows = numpy.clip(((ys - bounds[2]) * y_scale).astype(numpy.int64), 0, height - 1)
+
+		#Count each pixel once per link, so slow (densely sampled) parts of a curve aren't darker
+		pixels = numpy.unique(rows * width + cols + numpy.arange(stop - start)[:, None] * (width * height))
+		return numpy.bincount(pixels % (width * height), minlength = width * height)
+
+	link_chunks = [(start, min(start + chunk_size, len(x0))) for start in range(0, len(x0), chunk_size)]
+	density = numpy.zeros(width * height, dtype = numpy.int64)
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		for chunk_density in executor.map(Bin_Link_Chunk, link_chunks):
+			density += chunk_density
+
+	#Log-scaled density keeps single links visible next to heavily shared regions
+	alpha = numpy.log1p(density) / numpy.log1p(max(density.max(), 1))
+	alpha = numpy.round(alpha * 255).astype(numpy.uint32)
+	line_rgb = Color_Array_To_RGBA([line_color], alpha = 0)[0]
+	image = (line_rgb | (alpha << 24)).reshape(height, width)
+	image[density.reshape(height, width) == 0] = 0
+
+	return image.astype(numpy.uint32)
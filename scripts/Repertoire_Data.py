@@ -0,0 +1,408 @@
+import os
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype, union_categoricals
+
+def Combine_Sample_DataFrames(clone_dfs, columns, sample_col = "Sample"):
+	"""Combines a dict of sample repertoire DataFrames into one DataFrame with a categorical sample column.
+
+	Each output column is built with a single concatenation of the input columns, so no intermediate subset copies are
+	made; the sample column is stored as categorical codes instead of a repeated sample name string per clone.
+
+	Parameters
+	----------
+	clone_dfs: dict of {str: DataFrame}
+		Input repertoires as a dict of sample name: DataFrame
+	columns: list of str
+		Columns of the sample DataFrames to include in the combined DataFrame
+	sample_col: str
+		Header / name for the added column containing the sample names; default is "Sample"
+
+	Returns
+	----------
+	comparison_df: pandas DataFrame
+		The combined repertoire DataFrame, ordered by sample in the order of the input dict
+	"""
+
+	samples = list(clone_dfs)
+	sample_lengths = [len(clone_dfs[sample]) for sample in samples]
+
+	comparison_df = pandas.DataFrame(index = pandas.RangeIndex(sum(sample_lengths)))
+
+	#Insert one column at a time so only a single combined column is held in addition to the inputs
+	for col in columns:
+		sample_cols = [clone_dfs[sample][col] for sample in samples]
+
+		if any([is_categorical_dtype(col_series) for col_series in sample_cols]):
+			combined_col = union_categoricals([pandas.Categorical(col_series) for col_series in sample_cols])
+		else:
+			combined_col = numpy.concatenate([col_series.values for col_series in sample_cols])
+
+		comparison_df[col] = combined_col
+
+	sample_codes = numpy.repeat(numpy.arange(len(samples), dtype = numpy.int32), sample_lengths)
+	comparison_df[sample_col] = pandas.Categorical.from_codes(sample_codes, categories = samples)
+
+	return comparison_df
+
+def Category_Codes(series):
+	"""Gets the integer codes and categories of a Series, factorizing it first if it is not categorical.
+
+	Parameters
+	----------
+	series: pandas Series
+		Categorical or object Series of genes / isotypes / etc.
+
+	Returns
+	----------
+	codes: numpy array of ints
+		The category code for each row of the Series (-1 for missing values)
+	categories: pandas Index
+		The unique categories of the Series
+	"""
+
+	if is_categorical_dtype(series):
+		return series.cat.codes.values, series.cat.categories
+	else:
+		codes, categories = pandas.factorize(series)
+		return codes, pandas.Index(categories)
+
+def Recode_Categories(series, mapping):
+	"""Maps the categories of a Series through a function, merging categories which map to the same value.
+
+	Parameters
+	----------
+	series: pandas Series
+		Categorical or object Series to recode
+	mapping: function
+		Function mapping a category to its new (str) category
+
+	Returns
+	----------
+	recoded_series: pandas Series
+		Categorical Series with sorted categories and the same index as the input Series
+	"""
+
+	codes, categories = Category_Codes(series)
+	new_names = numpy.array([mapping(category) for category in categories], dtype = object)
+	new_categories, category_recodes = numpy.unique(new_names, return_inverse = True)
+
+	#Keep missing values as missing (-1) after recoding
+	new_codes = numpy.append(category_recodes, -1).take(codes)
+	recoded = pandas.Categorical.from_codes(new_codes, categories = new_categories)
+
+	return pandas.Series(recoded, index = series.index, name = series.name)
+
+def Split_Columns(split_col):
+	"""Gets the list of split columns from a plot's split_col argument (None, one column name or a list of names)."""
+
+	if split_col is None:
+		return []
+	elif isinstance(split_col, (list, tuple)):
+		return list(split_col)
+
+	return [split_col]
+
+def Facet_Cells(clone_df, split_cols):
+	"""Groups the rows of a DataFrame by every observed combination of the split columns in one pass.
+
+	The category codes of the split columns are combined into one mixed radix code per row and factorized once, so any
+	number of split columns costs a single sort instead of a groupby per column and subset.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s)
+	split_cols: list of str
+		Columns to group the rows by (for example the isotype and the sample), or an empty list for one cell
+
+	Returns
+	----------
+	cell_codes: numpy array of ints
+		The cell of each row of clone_df (-1 for rows missing a split value)
+	cells: pandas DataFrame
+		One row per observed cell (indexed by cell code) with its categorical split column values, sorted by the split
+		columns in order (category order for categorical columns)
+	"""
+
+	combined_codes = numpy.zeros(len(clone_df), dtype = numpy.int64)
+	kept = numpy.ones(len(clone_df), dtype = bool)
+	split_levels = []
+	for col in split_cols:
+		if is_categorical_dtype(clone_df[col]):
+			col_codes, levels = clone_df[col].cat.codes.values.astype(numpy.int64), clone_df[col].cat.categories
+		else:
+			col_codes, levels = pandas.factorize(clone_df[col], sort = True)
+		kept &= col_codes >= 0
+		combined_codes = combined_codes * max(len(levels), 1) + col_codes
+		split_levels.append(levels)
+
+	cell_codes = numpy.full(len(clone_df), -1, dtype = numpy.int64)
+	cell_codes[kept], cell_keys = pandas.factorize(combined_codes[kept], sort = True)
+
+	cells = pandas.DataFrame(index = pandas.RangeIndex(len(cell_keys)))
+	for col, levels in reversed(list(zip(split_cols, split_levels))):
+		cell_keys, level_codes = numpy.divmod(cell_keys, max(len(levels), 1))
+		cell_values = pandas.Categorical.from_codes(level_codes, categories = levels)
+		cells.insert(0, col, cell_values.remove_unused_categories())
+
+	return cell_codes, cells
+
+def Cell_Rows(cell_codes, total_cells):
+	"""Gets the row positions of every cell of Facet_Cells from one stable sort, so rows keep their order in a cell."""
+
+	row_order = numpy.argsort(cell_codes, kind = "stable")
+	cell_bounds = numpy.searchsorted(cell_codes[row_order], numpy.arange(total_cells + 1))
+
+	return [row_order[start:stop] for start, stop in zip(cell_bounds[:-1], cell_bounds[1:])]
+
+def Facet_Panels(cells, facet_cols):
+	"""Groups the cells of Facet_Cells into small multiple panels by the facet columns.
+
+	Returns
+	----------
+	panels: list of (str, numpy array of ints)
+		The title (joined facet values, "" without facet columns) and the cell codes of every panel, in cell order
+	"""
+
+	if not facet_cols:
+		return [("", numpy.arange(len(cells)))]
+
+	panels = []
+	for panel, panel_cells in cells.groupby(facet_cols, sort = False, observed = True).indices.items():
+		panel = panel if isinstance(panel, tuple) else (panel,)
+		panels.append((" - ".join([str(value) for value in panel]), numpy.asarray(panel_cells)))
+
+	return panels
+
+def Top_Clone_Order(counts, top_clones = None):
+	"""Gets the positions of the largest counts in descending order, with ties kept in position order.
+
+	Only the top_clones largest counts are sorted; they are selected with a linear time partition, so getting the top
+	few thousand clones of a sample of millions does not sort the whole sample.
+
+	Parameters
+	----------
+	counts: numpy array
+		Clone counts / frequencies
+	top_clones: int or None
+		Number of largest counts to return, or None for all; default is None
+
+	Returns
+	----------
+	ranked_positions: numpy array of ints
+		Positions of the counts from the largest (rank 0) onward
+	"""
+
+	counts = numpy.asarray(counts)
+	total_counts = len(counts)
+
+	if top_clones is None or top_clones >= total_counts:
+		return numpy.argsort(-counts, kind = "stable")
+	if top_clones <= 0:
+		return numpy.empty(0, dtype = numpy.int64)
+
+	#Keep every count above the top_clones-th largest count and the first of the counts tied with it
+	boundary = numpy.partition(counts, total_counts - top_clones)[total_counts - top_clones]
+	above_boundary = numpy.flatnonzero(counts > boundary)
+	at_boundary = numpy.flatnonzero(counts == boundary)[:top_clones - len(above_boundary)]
+	selected = numpy.sort(numpy.concatenate([above_boundary, at_boundary]))
+
+	return selected[numpy.argsort(-counts[selected], kind = "stable")]
+
+class Ranked_Clone_Index(object):
+	def __init__(self, clone_df, count_col = "Clustered", sample_col = None):
+		"""Creates a per-sample index of the rows of a repertoire DataFrame ranked by clone count.
+
+		Each sample's ranking is computed on first use for the requested number of top clones, and later requests for
+		the same or fewer clones are slices of it.
+
+		Parameters
+		----------
+		clone_df: pandas DataFrame
+			DataFrame of the repertoire(s)
+		count_col: str
+			Column name in clone_df of the clone counts / frequencies; default is "Clustered"
+		sample_col: str or None
+			Column name in clone_df of the sample names, or None for a single repertoire; default is None
+		"""
+
+		self.counts = clone_df[count_col].values
+
+		if sample_col is None:
+			sample_codes, self.samples = numpy.zeros(len(clone_df), dtype = numpy.int64), [None]
+		elif is_categorical_dtype(clone_df[sample_col]):
+			sample_codes, self.samples = clone_df[sample_col].cat.codes.values, list(clone_df[sample_col].cat.categories)
+		else:
+			sample_codes, self.samples = pandas.factorize(clone_df[sample_col], sort = True)
+			self.samples = list(self.samples)
+
+		#Row positions of every sample, in DataFrame order
+		row_order = numpy.argsort(sample_codes, kind = "stable")
+		sample_bounds = numpy.searchsorted(sample_codes[row_order], numpy.arange(len(self.samples) + 1))
+		self.sample_rows = {sample: row_order[start:stop]
+							for sample, start, stop in zip(self.samples, sample_bounds[:-1], sample_bounds[1:])}
+		self._ranked_rows = {}
+
+	def Top_Rows(self, sample = None, top_clones = None):
+		"""Gets the DataFrame row positions of a sample's top_clones largest clones (or all clones), largest first."""
+
+		rows = self.sample_rows[sample]
+		ranked_rows = self._ranked_rows.get(sample)
+		required_rows = len(rows) if top_clones is None else min(top_clones, len(rows))
+
+		if ranked_rows is None or len(ranked_rows) < required_rows:
+			ranked_rows = rows[Top_Clone_Order(self.counts[rows], required_rows)]
+			self._ranked_rows[sample] = ranked_rows
+
+		return ranked_rows[:required_rows]
+
+def Sample_Set_Keys(total_samples, seed = 0):
+	"""Generates random odd 64-bit keys for samples, so a set of samples is identified by the (wrapping) key sum.
+
+	Parameters
+	----------
+	total_samples: int
+		Number of samples to generate keys for
+	seed: int
+		Seed of the random generator, so keys are the same in every process; default is 0
+
+	Returns
+	----------
+	sample_keys: numpy array of uint64
+		The key of each sample
+	"""
+
+	sample_keys = numpy.random.default_rng(seed).integers(0, 2 ** 63, size = total_samples, dtype = numpy.uint64)
+	return sample_keys * numpy.uint64(2) + numpy.uint64(1)
+
+def Strip_Allele(gene):
+	"""Removes the allele suffix from a gene name (for example "IGHV1-69*01" to "IGHV1-69")."""
+
+	return gene.split("*")[0]
+
+def Gene_Family(gene):
+	"""Gets the gene family from a gene name (for example "IGHV1-69*01" to "IGHV1")."""
+
+	return Strip_Allele(gene).split("-")[0]
+
+def Normalize_Gene_Columns(clone_df, gene_cols = ("VGene", "JGene"), isotype_col = "Isotype", strip_alleles = True):
+	"""Converts gene and isotype columns to categoricals and strips allele suffixes from the gene names.
+
+	All normalization is done once per category, so later plots can derive families and colors from the categories
+	instead of from every row.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoire(s) to normalize
+	gene_cols: iterable of str
+		Columns containing gene names; default is ("VGene", "JGene")
+	isotype_col: str or None
+		Column containing the isotypes, or None if there is none; default is "Isotype"
+	strip_alleles: bool
+		Whether to remove the allele suffix from gene names (for example "IGHV1-69*01" to "IGHV1-69"); default is True
+
+	Returns
+	----------
+	normalized_df: pandas DataFrame
+		Shallow copy of clone_df with the normalized categorical columns
+	"""
+
+	normalized_df = clone_df.copy(deep = False)
+	gene_cols = [col for col in gene_cols if col is not None and col in normalized_df.columns]
+
+	for col in gene_cols:
+		if strip_alleles:
+			normalized_df[col] = Recode_Categories(normalized_df[col], Strip_Allele)
+		elif not is_categorical_dtype(normalized_df[col]):
+			normalized_df[col] = normalized_df[col].astype("category")
+
+	if isotype_col is not None and isotype_col in normalized_df.columns:
+		if not is_categorical_dtype(normalized_df[isotype_col]):
+			normalized_df[isotype_col] = normalized_df[isotype_col].astype("category")
+
+	return normalized_df
+
+#File extensions of the compressions pandas.read_csv detects from the file name
+compression_extensions = (".gz", ".bz2", ".zip", ".xz", ".zst")
+
+def Repertoire_Sample_Name(filename):
+	"""Gets the default sample name of a repertoire file: its file name without the compression and file extensions
+	(for example "Sample1.tsv.gz" to "Sample1")."""
+
+	sample_name = os.path.basename(filename)
+	if sample_name.lower().endswith(compression_extensions):
+		sample_name = os.path.splitext(sample_name)[0]
+
+	return os.path.splitext(sample_name)[0]
+
+def _Read_Repertoire_File(filename, columns, dtypes, sep, engine):
+	"""Reads one repertoire file with the column subset and dtypes applied by the parser (runs in a worker)."""
+
+	read_params = {"sep": sep, "usecols": columns, "dtype": dtypes}
+	if engine != "c":
+		read_params["engine"] = engine
+
+	return pandas.read_csv(filename, **read_params)
+
+def Load_Repertoire_Files(filenames, sample_names = None, columns = None, dtypes = None, sep = "\t", engine = None,
+						  n_jobs = 4, use_processes = False, combine = False, sample_col = "Sample"):
+	"""Reads many per-sample repertoire (for example AIRR TSV) files concurrently.
+
+	The files are parsed on a thread pool (the C and pyarrow parsers release the GIL while parsing) or optionally a
+	process pool, and only the given columns are parsed, directly into the given dtypes.
+
+	Parameters
+	----------
+	filenames: list of str
+		Delimited repertoire files (optionally compressed), one per sample
+	sample_names: list of str or None
+		Sample name for each file, or None to use the file names without (compression) extensions; default is None
+	columns: list of str or None
+		Columns to read from each file, or None for all columns; default is None
+	dtypes: dict of {str: dtype} or None
+		Dtypes of the columns (for example "category" for genes and isotypes); default is None
+	sep: str
+		Delimiter of the repertoire files; default is "\\t"
+	engine: str or None
+		pandas.read_csv parser, or None to use "pyarrow" if pyarrow is installed and "c" otherwise; default is None
+	n_jobs: int
+		Number of files read at the same time; default is 4
+	use_processes: bool
+		Whether to read the files in worker processes instead of threads (the DataFrames are then copied back to the
+		main process); default is False
+	combine: bool
+		Whether to return one combined DataFrame with a categorical sample column instead of a dict; default is False
+	sample_col: str
+		Header / name for the sample column of the combined DataFrame; default is "Sample"
+
+	Returns
+	----------
+	clone_dfs: dict of {str: DataFrame} or pandas DataFrame
+		The repertoires as a dict of sample name: DataFrame in file order, or combined into one DataFrame, as
+		Repertoire_Dashboard accepts
+	"""
+
+	if sample_names is None:
+		sample_names = [Repertoire_Sample_Name(filename) for filename in filenames]
+	if len(set(sample_names)) != len(filenames):
+		raise ValueError("Every repertoire file must have a unique sample name!")
+
+	if engine is None:
+		engine = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+	executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+	with executor_class(max_workers = n_jobs) as executor:
+		read_jobs = [executor.submit(_Read_Repertoire_File, filename, columns, dtypes, sep, engine)
+					 for filename in filenames]
+		clone_dfs = {sample: read_job.result() for sample, read_job in zip(sample_names, read_jobs)}
+
+	if combine:
+		combine_cols = columns if columns is not None else list(next(iter(clone_dfs.values())).columns)
+		return Combine_Sample_DataFrames(clone_dfs, combine_cols, sample_col = sample_col)
+
+	return clone_dfs
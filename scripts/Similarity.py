@@ -0,0 +1,211 @@
+import numpy
+import pandas
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage, dendrogram
+from scipy.spatial.distance import squareform
+from concurrent.futures import ThreadPoolExecutor
+
+from bokeh.plotting import figure
+from bokeh.models import Range1d, HoverTool, ColumnDataSource, LinearColorMapper, ColorBar, FixedTicker
+from bokeh.palettes import viridis
+from bokeh.io.export import export_png
+from bokeh.layouts import gridplot
+
+from .Abundance_Matrix import Clone_Abundance_Matrix
+
+#Metrics on clone presence use the binary matrix; metrics on clone frequencies use the column-normalized matrix
+similarity_metrics = {
+	"jaccard": "Jaccard",
+	"sorensen": "Sørensen",
+	"morisita-horn": "Morisita-Horn",
+	"cosine": "Cosine"
+}
+
+def Pairwise_Similarity(abundance_matrix, metric = "morisita-horn", block_size = 256, n_jobs = 4):
+	"""Calculates an overlap / similarity index between every pair of samples as blocked sparse matrix products.
+
+	Every index is derived from one Gram matrix (samples x samples products of the presence or frequency columns),
+	which is calculated in blocks of samples over a thread pool (the sparse products run outside the Python GIL).
+
+	Parameters
+	----------
+	abundance_matrix: Clone_Abundance_Matrix
+		Clone x sample abundance matrix of the compared samples
+	metric: str
+		"jaccard" or "sorensen" for clone presence overlap, or "morisita-horn" or "cosine" for clone frequency
+		similarity; default is "morisita-horn"
+	block_size: int
+		Number of samples per block of the Gram matrix; default is 256
+	n_jobs: int
+		Number of threads used for the blocks; default is 4
+
+	Returns
+	----------
+	similarity_df: pandas DataFrame
+		Symmetric samples x samples DataFrame of the similarity index (1.0 for identical repertoires)
+	"""
+
+	metric = metric.lower()
+	if metric not in similarity_metrics:
+		raise ValueError("metric must be one of: {0}".format(", ".join(similarity_metrics)))
+
+	counts = abundance_matrix.csc.astype(float)
+	if metric in ("jaccard", "sorensen"):
+		columns = counts.astype(bool).astype(float)
+	else:
+		#Normalize each sample column to clone frequencies
+		sample_totals = numpy.asarray(counts.sum(axis = 0)).ravel()
+		columns = counts @ sparse.diags(1.0 / numpy.where(sample_totals > 0, sample_totals, 1.0))
+	columns = sparse.csc_matrix(columns)
+
+	total_samples = columns.shape[1]
+	gram = numpy.zeros((total_samples, total_samples))
+	blocks = [(start, min(start + block_size, total_samples)) for start in range(0, total_samples, block_size)]
+
+	def Gram_Block(block_pair):
+		(start1, stop1), (start2, stop2) = block_pair
+		gram[start1:stop1, start2:stop2] = (columns[:, start1:stop1].T @ columns[:, start2:stop2]).toarray()
+
+	#Only the upper triangle of blocks is calculated; the lower triangle is mirrored afterwards
+	block_pairs = [(blocks[idx1], blocks[idx2]) for idx1 in range(len(blocks)) for idx2 in range(idx1, len(blocks))]
+	with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+		list(executor.map(Gram_Block, block_pairs))
+	gram = numpy.triu(gram) + numpy.triu(gram, 1).T
+
+	diagonal = numpy.diag(gram)
+	with numpy.errstate(divide = "ignore", invalid = "ignore"):
+		if metric == "jaccard":
+			similarity = gram / (diagonal[:, None] + diagonal[None, :] - gram)
+		elif metric in ("sorensen", "morisita-horn"):
+			#With frequencies the diagonal holds the Simpson sums, giving 2 * sum(p * q) / (sum(p^2) + sum(q^2))
+			similarity = 2.0 * gram / (diagonal[:, None] + diagonal[None, :])
+		else:
+			norms = numpy.sqrt(diagonal)
+			similarity = gram / (norms[:, None] * norms[None, :])
+
+	similarity = numpy.nan_to_num(similarity)
+
+	return pandas.DataFrame(similarity, index = abundance_matrix.samples, columns = abundance_matrix.samples)
+
+def Similarity_Heatmap_Plot(clone_df, png = None, title = "", metric = "morisita-horn", clone_col = "CloneID",
+							count_col = "Clustered", split_col = "Sample", cluster = True, abundance_matrix = None,
+							similarity_df = None, figsize = (700, 700), n_jobs = 4):
+	"""Creates a heatmap of the pairwise similarity of all samples, ordered by hierarchical clustering.
+
+	Parameters
+	----------
+	clone_df: pandas DataFrame
+		DataFrame of the repertoires to compare (can be None if abundance_matrix or similarity_df is given)
+	png: str
+		Title of the output PNG filename or None if none should be made; default is None
+	title: str
+		Title of the output graph; default is ""
+	metric: str
+		Similarity index (see Pairwise_Similarity); default is "morisita-horn"
+	clone_col: str
+		Column name in clone_df of the clone IDs; default is "CloneID"
+	count_col: str
+		Column name in clone_df of the clone counts/frequencies; default is "Clustered"
+	split_col: str
+		Column name in clone_df of the sample names; default is "Sample"
+	cluster: bool
+		Whether to order the samples by average linkage clustering and draw the dendrogram; default is True
+	abundance_matrix: Clone_Abundance_Matrix or None
+		Prebuilt clone x sample abundance matrix to use instead of clone_df; default is None
+	similarity_df: pandas DataFrame or None
+		Precalculated samples x samples similarity (from Pairwise_Similarity) to plot; default is None
+	figsize: tuple of (int, int)
+		The width and height of the output plot (including the dendrogram); default is (700, 700)
+	n_jobs: int
+		Number of threads used for calculating the similarity; default is 4
+
+	Returns
+	----------
+	plot: bokeh GridBox
+		The (dendrogram and) heatmap layout, with the plot frames aligned
+	"""
+
+	if similarity_df is None:
+		if abundance_matrix is None:
+			abundance_matrix = Clone_Abundance_Matrix.From_DataFrame(clone_df, clone_col = clone_col,
+																	 sample_col = split_col, count_col = count_col)
+		similarity_df = Pairwise_Similarity(abundance_matrix, metric = metric, n_jobs = n_jobs)
+
+	samples = [str(sample) for sample in similarity_df.index]
+	sample_order = list(range(len(samples)))
+	dendrogram_height = int(figsize[1] * 0.2) if cluster and len(samples) > 2 else 0
+
+	if dendrogram_height:
+		#Average linkage on the dissimilarity (1 - similarity) orders similar samples next to each other
+		distances = squareform(1.0 - similarity_df.values, checks = False).clip(min = 0.0)
+		sample_tree = dendrogram(linkage(distances, method = "average"), no_plot = True)
+		sample_order = sample_tree["leaves"]
+
+	ordered_samples = [samples[idx] for idx in sample_order]
+	ordered_similarity = similarity_df.values[numpy.ix_(sample_order, sample_order)]
+
+	heatmap_params = {
+		"plot_width": figsize[0],
+		"plot_height": figsize[1] - dendrogram_height,
+		"x_range": ordered_samples,
+		"y_range": list(reversed(ordered_samples)),
+		"title": title if not dendrogram_height else None,
+		"tools": "save, reset, help",
+		"toolbar_location": "right",
+		"x_axis_location": "below"
+	}
+	plot = figure(**heatmap_params)
+	plot.grid.visible = False
+	plot.axis.major_tick_line_color = None
+	plot.axis.major_label_text_font_size = "8pt"
+	plot.xaxis.major_label_orientation = numpy.pi / 3
+
+	total_samples = len(ordered_samples)
+	heatmap_data = {
+		"x": [sample for _ in range(total_samples) for sample in ordered_samples],
+		"y": [sample for sample in ordered_samples for _ in range(total_samples)],
+		"similarity": ordered_similarity.ravel()
+	}
+	color_mapper = LinearColorMapper(palette = viridis(256), low = 0.0, high = 1.0)
+	plot.rect(x = "x", y = "y", width = 1, height = 1, line_color = None, source = ColumnDataSource(heatmap_data),
+			  fill_color = {"field": "similarity", "transform": color_mapper})
+
+	metric_name = similarity_metrics.get(metric.lower(), metric)
+	plot.add_tools(HoverTool(tooltips = [("Samples", "@x / @y"), (metric_name, "@similarity{0.000}")]))
+	color_bar = ColorBar(color_mapper = color_mapper, label_standoff = 8, location = (0, 0),
+						 ticker = FixedTicker(ticks = [0.0, 0.25, 0.5, 0.75, 1.0]), title = metric_name)
+	plot.add_layout(color_bar, "right")
+
+	plots = [plot]
+	if dendrogram_height:
+		plots.insert(0, Dendrogram_Plot(sample_tree, total_samples, title, (figsize[0], dendrogram_height)))
+
+	similarity_plot = gridplot(plots, ncols = 1, toolbar_location = "right")
+
+	if png is not None:
+		export_png(similarity_plot, png)
+
+	return similarity_plot
+
+def Dendrogram_Plot(sample_tree, total_samples, title, figsize):
+	"""Draws a scipy dendrogram (from dendrogram(..., no_plot = True)) above a categorical heatmap of its leaves."""
+
+	#Scipy places the dendrogram leaves at 5, 15, 25, ...; rescale them to the heatmap's categorical centers
+	tree_xs = [[x / 10.0 for x in xs] for xs in sample_tree["icoord"]]
+	tree_ys = sample_tree["dcoord"]
+	dendrogram_params = {
+		"plot_width": figsize[0],
+		"plot_height": figsize[1],
+		"x_range": Range1d(0, total_samples),
+		"y_range": Range1d(0, max([max(ys) for ys in tree_ys] + [1e-6]) * 1.05),
+		"title": title,
+		"tools": "",
+		"toolbar_location": None
+	}
+	dendrogram_plot = figure(**dendrogram_params)
+	dendrogram_plot.grid.visible = False
+	dendrogram_plot.axis.visible = False
+	dendrogram_plot.outline_line_alpha = 0.0
+	dendrogram_plot.multi_line(xs = tree_xs, ys = tree_ys, line_color = "#505050", line_width = 1.5)
+
+	return dendrogram_plot
@@ -1,43 +1,56 @@
 import json
-import pandas
 
 from bokeh.plotting import figure
-from bokeh.models import Range1d, ColumnDataSource
+from bokeh.models import Range1d, ColumnDataSource, TapTool
 from bokeh.io import save, show
 from bokeh.embed import components
 from bokeh.layouts import gridplot, Spacer
 
+from .Abundance_Matrix import Clone_Abundance_Matrix
+from .Gene_Colors import Sample_Colors
+
 class Repertoire_Upset_Plot(object):
 	def __init__(self, clone_dfs, title = "", min_shared = 2, max_shared = None, overlap_bounds = None,
-				 clone_col = "CloneID", sample_col = None, highlighted_sets = None, figsize = (1200, 900)):
-		"""Creates a Repertoire comparison UpSet overlap plot."""
+				 clone_col = "CloneID", sample_col = None, highlighted_sets = None, figsize = (1200, 900),
+				 overlap_counts = None, sample_clone_counts = None, abundance_matrix = None, clone_details = False):
+		"""Creates a Repertoire comparison UpSet overlap plot.
+
+		The clone membership can also be given as a prebuilt Clone_Abundance_Matrix (abundance_matrix), or the shared
+		clone counts precomputed (for example from Cohort_Aggregate_Files) as overlap_counts and sample_clone_counts; in
+		both cases clone_dfs can be None. With clone_details, the set bars can be tapped to show the records of their
+		clones from a Bokeh server (see Clone_Detail_Panel).
+		"""
 
-		df_cols = [clone_col]
+		if overlap_counts is not None:
+			if sample_clone_counts is None:
+				raise ValueError("sample_clone_counts must be given along with precomputed overlap_counts!")
 
-		if isinstance(clone_dfs, dict):
-			df_dict = {sample: clone_dfs[sample][df_cols] for sample in clone_dfs}
+			#Precomputed counts are indexed by the JSON list of sample names of each set, as created below
+			set_sizes = overlap_counts.index.map(lambda sample_set: len(json.loads(sample_set))).values
+			if min_shared is not None:
+				overlap_counts = overlap_counts[set_sizes >= min_shared]
+				set_sizes = set_sizes[set_sizes >= min_shared]
+			if max_shared is not None:
+				overlap_counts = overlap_counts[set_sizes <= max_shared]
+			overlap_counts = overlap_counts.sort_values(ascending = False)
 
-			comparison_df = pandas.concat(list(df_dict.values()), ignore_index = True)
-			samples = [i for i in df_dict]
+			#Get the total clones per sample for the total clone counts bar graph
+			clone_counts = sample_clone_counts.sort_values(ascending = False)
+			samples = clone_counts.index.tolist()
 
 		else:
-			df_cols.append(sample_col)
-
-			comparison_df = clone_dfs[df_cols]
-			samples = clone_dfs[sample_col].drop_duplicates().tolist()
+			#Clone membership of all samples is counted from the sparse clone x sample matrix
+			if abundance_matrix is None:
+				abundance_matrix = Clone_Abundance_Matrix.From_DataFrame(clone_dfs, clone_col = clone_col,
+																		 sample_col = sample_col, count_col = None)
 
-		#Collapse by clone IDs and concatenate the multiple repertoire sample names containing each clone using JSON
-		serializer = lambda x: json.dumps(x.tolist())
-		grouped_df = comparison_df.groupby([clone_col])[sample_col].agg({serializer, "count"})
-		grouped_df = grouped_df.rename(columns = {"<lambda>": "Samples", "count": "Sample_Count"})
+			#Calculate the total number of clones shared by each combination of samples
+			overlap_counts = abundance_matrix.Overlap_Counts(min_shared = min_shared, max_shared = max_shared)
 
-		if min_shared is not None:
-			grouped_df = grouped_df[grouped_df["Sample_Count"] >= min_shared]
-		if max_shared is not None:
-			grouped_df = grouped_df[grouped_df["Sample_Count"] <= max_shared]
+			#Get the total clones per sample for the total clone counts bar graph
+			clone_counts = abundance_matrix.Sample_Clone_Counts().sort_values(ascending = False, kind = "mergesort")
+			samples = abundance_matrix.samples
 
-		#Calculate the total number of clones shared by each combination of samples
-		overlap_counts = grouped_df["Samples"].value_counts()
 		if overlap_bounds is not None:
 			overlap_counts = overlap_counts[overlap_counts >= overlap_bounds[0]]
 			overlap_counts = overlap_counts[overlap_counts <= overlap_bounds[1]]
@@ -45,7 +58,8 @@ class Repertoire_Upset_Plot(object):
 		total_sets = len(overlap_counts)
 		total_samples = len(samples)
 		MAIN_BAR_WIDTH = 0.5
-		set_colors = ("#82C882", "#BEB4D2", "#FABE82", "#FFFF96", "#326EB4", "#F00082", "#BE5A14", "#646464")
+		set_colors = Sample_Colors(len(highlighted_sets) if highlighted_sets is not None else 0,
+								   ("#82C882", "#BEB4D2", "#FABE82", "#FFFF96", "#326EB4", "#F00082", "#BE5A14", "#646464"))
 
 		main_plot_params = {
 			"plot_width": int(figsize[0] * 0.6),
@@ -85,11 +99,14 @@ class Repertoire_Upset_Plot(object):
 		main_bars_data = {
 			"x": sample_sets_xs,
 			"top": overlap_counts.tolist(),
-			"color": sample_sets_colors
+			"color": sample_sets_colors,
+			"set": overlap_counts.index.tolist()
 		}
-		main_bars_source = ColumnDataSource(main_bars_data)
+		main_bars_source = ColumnDataSource(main_bars_data, name = "clone_sets" if clone_details else None)
 		self.main_bars = self.main_plot.vbar(x = "x", top = "top", width = MAIN_BAR_WIDTH, bottom = 0,
 											 color = "color", source = main_bars_source)
+		if clone_details:
+			self.main_plot.add_tools(TapTool(renderers = [self.main_bars]))
 		self.main_plot.yaxis.axis_label = "Total Shared Clones"
 
 		sample_sets_plot_params = {
@@ -120,20 +137,18 @@ class Repertoire_Upset_Plot(object):
 
 		sample_set_circle_radius = MAIN_BAR_WIDTH * 0.3
 
+		#All matrix circles (the grey background grid first, then the sample set circles) share one source/renderer
+		total_grid_circles = total_sets * total_samples
 		sample_sets_data = {
 			"x": sample_sets_xs * total_samples,
-			"y": [i for i in range(total_samples) for _ in range(total_sets)]
+			"y": [i for i in range(total_samples) for _ in range(total_sets)],
+			"color": ["#787878"] * total_grid_circles,
+			"alpha": [0.5] * total_grid_circles
 		}
-		sample_sets_source = ColumnDataSource(sample_sets_data)
-		self.sample_sets_plot.circle(x = "x", y = "y", radius = sample_set_circle_radius, fill_color = "#787878",
-									 line_color = None, alpha = 0.5, source = sample_sets_source)
-
-		#Get the total clones per sample for the total clone counts bar graph
-		clone_counts = comparison_df[sample_col].value_counts()
+		set_links_data = {"xs": [], "ys": [], "color": []}
 
 		#Create the linked circles that mark the compared samples
-		ypos_to_sample = clone_counts.reset_index()["index"].to_dict()
-		sample_to_ypos = {ypos_to_sample[key]: key for key in ypos_to_sample}
+		sample_to_ypos = {sample: ypos for ypos, sample in enumerate(clone_counts.index)}
 		cur_set_color = "black"
 		cur_color_idx = 0
 		for x_pos, cur_set in enumerate(overlap_counts.index):
@@ -150,14 +165,25 @@ class Repertoire_Upset_Plot(object):
 					else:
 						cur_set_color = "black"
 
-			#Draw the bars linking the sample set circles
+			#Add the bars linking the sample set circles
 			min_circle_y = min(set_ys)
 			max_circle_y = max(set_ys)
-			self.sample_sets_plot.line(x = [x_pos, x_pos], y = [min_circle_y, max_circle_y],
-									   line_width = 5, line_color = cur_set_color)
-			#Draw the sample set circles
-			self.sample_sets_plot.circle(x = [x_pos] * cur_set_count, y = set_ys, radius = sample_set_circle_radius,
-										 fill_color = cur_set_color, line_color = None)
+			set_links_data["xs"].append([x_pos, x_pos])
+			set_links_data["ys"].append([min_circle_y, max_circle_y])
+			set_links_data["color"].append(cur_set_color)
+			#Add the sample set circles
+			sample_sets_data["x"] += [x_pos] * cur_set_count
+			sample_sets_data["y"] += set_ys
+			sample_sets_data["color"] += [cur_set_color] * cur_set_count
+			sample_sets_data["alpha"] += [1.0] * cur_set_count
+
+		#Draw all set links with one renderer, then all matrix circles with another
+		set_links_source = ColumnDataSource(set_links_data)
+		self.sample_sets_plot.multi_line(xs = "xs", ys = "ys", line_width = 5, line_color = "color",
+										 source = set_links_source)
+		sample_sets_source = ColumnDataSource(sample_sets_data)
+		self.sample_sets_plot.circle(x = "x", y = "y", radius = sample_set_circle_radius, fill_color = "color",
+									 fill_alpha = "alpha", line_color = None, source = sample_sets_source)
 
 		largest_repertoire_clones = clone_counts.max()
 		clone_bar_plot_params = {
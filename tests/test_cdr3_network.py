@@ -0,0 +1,58 @@
+import itertools
+import unittest
+
+import numpy
+
+from scripts.CDR3_Network import CDR3_Neighbor_Pairs
+
+def Edit_Distance(seq1, seq2):
+	"""Levenshtein distance by the full dynamic programming table."""
+
+	previous = list(range(len(seq2) + 1))
+	for idx1 in range(1, len(seq1) + 1):
+		current = [idx1]
+		for idx2 in range(1, len(seq2) + 1):
+			current.append(min(previous[idx2 - 1] + (seq1[idx1 - 1] != seq2[idx2 - 1]), previous[idx2] + 1,
+							   current[idx2 - 1] + 1))
+		previous = current
+
+	return previous[-1]
+
+def Hamming_Distance(seq1, seq2):
+	return sum(aa1 != aa2 for aa1, aa2 in zip(seq1, seq2)) if len(seq1) == len(seq2) else len(seq1) + len(seq2)
+
+def Brute_Force_Pairs(sequences, max_distance, distance):
+	"""Compares all pairs of (non-missing, non-empty) sequences."""
+
+	return [(idx1, idx2) for idx1, idx2 in itertools.combinations(range(len(sequences)), 2)
+			if isinstance(sequences[idx1], str) and isinstance(sequences[idx2], str) and sequences[idx1]
+			and sequences[idx2] and distance(sequences[idx1], sequences[idx2]) <= max_distance]
+
+class CDR3_Neighbor_Pairs_Test(unittest.TestCase):
+	def setUp(self):
+		#A small alphabet and short lengths give many neighbors, including sequences no longer than the distance
+		rng = numpy.random.default_rng(0)
+		self.sequences = ["".join(rng.choice(list("ACD"), size = rng.integers(0, 7))) for _ in range(150)]
+		for missing_idx in rng.choice(len(self.sequences), size = 15, replace = False):
+			self.sequences[missing_idx] = None if missing_idx % 2 else numpy.nan
+
+	def Check_Metric(self, metric, distance):
+		for max_distance in (1, 2):
+			pairs = CDR3_Neighbor_Pairs(self.sequences, max_distance = max_distance, metric = metric, n_jobs = 2,
+										chunk_size = 40)
+			expected_pairs = Brute_Force_Pairs(self.sequences, max_distance, distance)
+			self.assertEqual([tuple(pair) for pair in pairs.tolist()], expected_pairs, (metric, max_distance))
+
+	def test_hamming_pairs_match_all_pairs(self):
+		self.Check_Metric("hamming", Hamming_Distance)
+
+	def test_levenshtein_pairs_match_all_pairs(self):
+		self.Check_Metric("levenshtein", Edit_Distance)
+
+	def test_missing_sequences_have_no_neighbors(self):
+		for metric in ("hamming", "levenshtein"):
+			pairs = CDR3_Neighbor_Pairs([None, numpy.nan, "", None, "C"], max_distance = 1, metric = metric, n_jobs = 1)
+			self.assertEqual(len(pairs), 0, metric)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,92 @@
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+import numpy
+import pandas
+
+from scripts.Dashboard_Service import Dashboard_Service
+from scripts.Gene_Colors import vgene_colors, jgene_colors
+
+def Random_Repertoire_Table(total_samples = 3, total_clones = 300, seed = 0):
+	"""Creates a CSV table of random clones for several samples, with every column the dashboard uses."""
+
+	rng = numpy.random.default_rng(seed)
+	amino_acids = list("ACDEFGHIKLMNPQRSTVWY")
+	total_rows = total_samples * total_clones
+	clone_df = pandas.DataFrame({
+		"Sample": numpy.repeat(["S{0}".format(sample_idx) for sample_idx in range(total_samples)], total_clones),
+		"CloneID": rng.integers(0, total_clones * 2, size = total_rows),
+		"VGene": rng.choice(list(vgene_colors), size = total_rows),
+		"JGene": rng.choice([jgene for jgene in jgene_colors if jgene != "IGHJ2P"], size = total_rows),
+		"Isotype": rng.choice(["IgG1", "IgA1", "IgM"], size = total_rows),
+		"Clustered": rng.zipf(2.0, size = total_rows).clip(1, 10000),
+		"V_SHM": rng.uniform(0, 0.2, size = total_rows),
+		"J_SHM": rng.uniform(0, 0.1, size = total_rows),
+		"CDR3_AA": ["".join(rng.choice(amino_acids, size = rng.integers(8, 20))) for _ in range(total_rows)]
+	})
+	clone_df = clone_df.drop_duplicates(["Sample", "CloneID"])
+
+	return clone_df.to_csv(index = False).encode("utf-8")
+
+class Dashboard_Service_Server_Test(unittest.TestCase):
+	def setUp(self):
+		self.service = Dashboard_Service(n_workers = 2)
+		self.server = self.service.Serve_In_Thread(port = 0)
+		self.url = "http://localhost:{0}".format(self.server.server_port)
+
+	def tearDown(self):
+		self.service.Stop()
+
+	def Post(self, body, content_type = "text/csv"):
+		request = urllib.request.Request(self.url + "/dashboard", data = body, headers = {"Content-Type": content_type})
+		try:
+			with urllib.request.urlopen(request, timeout = 300) as response:
+				return response.status, response.headers["X-Dashboard-Cache"], response.read()
+		except urllib.error.HTTPError as error:
+			return error.code, None, error.read()
+
+	def test_identical_requests_are_coalesced_then_cached(self):
+		table = Random_Repertoire_Table()
+		total_requests = 4
+		responses = []
+		start_barrier = threading.Barrier(total_requests)
+
+		def Send_Request():
+			start_barrier.wait()
+			responses.append(self.Post(table))
+
+		request_threads = [threading.Thread(target = Send_Request) for _ in range(total_requests)]
+		for request_thread in request_threads:
+			request_thread.start()
+		for request_thread in request_threads:
+			request_thread.join()
+
+		#One request builds the dashboard; the others wait for that build (or read its cached result)
+		self.assertEqual([response[0] for response in responses], [200] * total_requests)
+		cache_statuses = sorted(response[1] for response in responses)
+		self.assertEqual(cache_statuses.count("miss"), 1)
+		self.assertTrue(set(cache_statuses) <= {"miss", "coalesced", "hit"})
+		self.assertEqual(len(set(response[2] for response in responses)), 1)
+
+		status, cache_status, page = self.Post(table)
+		self.assertEqual((status, cache_status, page), (200, "hit", responses[0][2]))
+
+		service_status = json.loads(urllib.request.urlopen(self.url + "/status", timeout = 10).read())
+		self.assertEqual(service_status["misses"], 1)
+		self.assertEqual(service_status["hits"] + service_status["coalesced"], total_requests)
+		self.assertEqual(service_status["pending"], 0)
+
+	def test_failed_builds_are_reported_and_not_cached(self):
+		#A build which fails right away can finish before its done callback is added, which must not deadlock
+		for _ in range(3):
+			status, cache_status, _ = self.Post(b"a,b\n1,2\n")
+			self.assertEqual(status, 500)
+
+		service_status = self.service.Status()
+		self.assertEqual((service_status["errors"], service_status["cached"], service_status["pending"]), (3, 0, 0))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,121 @@
+import json
+import unittest
+
+import numpy
+import pandas
+
+from bokeh.embed import json_item
+
+from scripts.Diversity import Diversity_Plot, Clone_Size_Frequencies, Chao1_Richness, ACE_Richness, Sample_Coverage
+from scripts.Diversity import Shannon_Entropy_Estimate, Hill_Curve, Asymptotic_Hill_Numbers, Bootstrap_Statistic
+
+def Control_Lines_Data(plot):
+	"""Gets the data of the control diversity lines of a Diversity_Plot figure."""
+
+	for renderer in plot.renderers:
+		if "control" in renderer.data_source.data:
+			return renderer.data_source.data
+
+class Diversity_Plot_Test(unittest.TestCase):
+	def test_control_lines_of_small_repertoires_are_finite(self):
+		rng = numpy.random.default_rng(0)
+		for total_clones in (1, 5, 19, 20, 21):
+			clone_df = pandas.DataFrame({"Clustered": rng.integers(1, 20, size = total_clones)})
+			plot = Diversity_Plot(clone_df)
+
+			control_data = Control_Lines_Data(plot)
+			self.assertEqual(len(control_data["ys"]), 4)
+			for diversities in control_data["ys"]:
+				self.assertTrue(numpy.isfinite(diversities).all(), total_clones)
+			#Controls of at most 20 clones are evenly distributed, so every order has the same diversity
+			if total_clones <= 20:
+				numpy.testing.assert_allclose(control_data["ys"][0], total_clones)
+
+			#The page JSON of the plot must not contain non-finite values
+			json.loads(json.dumps(json_item(plot), allow_nan = False))
+
+class Richness_Estimator_Test(unittest.TestCase):
+	def setUp(self):
+		#13 clones: 6 singletons, 3 doubletons, 2 of size 3, 1 of size 5 and 1 of size 12 (35 counts)
+		self.clone_sizes = numpy.array([1, 2, 3, 5, 12])
+		self.size_clones = numpy.array([6, 3, 2, 1, 1])
+		self.clone_counts = numpy.repeat(self.clone_sizes, self.size_clones)
+
+	def test_chao1_and_ace_of_a_hand_computed_histogram(self):
+		#Chao1 = S_obs + (n - 1) / n * f1^2 / (2 f2) = 13 + 34 / 35 * 36 / 6
+		self.assertAlmostEqual(Chao1_Richness(self.clone_sizes, self.size_clones)[0], 13.0 + 34.0 / 35.0 * 6.0)
+
+		#ACE: 12 rare clones with 23 counts, coverage 1 - 6 / 23 and sum i (i - 1) f_i = 38
+		rare_coverage = 17.0 / 23.0
+		cv_squared = 12.0 / rare_coverage * 38.0 / (23.0 * 22.0) - 1.0
+		expected_ace = 1.0 + 12.0 / rare_coverage + 6.0 / rare_coverage * cv_squared
+		self.assertAlmostEqual(ACE_Richness(self.clone_sizes, self.size_clones), expected_ace)
+		self.assertAlmostEqual(expected_ace, 60449.0 / 3179.0)
+
+		lower, upper = Chao1_Richness(self.clone_sizes, self.size_clones)[1:]
+		self.assertTrue(13.0 < lower < Chao1_Richness(self.clone_sizes, self.size_clones)[0] < upper)
+
+	def test_hill_curve_at_the_sample_size_is_the_observed_hill_number(self):
+		sample_size = self.clone_counts.sum()
+		frequencies = self.clone_counts / sample_size
+		observed_hill_numbers = [len(self.clone_counts), numpy.exp(-(frequencies * numpy.log(frequencies)).sum()),
+								 1.0 / (frequencies ** 2).sum()]
+
+		for order, observed_hill_number in enumerate(observed_hill_numbers):
+			hill_number = Hill_Curve(self.clone_sizes, self.size_clones, [sample_size], order)[0]
+			self.assertAlmostEqual(hill_number, observed_hill_number, places = 6, msg = order)
+
+		#Extrapolated richness approaches the Chao1 estimate
+		self.assertAlmostEqual(Hill_Curve(self.clone_sizes, self.size_clones, [10 ** 6], 0)[0],
+							   Chao1_Richness(self.clone_sizes, self.size_clones)[0])
+
+	def test_edge_cases_are_finite(self):
+		histograms = {
+			"no doubletons": [1, 3, 7],
+			"all singletons": [1] * 10,
+			"one singleton": [1, 4, 4],
+			"one clone": [1],
+			"no singletons": [2, 3, 3]
+		}
+
+		for case, clone_counts in histograms.items():
+			clone_sizes, size_clones = Clone_Size_Frequencies(numpy.array(clone_counts))
+			sample_size = sum(clone_counts)
+			estimates = [*Chao1_Richness(clone_sizes, size_clones), ACE_Richness(clone_sizes, size_clones),
+						 Sample_Coverage(clone_sizes, size_clones), Shannon_Entropy_Estimate(clone_sizes, size_clones)]
+			for order in (0, 1, 2):
+				estimates += Hill_Curve(clone_sizes, size_clones, [1, sample_size, 10 * sample_size], order).tolist()
+			self.assertTrue(numpy.isfinite(estimates).all(), case)
+			self.assertTrue(0.0 <= Sample_Coverage(clone_sizes, size_clones) <= 1.0, case)
+
+			#Only the order 2 estimate is unbounded, when no clone was seen twice
+			asymptotic_estimates = Asymptotic_Hill_Numbers(clone_sizes, size_clones)
+			self.assertTrue(numpy.isfinite(asymptotic_estimates[:2]).all(), case)
+			self.assertEqual(numpy.isinf(asymptotic_estimates[2]), max(clone_counts) == 1, case)
+
+		#All singletons without doubletons: (n - 1) / n * f1 (f1 - 1) / 2 unseen clones
+		clone_sizes, size_clones = Clone_Size_Frequencies(numpy.ones(10, dtype = int))
+		self.assertAlmostEqual(Chao1_Richness(clone_sizes, size_clones)[0], 10.0 + 0.9 * 45.0)
+		self.assertAlmostEqual(ACE_Richness(clone_sizes, size_clones), 10.0 + 0.9 * 45.0)
+
+	def test_bootstrap_is_reproducible_with_a_fixed_seed(self):
+		statistic = lambda clone_sizes, size_clones: Asymptotic_Hill_Numbers(clone_sizes, size_clones)[:2]
+
+		bootstrap_statistics = Bootstrap_Statistic(self.clone_sizes, self.size_clones, statistic, n_bootstraps = 20,
+												   seed = 7, n_jobs = 4)
+		self.assertEqual(bootstrap_statistics.shape, (20, 2))
+		numpy.testing.assert_array_equal(bootstrap_statistics, Bootstrap_Statistic(self.clone_sizes, self.size_clones,
+																				   statistic, n_bootstraps = 20,
+																				   seed = 7, n_jobs = 1))
+		self.assertFalse(numpy.array_equal(bootstrap_statistics, Bootstrap_Statistic(self.clone_sizes,
+																					 self.size_clones, statistic,
+																					 n_bootstraps = 20, seed = 8)))
+
+	def test_unbounded_estimates_are_left_out_of_the_plot(self):
+		clone_df = pandas.DataFrame({"Sample": ["Singletons"] * 10 + ["Mixed"] * 13,
+									 "Clustered": [1] * 10 + self.clone_counts.tolist()})
+		plot = Diversity_Plot(clone_df, split_col = "Sample", richness_estimates = True, n_bootstraps = 10)
+		json.loads(json.dumps(json_item(plot), allow_nan = False))
+
+if __name__ == "__main__":
+	unittest.main()
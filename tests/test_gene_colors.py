@@ -0,0 +1,34 @@
+import unittest
+
+import pandas
+
+from scripts.Gene_Colors import vgene_colors, Category_Color_Array, Used_Gene_Colors, Locus_Gene_Colors
+
+class Gene_Colors_Test(unittest.TestCase):
+	def setUp(self):
+		self.light_chain_genes = ["IGKV1-{0}".format(idx) for idx in range(1, 41)]
+		self.light_chain_genes += ["IGLV2-{0}".format(idx) for idx in range(1, 21)]
+
+	def test_missing_genes_get_distinguishable_per_locus_colors(self):
+		gene_colors = Locus_Gene_Colors(self.light_chain_genes)
+		self.assertEqual(len(set(color.to_hex() for color in gene_colors.values())), 60)
+		#Colors only depend on the gene set of each locus, not on the other loci or the gene order
+		self.assertEqual(Locus_Gene_Colors(reversed(self.light_chain_genes[:40])),
+						 {gene: gene_colors[gene] for gene in self.light_chain_genes[:40]})
+
+	def test_lookups_leave_the_shared_tables_unchanged(self):
+		table_genes = dict(vgene_colors)
+		genes = pandas.Series(self.light_chain_genes + ["IGHV1-69"], dtype = "category")
+
+		colors = Category_Color_Array(genes, vgene_colors)
+		extended_colors = vgene_colors.Extended(genes.cat.categories)
+
+		self.assertEqual(dict(vgene_colors), table_genes)
+		self.assertEqual(colors[-1], vgene_colors["IGHV1-69"].to_hex())
+		self.assertEqual(len(set(colors)), len(genes))
+		#The vectorized lookup, the extended table and the section fingerprint colors all agree
+		self.assertEqual(list(colors), [extended_colors[gene].to_hex() for gene in genes])
+		self.assertEqual(Used_Gene_Colors(vgene_colors, genes), dict(zip(genes, colors)))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,73 @@
+import time
+import unittest
+import urllib.request
+
+import numpy
+import pandas
+
+from scripts.Live_Dashboard import Live_Repertoire_Dashboard
+
+def Random_Batch(rng, samples, total_clones = 300, clone_pool = 600):
+	"""Creates a batch of random clones (with overlapping clone IDs between samples) for the given samples."""
+
+	return pandas.DataFrame({
+		"Sample": rng.choice(samples, size = total_clones),
+		"CloneID": rng.integers(0, clone_pool, size = total_clones),
+		"Clustered": rng.integers(1, 50, size = total_clones),
+		"VGene": rng.choice(["IGHV1-69*01", "IGHV3-23*01", "IGKV1-39*01", "IGHV9-99*01"], size = total_clones),
+		"JGene": rng.choice(["IGHJ4*02", "IGHJ6*02", "IGKJ1*01"], size = total_clones)
+	})
+
+class Live_Dashboard_Server_Test(unittest.TestCase):
+	def setUp(self):
+		self.live = Live_Repertoire_Dashboard(min_shared = 2)
+		self.server = self.live.Serve_In_Thread(port = 0)
+
+	def tearDown(self):
+		self.live.Stop()
+
+	def Wait_For(self, condition, timeout = 10.0):
+		deadline = time.time() + timeout
+		while time.time() < deadline:
+			if condition():
+				return True
+			time.sleep(0.05)
+		return False
+
+	def test_add_batch_updates_open_sessions(self):
+		rng = numpy.random.default_rng(0)
+		#More samples than fit in an int64 bitmask
+		samples = ["S{0}".format(sample_idx) for sample_idx in range(70)]
+		self.live.Add_Batch(Random_Batch(rng, samples[:3]))
+
+		#Requesting the page opens a session, whose document is built by Make_Document
+		page = urllib.request.urlopen("http://localhost:{0}/".format(self.server.port), timeout = 10).read()
+		self.assertIn(b"bokeh", page.lower())
+		self.assertEqual(len(self.live.document_states), 1)
+		doc_state = list(self.live.document_states.values())[0]
+
+		self.live.Add_Batch(Random_Batch(rng, samples, total_clones = 3000))
+		self.assertTrue(self.Wait_For(lambda: len(doc_state["diversity_source"].data["sample"]) == len(samples)))
+
+		#Shared set counts match the sets counted directly from the merged per-sample clones
+		clone_sets = {}
+		for sample_idx, clone_counts in enumerate(self.live.sample_clone_counts):
+			for clone in clone_counts.index:
+				clone_sets.setdefault(clone, set()).add(sample_idx)
+		expected_counts = {}
+		for clone_set in clone_sets.values():
+			if len(clone_set) >= 2:
+				expected_counts[frozenset(clone_set)] = expected_counts.get(frozenset(clone_set), 0) + 1
+		shared_counts = {frozenset(self.live.set_samples[set_key]): set_count
+						 for set_key, set_count in self.live.shared_set_counts.items()}
+		self.assertEqual(shared_counts, expected_counts)
+
+		#Every sample gets its own line color and the Mosaic tiles are colored by V gene
+		self.assertEqual(len(set(map(str, doc_state["diversity_source"].data["color"]))), len(samples))
+		self.assertTrue(self.Wait_For(lambda: len(doc_state["mosaic_source"].data["CloneID"]) > 0))
+		mosaic_data = doc_state["mosaic_source"].data
+		tile_colors = dict(zip(mosaic_data["VGene"], mosaic_data["vgene_colors"]))
+		self.assertGreater(len(set(tile_colors.values())), 1)
+
+if __name__ == "__main__":
+	unittest.main()